@@ -1,11 +1,16 @@
 from flask import Flask, render_template_string, request, jsonify
 from flask_cors import CORS
-import json
 import os
 from pathlib import Path
 import subprocess
 import sys
 
+from catalog import catalog_store, library_paths
+from catalog_pages import season_episodes_response, show_response, shows_page
+from events import event_bus, sse_response
+from faststart import faststart_job, find_candidates
+from library_import import is_video, scan_show, show_name
+
 # Admin Flask app
 admin_app = Flask(__name__, template_folder='.')
 CORS(
@@ -13,84 +18,36 @@ CORS(
     resources={r"/api/*": {"origins": "*"}}
 )
 
-# Data file paths
-DATA_DIR = Path(__file__).parent.parent / 'data'
-DATA_DIR.mkdir(exist_ok=True)
-CHANNELS_FILE = DATA_DIR / 'channels.json'
-SEASONS_FILE = DATA_DIR / 'seasons.json'
 UPLOAD_DIR = Path(__file__).parent.parent / 'frontend' / 'posters'
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-DATA_DIR = Path(__file__).parent.parent / 'data'
-DATA_DIR.mkdir(exist_ok=True)
-SHOWS_FILE = DATA_DIR / 'shows.json'
-
-def get_shows():
-    if SHOWS_FILE.exists():
-        return json.load(open(SHOWS_FILE))
-    return []
-
-def save_shows(shows):
-    json.dump(shows, open(SHOWS_FILE, 'w'), indent=2)
-
-def get_channels():
-    """Load TV channels from file"""
-    if CHANNELS_FILE.exists():
-        with open(CHANNELS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_channels(channels):
-    """Save TV channels to file"""
-    with open(CHANNELS_FILE, 'w') as f:
-        json.dump(channels, f, indent=2)
-
-def get_seasons():
-    """Load VOD seasons from file"""
-    if SEASONS_FILE.exists():
-        with open(SEASONS_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-def save_seasons(seasons):
-    """Save VOD seasons to file"""
-    with open(SEASONS_FILE, 'w') as f:
-        json.dump(seasons, f, indent=2)
-
 # ==================== ADMIN ROUTES ====================
 
 @admin_app.route('/api/shows/<show_id>/seasons', methods=['POST'])
 def add_season_to_show(show_id):
-    shows = get_shows()
     data = request.get_json(force=True)
 
-    for show in shows:
-        if show["id"] == show_id:
-            show["seasons"].append({
-                "id": str(len(show["seasons"]) + 1),
-                "name": data["name"],
-                "episodes": []
-            })
-            save_shows(shows)
-            return jsonify(show), 201
-
-    return jsonify({"error": "Show not found"}), 404
+    show = catalog_store.add_show_season(show_id, data["name"])
+    if show is None:
+        return jsonify({"error": "Show not found"}), 404
+    return jsonify(show), 201
 
 @admin_app.route('/api/shows', methods=['GET'])
 def list_shows():
-    return jsonify(get_shows())
+    return shows_page()
 
-@admin_app.route('/api/shows/<show_id>', methods=['DELETE'])
-def delete_show(show_id):
-    shows = get_shows()
-    before = len(shows)
+@admin_app.route('/api/shows/<show_id>', methods=['GET'])
+def get_show(show_id):
+    return show_response(show_id)
 
-    shows = [s for s in shows if s["id"] != show_id]
+@admin_app.route('/api/shows/<show_id>/seasons/<season_id>/episodes', methods=['GET'])
+def get_show_season_episodes(show_id, season_id):
+    return season_episodes_response(show_id, season_id)
 
-    if len(shows) == before:
+@admin_app.route('/api/shows/<show_id>', methods=['DELETE'])
+def delete_show(show_id):
+    if not catalog_store.delete_show(show_id):
         return jsonify({"error": "Show not found"}), 404
-
-    save_shows(shows)
     return jsonify({"status": "deleted"}), 200
 
 @admin_app.route('/api/shows/<show_id>/seasons/<season_id>/episodes', methods=['POST'])
@@ -98,48 +55,26 @@ def add_episodes_to_show_season(show_id, season_id):
     data = request.get_json(force=True)
     folder = Path(data['folder_path'])
 
-    shows = get_shows()
-
-    for show in shows:
-        if show['id'] == show_id:
-            for season in show['seasons']:
-                if season['id'] == season_id:
-                    files = sorted([
-                        f for f in folder.iterdir()
-                        if f.suffix.lower() in ['.mp4', '.mkv', '.avi']
-                    ])
-
-                    season['episodes'] = [
-                        {
-                            'filename': f.name,
-                            'path': str(f)
-                        }
-                        for f in files
-                    ]
+    files = sorted([
+        f for f in folder.iterdir()
+        if is_video(f.name) and f.is_file()
+    ])
 
-                    save_shows(shows)
-                    return jsonify(season), 200
-
-    return jsonify({'error': 'Not found'}), 404
+    season = catalog_store.set_show_season_episodes(
+        show_id, season_id, [(f.name, str(f)) for f in files]
+    )
+    if season is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(season), 200
 
 @admin_app.route('/api/shows/<show_id>/seasons/<season_id>', methods=['DELETE'])
 def delete_season_from_show(show_id, season_id):
-    shows = get_shows()
-
-    for show in shows:
-        if show["id"] == show_id:
-            before = len(show["seasons"])
-            show["seasons"] = [
-                s for s in show["seasons"] if s["id"] != season_id
-            ]
-
-            if len(show["seasons"]) == before:
-                return jsonify({"error": "Season not found"}), 404
-
-            save_shows(shows)
-            return jsonify({"status": "deleted"}), 200
-
-    return jsonify({"error": "Show not found"}), 404
+    deleted = catalog_store.delete_show_season(show_id, season_id)
+    if deleted is None:
+        return jsonify({"error": "Show not found"}), 404
+    if not deleted:
+        return jsonify({"error": "Season not found"}), 404
+    return jsonify({"status": "deleted"}), 200
 
 
 @admin_app.route('/api/shows', methods=['POST'])
@@ -147,25 +82,61 @@ def add_show():
     name = request.form['name']
     poster = request.files.get('poster')
 
-    shows = get_shows()
-    show_id = str(len(shows) + 1)
+    show = catalog_store.add_show(name)
 
-    poster_filename = ''
     if poster:
-        poster_filename = f"{show_id}_{poster.filename}"
+        poster_filename = f"{show['id']}_{poster.filename}"
         poster.save(UPLOAD_DIR / poster_filename)
+        show = catalog_store.set_show_poster(show['id'], poster_filename)
 
-    show = {
-        "id": show_id,
-        "name": name,
-        "poster": poster_filename,
-        "seasons": []
-    }
-
-    shows.append(show)
-    save_shows(shows)
     return jsonify(show), 201
 
+@admin_app.route('/api/shows/import', methods=['POST'])
+def import_show():
+    """Add a show from a folder with a subfolder per season, in one go
+    (or, with show_id, refresh an existing show's seasons from it)"""
+    data = request.get_json(force=True)
+    root = data.get('folder_path', '')
+    if not os.path.isdir(root):
+        return jsonify({'error': 'Folder not found'}), 400
+
+    seasons = scan_show(root)
+    if not seasons:
+        return jsonify({'error': 'No video files found'}), 400
+
+    show_id = data.get('show_id')
+    show = catalog_store.import_show(data.get('name') or show_name(root), seasons, show_id)
+    if show is None:
+        return jsonify({'error': 'Show not found'}), 404
+    return jsonify(show), 200 if show_id else 201
+
+# ==================== FAST-START ====================
+
+@admin_app.route('/api/faststart/scan', methods=['POST'])
+def scan_faststart():
+    """List registered mp4s whose moov atom is at the end of the file"""
+    paths = library_paths()
+    candidates = find_candidates(paths)
+    return jsonify({'scanned': len(paths), 'candidates': candidates}), 200
+
+@admin_app.route('/api/faststart/fix', methods=['POST'])
+def fix_faststart():
+    """Rewrite every file found by a scan to fast-start, in the background"""
+    candidates = find_candidates(library_paths())
+    if not faststart_job.start(candidates):
+        return jsonify({'error': 'Already running'}), 409
+    return jsonify(faststart_job.status()), 202
+
+@admin_app.route('/api/faststart/status', methods=['GET'])
+def faststart_status():
+    return jsonify(faststart_job.status())
+
+
+@admin_app.route('/api/events', methods=['GET'])
+def events():
+    """Server-Sent Events from the admin app: fast-start progress. Catalog
+    changes are on the main app's /api/events."""
+    return sse_response(event_bus)
 
 @admin_app.route('/')
 def admin_panel():
@@ -462,6 +433,24 @@ def admin_panel():
                 </form>
             </div>
 
+            <div class="section">
+                <h2>📂 Import TV Show from Folder</h2>
+
+                <form onsubmit="importShow(event)">
+                    <div class="form-group">
+                        <label for="import-folder">Show Folder (one "Season N" folder per season)</label>
+                        <input type="text" id="import-folder" placeholder="e.g., D:\\Shows\\That '70s Show (1998)" required>
+                    </div>
+
+                    <div class="form-group">
+                        <label for="import-name">Show Name (optional)</label>
+                        <input type="text" id="import-name" placeholder="Taken from the folder name">
+                    </div>
+
+                    <button type="submit">Import Show</button>
+                </form>
+            </div>
+
             <div class="section">
                 <h2>TV Shows</h2>
                 <div id="shows-list" class="list-container"></div>
@@ -485,6 +474,26 @@ def admin_panel():
                     <button type="submit">Add Episodes</button>
                 </</form>
             </div>
+
+            <!-- Fast-start Section -->
+            <div class="section">
+                <h2>⚡ Fast-start</h2>
+                <p style="color: #a0aec0; margin-bottom: 1rem;">
+                    MP4s with their index (moov) at the end stall before playing. Scan the library and move it to the front.
+                </p>
+                <div class="item-actions">
+                    <button onclick="scanFaststart()">Scan Library</button>
+                    <button id="faststart-fix-btn" onclick="fixFaststart()" disabled>Fix Files</button>
+                </div>
+                <p id="faststart-status" style="color: #a0aec0; margin-top: 1rem;"></p>
+            </div>
+
+            <!-- Streams Section -->
+            <div class="section">
+                <h2>📡 Streams</h2>
+                <p id="streams-summary" style="color: #a0aec0; margin-bottom: 1rem;"></p>
+                <div id="streams-list" class="list-container"></div>
+            </div>
         </div>
 
         <script>
@@ -523,6 +532,7 @@ def admin_panel():
                                 <p>${channel.folder_path}</p>
                             </div>
                             <div class="item-actions">
+                                <button onclick="rescanChannel('${channel.id}')">Rescan</button>
                                 <button class="btn-delete" onclick="deleteChannel('${channel.id}')">Delete</button>
                             </div>
                         `;
@@ -534,11 +544,31 @@ def admin_panel():
             }
 
 
-            async function populateShowSelect() {
-                const res = await fetch(`${ADMIN_API}/shows`);
-                if (!res.ok) return;
+            // Every show's ID, name and seasons (without their episodes), a
+            // page at a time; the shows list and the dropdowns share it
+            async function fetchShows() {
+                const shows = [];
+                let cursor = null;
+                do {
+                    const params = new URLSearchParams({ fields: 'id,name,seasons', limit: 500 });
+                    if (cursor) params.set('cursor', cursor);
+                    const res = await fetch(`${ADMIN_API}/shows?${params}`);
+                    if (!res.ok) return null;
+                    const page = await res.json();
+                    shows.push(...page.shows);
+                    cursor = page.next_cursor;
+                } while (cursor);
+                return shows;
+            }
 
-                const shows = await res.json();
+            // One show's seasons, for the season dropdowns
+            async function fetchSeasons(showId) {
+                const res = await fetch(`${ADMIN_API}/shows/${showId}?fields=seasons`);
+                if (!res.ok) return [];
+                return (await res.json()).seasons;
+            }
+
+            function populateShowSelect(shows) {
                 const select = document.getElementById('season-show');
                 select.innerHTML = '';
 
@@ -550,11 +580,7 @@ def admin_panel():
                 });
             }
 
-            async function populateRemoveSeasonShows() {
-                const res = await fetch(`${ADMIN_API}/shows`);
-                if (!res.ok) return;
-
-                const shows = await res.json();
+            function populateRemoveSeasonShows(shows) {
                 const showSelect = document.getElementById('remove-season-show');
                 const seasonSelect = document.getElementById('remove-season-season');
 
@@ -581,15 +607,13 @@ def admin_panel():
 
                 if (!showId) return;
 
-                const res = await fetch(`${ADMIN_API}/shows`);
-                const shows = await res.json();
-                const show = shows.find(s => s.id === showId);
-                if (!show || show.seasons.length === 0) return;
+                const seasons = await fetchSeasons(showId);
+                if (seasons.length === 0) return;
 
                 seasonSelect.disabled = false;
                 seasonSelect.innerHTML = '<option value="">Select season</option>';
 
-                show.seasons.forEach(season => {
+                seasons.forEach(season => {
                     const opt = document.createElement('option');
                     opt.value = season.id;
                     opt.textContent = season.name;
@@ -627,8 +651,7 @@ def admin_panel():
 
                 if (res.ok) {
                     showMessage('Season deleted');
-                    populateRemoveSeasonShows();
-                    loadShows();
+                    refreshShows();
                 } else {
                     showMessage('Failed to delete season', 'error');
                 }
@@ -643,10 +666,7 @@ def admin_panel():
 
                 if (res.ok) {
                     showMessage('TV show deleted');
-                    loadShows();
-                    populateShowSelect();
-                    populateEpisodeShows();
-                    populateRemoveSeasonShows();
+                    refreshShows();
                 } else {
                     showMessage('Failed to delete show', 'error');
                 }
@@ -680,17 +700,41 @@ def admin_panel():
                     showMessage('Show added!');
                     nameInput.value = '';
                     posterInput.value = '';
-                    loadShows();
+                    refreshShows();
                 } else {
                     showMessage('Failed to add show', 'error');
                 }
             }
 
-            async function populateEpisodeShows() {
-                const res = await fetch(`${ADMIN_API}/shows`);
-                if (!res.ok) return;
+            async function importShow(e) {
+                e.preventDefault();
+
+                const folderInput = document.getElementById('import-folder');
+                const nameInput = document.getElementById('import-name');
+
+                const res = await fetch(`${ADMIN_API}/shows/import`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        folder_path: folderInput.value.trim(),
+                        name: nameInput.value.trim()
+                    })
+                });
 
-                const shows = await res.json();
+                if (res.ok) {
+                    const show = await res.json();
+                    const episodes = show.seasons.reduce((n, s) => n + s.episodes.length, 0);
+                    showMessage(`Imported ${show.name}: ${show.seasons.length} seasons, ${episodes} episodes`);
+                    folderInput.value = '';
+                    nameInput.value = '';
+                    refreshShows();
+                } else {
+                    const error = await res.json().catch(() => ({}));
+                    showMessage('Failed to import show: ' + (error.error || res.status), 'error');
+                }
+            }
+
+            function populateEpisodeShows(shows) {
                 const showSelect = document.getElementById('episode-show');
                 showSelect.innerHTML = '<option value="">Select show</option>';
 
@@ -706,20 +750,17 @@ def admin_panel():
                 const showId = e.target.value;
                 const seasonSelect = document.getElementById('episode-season');
                 seasonSelect.innerHTML = '';
+                if (!showId) return;
 
-                const res = await fetch(`${ADMIN_API}/shows`);
-                const shows = await res.json();
-                const show = shows.find(s => s.id === showId);
-                if (!show) return;
-
-                show.seasons.forEach(season => {
+                const seasons = await fetchSeasons(showId);
+                seasons.forEach(season => {
                     const opt = document.createElement('option');
                     opt.value = season.id;
                     opt.textContent = season.name;
                     seasonSelect.appendChild(opt);
                 });
 
-                if (show.seasons.length === 0) {
+                if (seasons.length === 0) {
                     seasonSelect.innerHTML = '<option value="">No seasons yet - add one above</option>';
                 }
             });
@@ -763,11 +804,105 @@ def admin_panel():
                 }
             }
 
-            async function loadShows() {
-                const res = await fetch(`${ADMIN_API}/shows`);
+            async function rescanChannel(channelId) {
+                try {
+                    const response = await fetch(`${MAIN_API}/channels/${channelId}/rescan`, { method: 'POST' });
+                    if (response.ok) {
+                        const result = await response.json();
+                        showMessage(`Rescanned: ${result.episodes} episodes`);
+                    } else {
+                        showMessage('Error rescanning channel', 'error');
+                    }
+                } catch (error) {
+                    showMessage('Error: ' + error.message, 'error');
+                }
+            }
+
+            async function scanFaststart() {
+                const status = document.getElementById('faststart-status');
+                status.textContent = 'Scanning...';
+                const res = await fetch(`${ADMIN_API}/faststart/scan`, { method: 'POST' });
+                if (!res.ok) {
+                    status.textContent = 'Scan failed';
+                    return;
+                }
+                const result = await res.json();
+                status.textContent = `${result.candidates.length} of ${result.scanned} files need fast-start`;
+                document.getElementById('faststart-fix-btn').disabled = result.candidates.length === 0;
+            }
+
+            async function fixFaststart() {
+                document.getElementById('faststart-fix-btn').disabled = true;
+                const res = await fetch(`${ADMIN_API}/faststart/fix`, { method: 'POST' });
+                if (!res.ok) {
+                    showMessage('Fast-start fix is already running', 'error');
+                }
+                pollFaststart();
+            }
+
+            async function pollFaststart() {
+                const res = await fetch(`${ADMIN_API}/faststart/status`);
+                renderFaststart(await res.json());
+            }
+
+            // Progress after that comes in as 'faststart' events
+            function renderFaststart(job) {
+                const failed = job.failed.length ? `, ${job.failed.length} failed` : '';
+                document.getElementById('faststart-status').textContent =
+                    `${job.running ? 'Fixing' : 'Fixed'} ${job.done} of ${job.total} files${failed}`;
+            }
+
+            function mbps(bps) {
+                return `${(bps / 1e6).toFixed(1)} Mbit/s`;
+            }
+
+            // Rates are only refreshed while something is streaming; the
+            // first stream starting is announced by a 'streams' event
+            let streamsTimer = null;
+
+            async function loadStreams() {
+                const res = await fetch(`${MAIN_API}/stats/streams`);
                 if (!res.ok) return;
 
-                const shows = await res.json();
+                const stats = await res.json();
+                if (stats.streams.length && !streamsTimer) {
+                    streamsTimer = setInterval(loadStreams, 5000);
+                } else if (!stats.streams.length && streamsTimer) {
+                    clearInterval(streamsTimer);
+                    streamsTimer = null;
+                }
+                if (!stats.client_cap_bps && !stats.total_cap_bps) {
+                    // Without caps streams go out untouched and aren't tracked
+                    document.getElementById('streams-summary').textContent =
+                        'No bandwidth caps set (SHAPE_CLIENT_MBPS, SHAPE_TOTAL_MBPS), so streams are not listed';
+                    document.getElementById('streams-list').innerHTML = '';
+                    return;
+                }
+                const caps = [
+                    stats.client_cap_bps ? `${mbps(stats.client_cap_bps)} per client` : 'no cap per client',
+                    stats.total_cap_bps ? `${mbps(stats.total_cap_bps)} total` : 'no total cap'
+                ];
+                document.getElementById('streams-summary').textContent =
+                    `${stats.streams.length} streams, ${mbps(stats.total_rate_bps)} (${caps.join(', ')})`;
+
+                const container = document.getElementById('streams-list');
+                container.innerHTML = '';
+                stats.streams.forEach(stream => {
+                    const state = stream.interactive ? 'starting' : stream.held_seconds > 0
+                        ? `held ${stream.held_seconds.toFixed(2)}s` : 'streaming';
+                    const item = document.createElement('div');
+                    item.className = 'item';
+                    item.innerHTML = `
+                        <div class="item-info">
+                            <h3>${stream.file}</h3>
+                            <p>${stream.client} · ${mbps(stream.rate_bps)} · ${(stream.sent_bytes / 2 ** 20).toFixed(0)} MB in ${stream.seconds}s · ${state}</p>
+                        </div>
+                    `;
+                    container.appendChild(item);
+                });
+            }
+
+            function renderShows(shows) {
                 const container = document.getElementById('shows-list');
                 container.innerHTML = '';
 
@@ -827,8 +962,7 @@ def admin_panel():
                 if (res.ok) {
                     showMessage('Season added!');
                     document.getElementById('season-name').value = '';
-                    loadShows();
-                    populateShowSelect();
+                    refreshShows();
                 } else {
                     showMessage('Failed to add season', 'error');
                 }
@@ -861,7 +995,7 @@ def admin_panel():
                     if (response.ok) {
                         showMessage('Episodes added successfully!');
                         document.getElementById('episode-folder').value = '';
-                        loadShows(); // refresh counts
+                        refreshShows(); // refresh counts
                     } else {
                         const txt = await response.text();
                         showMessage('Error adding episodes: ' + txt, 'error');
@@ -875,15 +1009,35 @@ def admin_panel():
             // Load initial data
             document.addEventListener('DOMContentLoaded', () => {
                 loadChannels();
-                loadShows();
-                populateShowSelect();
-                populateEpisodeShows();
-                populateRemoveSeasonShows();
-                // Refresh every 5 seconds
-                setInterval(() => {
-                    loadChannels();
-                }, 5000);
+                refreshShows();
+                loadStreams();
+                subscribeToEvents();
             });
+
+            async function refreshShows() {
+                const shows = await fetchShows();
+                if (!shows) return;
+                renderShows(shows);
+                populateShowSelect(shows);
+                populateEpisodeShows(shows);
+                populateRemoveSeasonShows(shows);
+            }
+
+            // Changes are pushed by the servers instead of polled for
+            function subscribeToEvents() {
+                const main = new EventSource(`${MAIN_API}/events`);
+                main.addEventListener('channels', loadChannels);
+                main.addEventListener('shows', refreshShows);
+                main.addEventListener('streams', loadStreams);
+                main.addEventListener('reset', () => {
+                    loadChannels();
+                    refreshShows();
+                    loadStreams();
+                });
+
+                const admin = new EventSource(`${ADMIN_API}/events`);
+                admin.addEventListener('faststart', e => renderFaststart(JSON.parse(e.data)));
+            }
         </script>
     </body>
     </html>
@@ -891,4 +1045,6 @@ def admin_panel():
     return render_template_string(html)
 
 if __name__ == '__main__':
-    admin_app.run(debug=True, host='0.0.0.0', port=5001)
+    # Same as `python serve.py admin`
+    import serve
+    sys.exit(serve.main(['admin', *sys.argv[1:]]))
@@ -1,10 +1,30 @@
-from flask import Flask, jsonify, request, send_from_directory, send_file
+from flask import Flask, Response, jsonify, request, send_from_directory, send_file
 from flask_cors import CORS
-import json
 import os
+import sys
+import time
 from pathlib import Path
 import mimetypes
 
+from streaming import file_etag, if_range_matches, parse_range, send_range, range_not_satisfiable
+from block_cache import block_cache
+from fd_pool import file_pool
+from shaping import shaper
+from readahead import readahead
+from catalog import catalog_store, channels_catalog, seasons_catalog
+from catalog_records import media_id
+from http_cache import cache_policy, conditional
+from media_table import media_table
+from folder_index import folder_index
+from library_watch import library_watcher
+from catalog_events import catalog_monitor
+from catalog_pages import season_episodes_response, show_response, shows_page
+from events import event_bus, sse_response
+from schedule import get_timeline, MAX_SCHEDULE_HOURS
+from hls import hls_packager, HlsError
+from media_probe import media_cache
+from transcode import ffmpeg_available, transcoder, needs_transcode
+
 # make sure MIME supports subtitles
 mimetypes.add_type('text/vtt', '.vtt')
 mimetypes.add_type('application/x-subrip', '.srt')
@@ -19,54 +39,53 @@ CORS(
     }
 )
 
-# Data file paths
-DATA_DIR = Path(__file__).parent.parent / 'data'
-DATA_DIR.mkdir(exist_ok=True)
-CHANNELS_FILE = DATA_DIR / 'channels.json'
-SEASONS_FILE = DATA_DIR / 'seasons.json'
-
-def get_channels():
-    """Load TV channels from file"""
-    if CHANNELS_FILE.exists():
-        with open(CHANNELS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_channels(channels):
-    """Save TV channels to file"""
-    with open(CHANNELS_FILE, 'w') as f:
-        json.dump(channels, f, indent=2)
-
-def get_seasons():
-    """Load VOD seasons from file"""
-    if SEASONS_FILE.exists():
-        with open(SEASONS_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-def save_seasons(seasons):
-    """Save VOD seasons to file"""
-    with open(SEASONS_FILE, 'w') as f:
-        json.dump(seasons, f, indent=2)
+@app.before_request
+def start_library_watcher():
+    """The watcher runs in whichever process serves requests (each worker,
+    under gunicorn), started by the first one"""
+    library_watcher.ensure_running()
 
 def get_files_in_folder(folder_path):
     """Get media files from a folder"""
-    video_extensions = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm'}
-    try:
-        files = [f for f in sorted(os.listdir(folder_path)) 
-                if os.path.isfile(os.path.join(folder_path, f)) 
-                and Path(f).suffix.lower() in video_extensions]
-        return files
-    except:
-        return []
+    return list(folder_index.files(folder_path))
+
+def airing_paths():
+    """What every channel is airing now and next"""
+    paths = []
+    for channel in channels_catalog.data.values():
+        timeline = get_timeline(channel['folder_path'])
+        if timeline is not None:
+            index, _ = timeline.locate(time.time())
+            paths.append(timeline.episode(index)['path'])
+            paths.append(timeline.episode((index + 1) % len(timeline.files))['path'])
+    return paths
+
+# Keep converted copies of those in the transcode cache whatever its size
+transcoder.airing = airing_paths
+
+def next_on_channel(path):
+    """The file served after path on the channel that airs it, or None"""
+    folder, filename = os.path.split(os.path.normpath(path))
+    if not any(os.path.normpath(c['folder_path']) == folder for c in channels_catalog.data.values()):
+        return None
+    files = folder_index.files(folder)
+    if filename not in files:
+        return None
+    upcoming = os.path.join(folder, files[(files.index(filename) + 1) % len(files)])
+    if needs_transcode(media_cache.get(upcoming)):
+        # Whatever the player will get instead; the transcoder is already
+        # converting the next episode if it isn't there yet
+        return transcoder.cached(upcoming)
+    return upcoming
+
+readahead.next_episode = next_on_channel
 
 # ==================== TV CHANNELS ROUTES ====================
 
 @app.route('/api/channels', methods=['GET'])
 def list_channels():
     """Get all TV channels"""
-    channels = get_channels()
-    return jsonify(channels)
+    return conditional(channels_catalog.response(), 'channels')
 
 @app.route('/api/channels', methods=['POST'])
 def add_channel():
@@ -78,25 +97,13 @@ def add_channel():
     if not os.path.isdir(folder_path):
         return jsonify({'error': 'Folder does not exist'}), 400
     
-    channels = get_channels()
-    channel_id = str(len(channels) + 1)
-    
-    channels[channel_id] = {
-        'id': channel_id,
-        'name': channel_name,
-        'folder_path': folder_path
-    }
-    
-    save_channels(channels)
-    return jsonify(channels[channel_id]), 201
+    channel = catalog_store.add_channel(channel_name, folder_path)
+    return jsonify(channel), 201
 
 @app.route('/api/channels/<channel_id>', methods=['DELETE'])
 def delete_channel(channel_id):
     """Delete a TV channel"""
-    channels = get_channels()
-    if channel_id in channels:
-        del channels[channel_id]
-        save_channels(channels)
+    if catalog_store.delete_channel(channel_id):
         return jsonify({'status': 'deleted'}), 200
     return jsonify({'error': 'Channel not found'}), 404
 
@@ -104,24 +111,77 @@ def delete_channel(channel_id):
 @app.route('/api/channels/<channel_id>/episodes', methods=['GET'])
 def get_channel_episodes(channel_id):
     """Get all episodes/files in a channel"""
-    channels = get_channels()
+    channels = channels_catalog.data
     if channel_id not in channels:
         return jsonify({'error': 'Channel not found'}), 404
     
     folder_path = channels[channel_id]['folder_path']
     files = get_files_in_folder(folder_path)
     
-    episodes = [{'index': i, 'filename': f, 'path': os.path.join(folder_path, f)} 
-                for i, f in enumerate(files)]
-    return jsonify(episodes), 200
+    episodes = []
+    for i, f in enumerate(files):
+        path = os.path.join(folder_path, f)
+        episodes.append({'index': i, 'filename': f, 'path': path, 'media_id': media_id(path)})
+    return conditional(jsonify(episodes), 'channel_episodes')
+
+@app.route('/api/channels/<channel_id>/now', methods=['GET'])
+def channel_now(channel_id):
+    """What a channel is airing right now, and how far into it"""
+    channels = channels_catalog.data
+    if channel_id not in channels:
+        return jsonify({'error': 'Channel not found'}), 404
+
+    timeline = get_timeline(channels[channel_id]['folder_path'])
+    if timeline is None:
+        return jsonify({'error': 'No episodes found'}), 404
+
+    now = timeline.now()
+    # Get a browser-playable copy of the next episode going before the
+    # player asks for it. Not this one: the player is about to fall back to
+    # HLS for it, and converting it as well would do the work twice.
+    upcoming = timeline.episode((now['index'] + 1) % now['count'])
+    transcoder.prepare([upcoming['path']])
+    return jsonify(now), 200
+
+@app.route('/api/channels/<channel_id>/schedule', methods=['GET'])
+def channel_schedule(channel_id):
+    """EPG-style list of what airs on a channel over the next few hours"""
+    channels = channels_catalog.data
+    if channel_id not in channels:
+        return jsonify({'error': 'Channel not found'}), 404
+
+    timeline = get_timeline(channels[channel_id]['folder_path'])
+    if timeline is None:
+        return jsonify({'error': 'No episodes found'}), 404
+
+    hours = request.args.get('hours', 6, type=float)
+    hours = max(0, min(hours, MAX_SCHEDULE_HOURS))
+    return jsonify(timeline.schedule(time.time(), hours)), 200
+
+@app.route('/api/channels/rescan', methods=['POST'])
+def rescan_all_channels():
+    """Drop every cached folder listing"""
+    folder_index.rescan()
+    return jsonify({'status': 'rescanned'}), 200
+
+@app.route('/api/channels/<channel_id>/rescan', methods=['POST'])
+def rescan_channel(channel_id):
+    """Force a fresh listing of a channel's folder"""
+    channels = channels_catalog.data
+    if channel_id not in channels:
+        return jsonify({'error': 'Channel not found'}), 404
+
+    folder_path = channels[channel_id]['folder_path']
+    folder_index.rescan(folder_path)
+    files = get_files_in_folder(folder_path)
+    return jsonify({'status': 'rescanned', 'episodes': len(files)}), 200
 
 # ==================== VOD ROUTES ====================
 
 @app.route('/api/seasons', methods=['GET'])
 def list_seasons():
     """Get all VOD seasons"""
-    seasons = get_seasons()
-    return jsonify(seasons)
+    return conditional(seasons_catalog.response(), 'seasons')
 
 @app.route('/api/seasons', methods=['POST'])
 def add_season():
@@ -129,25 +189,14 @@ def add_season():
     data = request.json
     season_name = data.get('name', 'Season 1')
     
-    seasons = get_seasons()
-    season_id = str(len(seasons) + 1)
-    
-    new_season = {
-        'id': season_id,
-        'name': season_name,
-        'episodes': []
-    }
-    
-    seasons.append(new_season)
-    save_seasons(seasons)
+    new_season = catalog_store.add_season(season_name)
     return jsonify(new_season), 201
 
 @app.route('/api/seasons/<season_id>', methods=['DELETE'])
 def delete_season(season_id):
     """Delete a VOD season"""
-    seasons = get_seasons()
-    seasons = [s for s in seasons if s['id'] != season_id]
-    save_seasons(seasons)
+    if not catalog_store.delete_season(season_id):
+        return jsonify({'error': 'Season not found'}), 404
     return jsonify({'status': 'deleted'}), 200
 
 @app.route('/api/seasons/<season_id>/episodes', methods=['POST'])
@@ -159,96 +208,209 @@ def add_episodes_to_season(season_id):
     if not os.path.isdir(folder_path):
         return jsonify({'error': 'Folder does not exist'}), 400
     
-    seasons = get_seasons()
-    season = next((s for s in seasons if s['id'] == season_id), None)
+    files = get_files_in_folder(folder_path)
+    season = catalog_store.add_season_episodes(
+        season_id, [(filename, os.path.join(folder_path, filename)) for filename in files]
+    )
     
     if not season:
         return jsonify({'error': 'Season not found'}), 404
-    
-    files = get_files_in_folder(folder_path)
-    episode_id = len(season['episodes'])
-    
-    for filename in files:
-        episode_id += 1
-        season['episodes'].append({
-            'id': str(episode_id),
-            'filename': filename,
-            'path': os.path.join(folder_path, filename)
-        })
-    
-    save_seasons(seasons)
     return jsonify(season), 200
 
-SHOWS_FILE = DATA_DIR / 'shows.json'
+# ==================== MEDIA SERVING ====================
 
+@app.route('/api/shows', methods=['GET'])
+def list_shows_main():
+    return shows_page()
 
-def get_shows():
-    if SHOWS_FILE.exists():
-        return json.load(open(SHOWS_FILE))
-    return []
+@app.route('/api/shows/<show_id>', methods=['GET'])
+def get_show(show_id):
+    return show_response(show_id)
 
-def save_shows(shows):
-    json.dump(shows, open(SHOWS_FILE, 'w'), indent=2)
+@app.route('/api/shows/<show_id>/seasons/<season_id>/episodes', methods=['GET'])
+def get_show_season_episodes(show_id, season_id):
+    return season_episodes_response(show_id, season_id)
 
-# ==================== MEDIA SERVING ====================
+# Sidecar subtitle files next to an episode, per language
+SUBTITLE_SUFFIXES = {'he': '.vtt', 'en': '.en.vtt'}
 
-@app.route('/api/shows', methods=['GET'])
-def list_shows_main():
-    if SHOWS_FILE.exists():
-        return jsonify(json.load(open(SHOWS_FILE)))
-    return jsonify([])
-
-@app.route('/api/video/<path:video_path>', methods=['GET'])
-def serve_video(video_path):
-    from urllib.parse import unquote
-    video_path = unquote(video_path)
-
-    """Serve video files with streaming support"""
-    # Decode the path
-    video_path = video_path.replace('__SLASH__', '/')
-    
-    # Security check - ensure the file exists and is accessible
-    if not os.path.exists(video_path):
+@app.route('/api/media/<media_id>', methods=['GET'])
+def serve_media(media_id):
+    """Serve an episode by its media_id, with streaming support"""
+    found = media_table.resolve(media_id)
+    if found is None:
         return jsonify({'error': 'File not found'}), 404
-    
+    video_path, st = found
+    episode = video_path
+
+    # Browsers can't play it as it is (mkv, avi, HEVC...): serve the
+    # converted copy if there is one. Otherwise the file goes out as it is
+    # and a player that can't decode it switches to HLS, unless it asked
+    # with ?converted=1 to wait for a conversion (202 with its progress).
+    # Without ffmpeg, or if the conversion failed, that's the file as it is.
+    if Path(video_path).suffix.lower() in folder_index.extensions:
+        info = media_cache.get(video_path, st)
+        if needs_transcode(info):
+            try:
+                if request.args.get('converted') and ffmpeg_available():
+                    converted, job = transcoder.request(video_path, info, st)
+                    if converted is None and job['status'] != 'failed':
+                        response = jsonify(job)
+                        response.headers['Retry-After'] = '5'
+                        return response, 202
+                else:
+                    converted = transcoder.converted(video_path, st)
+                if converted is not None:
+                    try:
+                        st = os.stat(converted)
+                        video_path = str(converted)
+                    except OSError:
+                        # Evicted by another process since
+                        pass
+            except OSError:
+                return jsonify({'error': 'Error reading file'}), 500
+
+    return send_media(video_path, st, episode)
+
+@app.route('/api/media/<media_id>/subtitles/<lang>', methods=['GET'])
+def serve_subtitles(media_id, lang):
+    """An episode's subtitles: the .vtt (he) or .en.vtt (en) beside it"""
+    found = media_table.resolve(media_id)
+    if found is None or lang not in SUBTITLE_SUFFIXES:
+        return jsonify({'error': 'File not found'}), 404
+    subtitle_path = os.path.splitext(found[0])[0] + SUBTITLE_SUFFIXES[lang]
+    try:
+        st = os.stat(subtitle_path)
+    except OSError:
+        return jsonify({'error': 'File not found'}), 404
+    return send_media(subtitle_path, st)
+
+def send_media(path, st, episode=None):
+    """Range or whole-file response for path, a file we have already stat'ed"""
     # Get range request support
     range_header = request.headers.get('Range')
-    
+    mime, _ = mimetypes.guess_type(path)
+
     try:
-        file_size = os.path.getsize(video_path)
-        
-        if range_header:
-            # Parse range header
-            range_match = range_header.replace('bytes=', '').split('-')
-            start = int(range_match[0]) if range_match[0] else 0
-            end = int(range_match[1]) if range_match[1] else file_size - 1
-            
-            if start > file_size or end > file_size:
-                return 'Requested range not satisfiable', 416
-            
-            with open(video_path, 'rb') as f:
-                f.seek(start)
-                chunk = f.read(end - start + 1)
-            
-            mime, _ = mimetypes.guess_type(video_path)
-            mime = mime or 'application/octet-stream'
-            
-            return chunk, 206, {
-                'Content-Range': f'bytes {start}-{end}/{file_size}',
-                'Accept-Ranges': 'bytes',
-                'Content-Length': len(chunk),
-                'Content-Type': mime,
-
-                # ✅ REQUIRED FOR LAN VIDEO
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Range',
-                'Access-Control-Expose-Headers': 'Content-Range, Accept-Ranges'
-            }
+        # A range of some other version of the file is no use: send it all
+        if range_header and if_range_matches(st):
+            file_size = st.st_size
+            byte_range = parse_range(range_header, file_size)
+            if byte_range is None:
+                return range_not_satisfiable(file_size)
+
+            # Streamed in bounded chunks, so 'bytes=0-' on a 2 GB episode
+            # never ends up in memory
+            start, end = byte_range
+            response = send_range(path, st, start, end, mime or 'application/octet-stream', episode)
+            # The URL names the episode, not a path, so it can be cached
+            response.headers['Cache-Control'] = cache_policy('media')
+            return response
         else:
-            return send_file(video_path, mimetype='video/mp4'), 200
-    except:
+            # Subtitles come through here too, so use the real type. send_file
+            # sets Last-Modified and our ETag; don't force a 200 over its 304.
+            response = send_file(path, mimetype=mime or 'video/mp4', etag=file_etag(st))
+            return conditional(response, 'media')
+    except OSError:
         return jsonify({'error': 'Error reading file'}), 500
 
+def resolve_path(media_id):
+    """Catalog path of a media_id whose file is there, or None"""
+    found = media_table.resolve(media_id)
+    return found[0] if found else None
+
+@app.route('/api/media/<media_id>/hls/index.m3u8', methods=['GET'])
+def hls_playlist(media_id):
+    """HLS playlist for a video; its segments are made on demand"""
+    video_path = resolve_path(media_id)
+    if video_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    try:
+        plan = hls_packager.plan(video_path)
+    except (OSError, HlsError) as e:
+        return jsonify({'error': str(e)}), 415
+
+    response = Response(plan.playlist(), mimetype='application/vnd.apple.mpegurl')
+    return conditional(response, 'hls_playlist')
+
+@app.route('/api/media/<media_id>/hls/<int:segment>.ts', methods=['GET'])
+def hls_segment(media_id, segment):
+    """One MPEG-TS segment: stream-copied on keyframes or transcoded"""
+    video_path = resolve_path(media_id)
+    if video_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    try:
+        plan = hls_packager.plan(video_path)
+        if segment >= len(plan):
+            return jsonify({'error': 'Segment not found'}), 404
+        segment_path = hls_packager.segment(plan, segment)
+    except (OSError, HlsError) as e:
+        return jsonify({'error': str(e)}), 500
+
+    return conditional(send_file(segment_path, mimetype='video/mp2t'), 'hls_segment')
+
+@app.route('/api/transcode', methods=['GET'])
+def transcode_status():
+    """Conversions queued, running or failed, and the cache they fill"""
+    return jsonify({'jobs': transcoder.jobs(), 'cache': transcoder.cache.stats()})
+
+@app.route('/api/media/<media_id>/transcode', methods=['GET', 'POST'])
+def transcode_file(media_id):
+    """Progress of one file's conversion; POST starts it (or retries it)"""
+    video_path = resolve_path(media_id)
+    if video_path is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    info = media_cache.get(video_path)
+    if not needs_transcode(info):
+        return jsonify({'path': video_path, 'status': 'not_needed'}), 200
+
+    if request.method == 'POST':
+        transcoder.retry(video_path)
+        transcoder.request(video_path, info)
+    return jsonify(transcoder.status(video_path)), 200
+
+@app.route('/api/stats/cache', methods=['GET'])
+def block_cache_stats():
+    """Hit/miss/eviction counters for sizing the shared block cache"""
+    return jsonify(block_cache.stats())
+
+@app.route('/api/stats/files', methods=['GET'])
+def file_pool_stats():
+    """Open media file handles and how often a range request reused one"""
+    return jsonify(file_pool.stats())
+
+@app.route('/api/stats/streams', methods=['GET'])
+def stream_stats():
+    """Every video stream in flight with its current rate, for the admin panel"""
+    return jsonify(shaper.stats())
+
+@app.route('/api/stats/readahead', methods=['GET'])
+def readahead_stats():
+    """Next-episode warming, and how fast episodes start with and without it"""
+    return jsonify(readahead.stats())
+
+@app.route('/api/stats/hls', methods=['GET'])
+def hls_cache_stats():
+    """Segment cache usage and counters"""
+    return jsonify(hls_packager.stats())
+
+@app.route('/api/stats/watch', methods=['GET'])
+def library_watch_stats():
+    """Folders watched for new, removed and renamed episodes"""
+    return jsonify(library_watcher.stats())
+
+# ==================== EVENTS ====================
+
+@app.route('/api/events', methods=['GET'])
+def events():
+    """Server-Sent Events: catalog changes (from this app or the admin app),
+    library changes the watcher found, transcode progress and streams
+    starting and stopping, as they happen"""
+    return sse_response(event_bus, monitor=catalog_monitor)
+
 # ==================== FRONTEND ROUTES ====================
 
 @app.route('/')
@@ -262,4 +424,6 @@ def not_found(e):
     return send_from_directory('../frontend', 'index.html')
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Same as `python serve.py`: the async runtime, not Flask's dev server
+    import serve
+    sys.exit(serve.main(['main', *sys.argv[1:]]))
@@ -0,0 +1,359 @@
+"""asyncio HTTP/1.1 server for the Flask apps, built for long video streams.
+
+Requests still go through Flask on a thread pool, so every route behaves
+exactly as it does under any other server. What changes is the response
+body: it is pulled from the app one chunk at a time on a second, small
+pool and written with non-blocking sends, and the next chunk is only read
+once the client has taken the last one. A viewer on a slow link or a
+paused player costs a socket and a few dozen KiB of buffer, not a thread,
+so one process keeps hundreds of streams going. A file the app hands back
+through wsgi.file_wrapper is sent with sendfile() on the event loop.
+"""
+import asyncio
+import io
+import os
+import signal
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import unquote_to_bytes
+
+# ===== CONFIG =====
+# Threads running route handlers; a stream only holds one while its
+# response starts
+APP_THREADS = int(os.environ.get('ASYNC_APP_THREADS', 32))
+# Threads reading response bodies from disk (or the block cache)
+IO_THREADS = int(os.environ.get('ASYNC_IO_THREADS', 16))
+# Bytes handed to a socket at once; the next piece waits until the client
+# has taken it, which is all a slow client can make us buffer
+WRITE_SIZE = 64 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# ==================
+
+
+class Pacer:
+    """Put in the environ so the app can ask for a pause before its next
+    chunk is written (see shaping.py), instead of sleeping on an I/O thread.
+
+    wake_on, if the app sets it along with delay, may end the pause early:
+    it is called with a function that does (from any thread) and returns
+    one that cancels it (see events.py).
+    """
+
+    __slots__ = ('delay', 'wake_on')
+
+    def __init__(self):
+        self.delay = 0.0
+        self.wake_on = None
+
+
+class FileWrapper:
+    """wsgi.file_wrapper: a file to be sent from where it is positioned,
+    for Content-Length bytes; iterable like any body where sendfile() is
+    no use"""
+
+    def __init__(self, filelike, block_size=WRITE_SIZE):
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.block_size)
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self):
+        close = getattr(self.filelike, 'close', None)
+        if close is not None:
+            close()
+
+
+class AsyncServer:
+    """Serves one WSGI app; see the module docstring"""
+
+    def __init__(self, app, keepalive=75, max_connections=1000, graceful_timeout=30,
+                 app_threads=APP_THREADS, io_threads=IO_THREADS):
+        self.app = app
+        self.keepalive = keepalive
+        self.max_connections = max_connections
+        self.graceful_timeout = graceful_timeout
+        self.connections = 0
+        self.active = 0
+        self._app_pool = ThreadPoolExecutor(app_threads, thread_name_prefix='async-app')
+        self._io_pool = ThreadPoolExecutor(io_threads, thread_name_prefix='async-io')
+        self._host = self._port = None
+
+    # ----- connections -----
+
+    async def _connection(self, reader, writer):
+        self.connections += 1
+        writer.transport.set_write_buffer_limits(high=WRITE_SIZE)
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            if self.connections > self.max_connections:
+                await self._simple(writer, '503 Service Unavailable')
+                return
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    # Idle keep-alive timed out, or the client went away
+                    return
+                except (ValueError, asyncio.LimitOverrunError):
+                    await self._simple(writer, '400 Bad Request')
+                    return
+                keep_alive = await self._respond(request, reader, writer, peer)
+        except OSError:
+            # Reset or closed by the client mid-response
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _read_request(self, reader):
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive)
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ', 2)
+        if not version.startswith('HTTP/1.'):
+            raise ValueError(version)
+        headers = []
+        for line in lines[1:]:
+            if line:
+                name, sep, value = line.partition(':')
+                if not sep:
+                    raise ValueError(line)
+                headers.append((name.strip(), value.strip()))
+        return method, target, version, headers
+
+    async def _simple(self, writer, status):
+        body = status.encode('latin-1')
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+
+    # ----- requests -----
+
+    async def _respond(self, request, reader, writer, peer):
+        """Answer one request; returns whether the connection stays open"""
+        method, target, version, headers = request
+        fields = {name.lower(): value for name, value in headers}
+        connection = fields.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = 'keep-alive' in connection
+        else:
+            keep_alive = 'close' not in connection
+
+        if 'transfer-encoding' in fields:
+            # Browsers never send chunked request bodies
+            await self._simple(writer, '411 Length Required')
+            return False
+        try:
+            length = int(fields.get('content-length', 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_BYTES:
+            await self._simple(writer, '413 Content Too Large')
+            return False
+        body = b''
+        if length:
+            if fields.get('expect', '').lower() == '100-continue':
+                writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            body = await asyncio.wait_for(reader.readexactly(length), self.keepalive)
+
+        environ = self._environ(method, target, version, headers, body, peer)
+        pacer = environ['async_server.pacer'] = Pacer()
+        loop = asyncio.get_running_loop()
+        self.active += 1
+        try:
+            status, response_headers, result, chunks, first = await loop.run_in_executor(
+                self._app_pool, self._start, environ
+            )
+            try:
+                return await self._send(
+                    loop, writer, method, status, response_headers, result, chunks, first,
+                    keep_alive, pacer
+                )
+            finally:
+                close = getattr(result, 'close', None)
+                if close is not None:
+                    await loop.run_in_executor(self._io_pool, close)
+        finally:
+            self.active -= 1
+
+    def _environ(self, method, target, version, headers, body, peer):
+        path, _, query = target.partition('?')
+        if '://' in path:
+            # Absolute form, as sent to proxies
+            path = '/' + path.split('://', 1)[1].partition('/')[2]
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            # Raw bytes as latin-1, per PEP 3333; Werkzeug decodes the UTF-8
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'REQUEST_URI': target,
+            'SERVER_NAME': self._host,
+            'SERVER_PORT': str(self._port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': str(peer[0]),
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+        }
+        for name, value in headers:
+            if '_' in name:
+                # Could pass for a hyphenated header once mapped to HTTP_*
+                continue
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def _start(self, environ):
+        """Run the app up to its first chunk of body; on an app thread"""
+        response = []
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [status, headers]
+            return written.append
+
+        try:
+            result = self.app(environ, start_response)
+            if isinstance(result, FileWrapper):
+                # Not read here: _send hands the file to sendfile()
+                return response[0], response[1], result, result, b''.join(written)
+            chunks = iter(result)
+            first = next(chunks, None)
+        except Exception:
+            traceback.print_exc()
+            body = b'Internal Server Error'
+            return ('500 Internal Server Error',
+                    [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))],
+                    None, iter(()), body)
+        if written:
+            first = b''.join(written) + (first or b'')
+        return response[0], response[1], result, chunks, first
+
+    async def _send(self, loop, writer, method, status, headers, result, chunks, first,
+                    keep_alive, pacer):
+        names = {name.lower() for name, _ in headers}
+        code = int(status[:3])
+        bodyless = method == 'HEAD' or code in (204, 304) or code < 200
+        chunked = not bodyless and 'content-length' not in names
+        keep_alive = keep_alive and 'close' not in dict(
+            (name.lower(), value.lower()) for name, value in headers
+        ).get('connection', '')
+
+        lines = [f'HTTP/1.1 {status}']
+        lines += [f'{name}: {value}' for name, value in headers if name.lower() != 'connection']
+        if 'date' not in names:
+            lines.append(f'Date: {formatdate(usegmt=True)}')
+        if chunked:
+            lines.append('Transfer-Encoding: chunked')
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        if isinstance(result, FileWrapper) and not bodyless and not chunked:
+            if first:
+                await self._write(writer, first, False)
+            await self._sendfile(loop, writer, result, int(dict(
+                (name.lower(), value) for name, value in headers
+            )['content-length']) - len(first))
+            return keep_alive
+
+        chunk = first
+        while chunk is not None and not bodyless:
+            if pacer.delay:
+                await self._pause(loop, pacer)
+            if chunk:
+                await self._write(writer, chunk, chunked)
+            # Only read on once the client has taken the last chunk
+            chunk = await loop.run_in_executor(self._io_pool, next, chunks, None)
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive
+
+    async def _pause(self, loop, pacer):
+        delay, pacer.delay = pacer.delay, 0.0
+        wake_on, pacer.wake_on = pacer.wake_on, None
+        if wake_on is None:
+            await asyncio.sleep(delay)
+            return
+        woken = asyncio.Event()
+        cancel = wake_on(lambda: loop.call_soon_threadsafe(woken.set))
+        try:
+            await asyncio.wait_for(woken.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            cancel()
+
+    async def _sendfile(self, loop, writer, wrapper, count):
+        f = wrapper.filelike
+        offset = await loop.run_in_executor(self._io_pool, f.tell)
+        # Kernel to socket where it can; read and written in pieces where it
+        # can't (Windows, a file-like object with no fileno)
+        await loop.sendfile(writer.transport, f, offset, count)
+        await writer.drain()
+
+    async def _write(self, writer, data, chunked):
+        if chunked:
+            writer.write(b'%x\r\n' % len(data))
+        view = memoryview(data)
+        for offset in range(0, len(view), WRITE_SIZE):
+            writer.write(view[offset:offset + WRITE_SIZE])
+            await writer.drain()
+        if chunked:
+            writer.write(b'\r\n')
+
+    # ----- running -----
+
+    async def run(self, host, port):
+        self._host, self._port = host, port
+        server = await asyncio.start_server(
+            self._connection, host, port, limit=MAX_HEADER_BYTES, backlog=1024
+        )
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop.set)
+            except (NotImplementedError, AttributeError):
+                # Windows: Ctrl+C arrives as KeyboardInterrupt instead
+                pass
+
+        async with server:
+            await stop.wait()
+            # No new connections; let responses in flight finish
+            server.close()
+            deadline = time.monotonic() + self.graceful_timeout
+            while self.active and time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+
+
+def serve(app, host, port, **options):
+    server = AsyncServer(app, **options)
+    try:
+        asyncio.run(server.run(host, port))
+    except KeyboardInterrupt:
+        pass
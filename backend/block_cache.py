@@ -0,0 +1,144 @@
+import os
+import threading
+from collections import OrderedDict
+
+from fd_pool import file_identity, file_pool
+
+# ===== CONFIG =====
+BLOCK_SIZE = 1024 * 1024
+BLOCK_CACHE_MB = int(os.environ.get('BLOCK_CACHE_MB', 256))
+# ==================
+
+
+class _PendingRead:
+    """A disk read other threads can wait on instead of issuing their own"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._block = None
+        self._error = None
+
+    def resolve(self, block=None, error=None):
+        self._block = block
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._block
+
+
+class BlockCache:
+    """Process-wide LRU cache of fixed-size, aligned file blocks.
+
+    Viewers tuned to the same live channel read the same file at nearly the
+    same offsets, so blocks are shared between their requests. Concurrent
+    misses on one block are coalesced into a single disk read.
+    """
+
+    def __init__(self, max_bytes, block_size=BLOCK_SIZE):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self._blocks = OrderedDict()
+        self._pending = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes >= self.block_size
+
+    def get_block(self, path, identity, index):
+        """Return block number index of the file, reading it at most once"""
+        key = (identity, index)
+
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return block
+
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _PendingRead()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return pending.wait()
+
+        try:
+            block = file_pool.read(path, identity, self.block_size, index * self.block_size)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            pending.resolve(error=e)
+            raise
+
+        with self._lock:
+            del self._pending[key]
+            self._store(key, block)
+        pending.resolve(block)
+        return block
+
+    def _store(self, key, block):
+        self._blocks[key] = block
+        self._size += len(block)
+        while self._size > self.max_bytes and self._blocks:
+            _, evicted = self._blocks.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def iter_range(self, path, st, start, length):
+        """Yield length bytes of path starting at start, block by block"""
+        identity = file_identity(path, st)
+        block_size = self.block_size
+        end = start + length
+        offset = start
+
+        while offset < end:
+            index, skip = divmod(offset, block_size)
+            block = self.get_block(path, identity, index)
+            if len(block) <= skip:
+                break
+
+            take = min(len(block) - skip, end - offset)
+            if skip == 0 and take == len(block):
+                yield block
+            else:
+                yield block[skip:skip + take]
+            offset += take
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'enabled': self.enabled,
+                'block_size': self.block_size,
+                'max_bytes': self.max_bytes,
+                'used_bytes': self._size,
+                'blocks': len(self._blocks),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0
+            }
+
+
+block_cache = BlockCache(BLOCK_CACHE_MB * 1024 * 1024)
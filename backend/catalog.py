@@ -0,0 +1,482 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from flask import Response
+
+from catalog_journal import Journal, snapshot_hash, write_atomic
+from catalog_records import RecordIndex, Season, Show, next_id, stream_records
+from folder_index import folder_index
+from library_import import sync_episodes
+
+# Data file paths
+DATA_DIR = Path(__file__).parent.parent / 'data'
+DATA_DIR.mkdir(exist_ok=True)
+CHANNELS_FILE = DATA_DIR / 'channels.json'
+SEASONS_FILE = DATA_DIR / 'seasons.json'
+SHOWS_FILE = DATA_DIR / 'shows.json'
+
+# ===== CONFIG =====
+# 'json' keeps the catalog in the files above. 'sqlite' keeps it in
+# CATALOG_DB instead, importing the JSON files the first time.
+CATALOG_BACKEND = os.environ.get('CATALOG_BACKEND', 'json')
+CATALOG_DB = Path(os.environ.get('CATALOG_DB', DATA_DIR / 'catalog.db'))
+# The JSON files are rewritten once their journal grows past this
+JOURNAL_COMPACT_BYTES = int(os.environ.get('CATALOG_JOURNAL_BYTES', 4 * 2**20))
+# ==================
+
+
+class CatalogFile:
+    """A JSON data file kept parsed in memory, with its journal replayed.
+
+    Changes go through transaction(), put() and delete(), which append a
+    line to the file's journal (see catalog_journal) instead of writing the
+    whole file; the file is rewritten in the background once the journal
+    passes JOURNAL_COMPACT_BYTES. The file and the journal are only re-read
+    when their mtime, size or inode changes, and a journal that only grew is
+    read on from where we left off, so the main app and the admin app see
+    each other's changes cheaply. Alongside the parsed document we keep the
+    serialized response body and a strong ETag, so read endpoints never
+    touch the JSON encoder.
+    """
+
+    def __init__(self, path, default):
+        self.path = Path(path)
+        self.default = default
+        self.journal = Journal(self.path.with_name(self.path.name + '.journal'))
+        self._lock = threading.Lock()
+        self._signature = None
+        self._data = None
+        self._body = None
+        self._etag = None
+        self._base = None  # hash of the file as we read it
+        self._offset = None  # journal bytes replayed; None if it continues another file
+        self._compacting = False
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            signature = None
+        return signature, self.journal.signature()
+
+    def _refresh(self):
+        signature = self._stat_signature()
+        if self._data is not None and signature == self._signature:
+            return
+
+        with self._lock:
+            if self._data is not None and signature == self._signature:
+                return
+            self._load(signature)
+
+    def _load(self, signature):
+        file_signature, journal_signature = signature
+        previous = self._signature
+        if (self._data is not None and self._offset is not None
+                and file_signature == previous[0]
+                and journal_signature is not None and previous[1] is not None
+                and journal_signature[2] == previous[1][2]
+                and journal_signature[1] >= self._offset):
+            # Only the journal grew
+            entries, self._offset = self.journal.read(self._base, self._offset)
+            data = self._copy(self._data)
+        else:
+            try:
+                with open(self.path, 'rb') as f:
+                    raw = f.read()
+                doc = json.loads(raw)
+            except FileNotFoundError:
+                raw = b''
+                doc = json.loads(json.dumps(self.default))
+            self._base = snapshot_hash(raw)
+            data = self._parse(doc)
+            replayed = self.journal.read(self._base)
+            entries, self._offset = replayed if replayed is not None else ([], None)
+        for entry in entries:
+            self._apply(data, entry)
+        self._set(data, signature)
+
+    def _parse(self, doc):
+        """In-memory form of the document as the file holds it"""
+        return doc
+
+    def _copy(self, data):
+        return dict(data)
+
+    def _apply(self, data, entry):
+        if entry['op'] == 'put':
+            data[entry['id']] = entry['item']
+        else:
+            data.pop(entry['id'], None)
+
+    def _item_to_disk(self, item):
+        return item
+
+    def _dump(self, data):
+        """data as it is written to the file"""
+        return data
+
+    def _set(self, data, signature):
+        body = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        self._data = data
+        self._body = body
+        self._etag = hashlib.sha1(body).hexdigest()
+        self._signature = signature
+
+    def snapshot(self):
+        """Return (data, body, etag) for the current file contents.
+
+        data is shared between requests and must not be mutated; use load()
+        or get() for a copy that can be changed.
+        """
+        self._refresh()
+        return self._data, self._body, self._etag
+
+    @property
+    def data(self):
+        return self.snapshot()[0]
+
+    def load(self):
+        """Return a private, mutable copy of the document"""
+        return json.loads(self.snapshot()[1])
+
+    def get(self, item_id):
+        """A private copy of one item, or None"""
+        item = self.data.get(item_id)
+        return json.loads(json.dumps(item)) if item is not None else None
+
+    @contextmanager
+    def transaction(self):
+        """Bring the data up to date and keep every other writer, in this
+        process or another, out until the block ends"""
+        with self.journal.locked():
+            self._refresh()
+            yield self
+
+    def put(self, item_id, item):
+        """Add item, or replace the one with item_id. Only within
+        transaction()."""
+        self._append({'op': 'put', 'id': item_id, 'item': self._item_to_disk(item)})
+
+    def delete(self, item_id):
+        """Remove the item with item_id. Only within transaction()."""
+        self._append({'op': 'delete', 'id': item_id})
+
+    def _append(self, entry):
+        with self._lock:
+            if self._offset is None:
+                # The journal continues an older version of the file
+                self.journal.reset(self._base)
+            self._offset = self.journal.append(self._base, entry)
+            data = self._copy(self._data)
+            self._apply(data, entry)
+            self._set(data, self._stat_signature())
+            compact = self._offset > JOURNAL_COMPACT_BYTES and not self._compacting
+            self._compacting = self._compacting or compact
+        if compact:
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """Rewrite the file with the journal folded in"""
+        try:
+            with self.journal.locked():
+                self._refresh()
+                self._write(self._data)
+        finally:
+            self._compacting = False
+
+    def save(self, data):
+        """Replace the whole document with data (as load() returns it)"""
+        data = self._parse(json.loads(json.dumps(data)))
+        with self.journal.locked():
+            self._write(data)
+
+    def _write(self, data):
+        raw = json.dumps(self._dump(data), indent=2).encode('utf-8')
+        with self._lock:
+            # A crash between these two leaves a journal for the old file,
+            # which is then ignored
+            write_atomic(self.path, raw)
+            self._base = snapshot_hash(raw)
+            self._offset = self.journal.reset(self._base)
+            self._set(data, self._stat_signature())
+
+    def response(self):
+        """JSON response served straight from the pre-serialized body"""
+        _, body, etag = self.snapshot()
+        return self._validated(Response(body, mimetype='application/json'), etag)
+
+    def _validated(self, response, etag):
+        mtimes = [s[0] for s in self._signature if s is not None]
+        response.set_etag(etag)
+        if mtimes:
+            response.last_modified = datetime.fromtimestamp(max(mtimes) / 1e9, timezone.utc)
+        return response
+
+
+class RecordCatalogFile(CatalogFile):
+    """A CatalogFile of Show or Season records (see catalog_records).
+
+    The file stores each season as its folder and a list of filenames, and
+    load(), get(), put() and save() still deal in the full episode dicts the
+    API uses, so the admin routes don't change. Responses are never kept as
+    one body: they are serialized a record at a time while being sent, and
+    their ETag comes from the files' signatures instead of a hash of the
+    body.
+    """
+
+    def __init__(self, path, record):
+        super().__init__(path, [])
+        self.record = record
+        self._index = None
+
+    def _parse(self, doc):
+        return [self.record.from_dict(d) for d in doc]
+
+    def _copy(self, data):
+        return list(data)
+
+    def _apply(self, data, entry):
+        item_id = entry['id']
+        if entry['op'] == 'put':
+            record = self.record.from_dict(entry['item'])
+            index = next((i for i, r in enumerate(data) if r.id == item_id), None)
+            if index is None:
+                data.append(record)
+            else:
+                data[index] = record
+        else:
+            data[:] = [r for r in data if r.id != item_id]
+
+    def _item_to_disk(self, item):
+        return self.record.from_dict(item).to_disk()
+
+    def _dump(self, data):
+        return [record.to_disk() for record in data]
+
+    def _set(self, data, signature):
+        self._data = data
+        self._body = None
+        self._etag = hashlib.sha1(f'{self.path}:{signature}'.encode('utf-8')).hexdigest()
+        self._signature = signature
+
+    def load(self):
+        return [record.to_api() for record in self.snapshot()[0]]
+
+    def get(self, item_id):
+        record = next((r for r in self.data if r.id == item_id), None)
+        return record.to_api() if record is not None else None
+
+    def index(self):
+        """RecordIndex of the current records, built the first time it's
+        asked for after a change"""
+        records = self.data
+        index = self._index
+        if index is None or index.records is not records:
+            index = self._index = RecordIndex(records)
+        return index
+
+    def response(self):
+        records, _, etag = self.snapshot()
+        return self._validated(Response(stream_records(records), mimetype='application/json'), etag)
+
+
+class JsonCatalogStore:
+    """Every change to the catalog, made on the JSON files.
+
+    Each one is a transaction on the file it touches: the item it changes
+    is read, changed and put back whole, as one line in the file's journal.
+    The transaction holds a lock file, so the main app and the admin app
+    can't lose each other's changes either. Methods that take an ID return
+    None (or False) when there is nothing with that ID.
+    """
+
+    def __init__(self, channels, seasons, shows):
+        self.channels = channels
+        self.seasons = seasons
+        self.shows = shows
+
+    def media_path(self, key):
+        # No index; media_table's own map is all there is
+        return None
+
+    def add_channel(self, name, folder_path):
+        with self.channels.transaction() as channels:
+            channel_id = next_id(channels.data)
+            channel = {'id': channel_id, 'name': name, 'folder_path': folder_path}
+            channels.put(channel_id, channel)
+        return channel
+
+    def delete_channel(self, channel_id):
+        with self.channels.transaction() as channels:
+            if channels.get(channel_id) is None:
+                return False
+            channels.delete(channel_id)
+        return True
+
+    def add_season(self, name):
+        with self.seasons.transaction() as seasons:
+            season = {'id': next_id(s.id for s in seasons.data), 'name': name, 'episodes': []}
+            seasons.put(season['id'], season)
+        return season
+
+    def delete_season(self, season_id):
+        with self.seasons.transaction() as seasons:
+            if seasons.get(season_id) is None:
+                return False
+            seasons.delete(season_id)
+        return True
+
+    def add_season_episodes(self, season_id, episodes):
+        """Append (filename, path) episodes to a VOD season"""
+        with self.seasons.transaction() as seasons:
+            season = seasons.get(season_id)
+            if season is None:
+                return None
+            first = int(next_id(e.get('id') for e in season['episodes']))
+            for i, (filename, path) in enumerate(episodes):
+                season['episodes'].append({'id': str(first + i), 'filename': filename, 'path': path})
+            seasons.put(season_id, season)
+        # As the API (and the SQLite store) has it: media_id and all
+        return Season.from_dict(season).to_api()
+
+    def sync_season(self, show_id, season_id, folder, files):
+        """Bring a season's episodes from folder in line with files, the
+        folder's listing now (show_id None for a VOD season). Returns
+        (added, removed) filenames, or None if there is no such season."""
+        catalog = self.seasons if show_id is None else self.shows
+        with catalog.transaction():
+            owner = catalog.get(season_id if show_id is None else show_id)
+            season = owner if show_id is None or owner is None else next(
+                (s for s in owner['seasons'] if s['id'] == season_id), None
+            )
+            if season is None:
+                return None
+            season['episodes'], added, removed = sync_episodes(
+                season['episodes'], folder, files, numbered=show_id is None
+            )
+            if added or removed:
+                catalog.put(owner['id'], owner)
+        return added, removed
+
+    def add_show(self, name):
+        with self.shows.transaction() as shows:
+            show = {'id': next_id(s.id for s in shows.data), 'name': name, 'poster': '', 'seasons': []}
+            shows.put(show['id'], show)
+        return show
+
+    def _edit_show(self, show_id, edit):
+        """Apply edit to show show_id and save, unless edit returns None"""
+        with self.shows.transaction() as shows:
+            show = shows.get(show_id)
+            if show is None:
+                return None
+            result = edit(show)
+            if result is not None and result is not False:
+                shows.put(show_id, show)
+            return result
+
+    def set_show_poster(self, show_id, poster):
+        def edit(show):
+            show['poster'] = poster
+            return show
+        show = self._edit_show(show_id, edit)
+        return Show.from_dict(show).to_api() if show is not None else None
+
+    def delete_show(self, show_id):
+        with self.shows.transaction() as shows:
+            if shows.get(show_id) is None:
+                return False
+            shows.delete(show_id)
+        return True
+
+    def import_show(self, name, seasons, show_id=None):
+        """Add a show with (name, [(filename, path)]) seasons as one change.
+        With show_id they go into that show instead, replacing the episodes
+        of seasons it already has by that name; None if there is no such
+        show."""
+        with self.shows.transaction() as shows:
+            if show_id is None:
+                show = {'id': next_id(s.id for s in shows.data), 'name': name, 'poster': '', 'seasons': []}
+            else:
+                show = shows.get(show_id)
+                if show is None:
+                    return None
+            by_name = {s['name']: s for s in show['seasons']}
+            for season_name, episodes in seasons:
+                season = by_name.get(season_name)
+                if season is None:
+                    season = {'id': next_id(s['id'] for s in show['seasons']), 'name': season_name}
+                    show['seasons'].append(season)
+                season['episodes'] = [{'filename': f, 'path': p} for f, p in episodes]
+            shows.put(show['id'], show)
+        return Show.from_dict(show).to_api()
+
+    def add_show_season(self, show_id, name):
+        def edit(show):
+            show['seasons'].append({
+                'id': next_id(s['id'] for s in show['seasons']), 'name': name, 'episodes': []
+            })
+            return show
+        show = self._edit_show(show_id, edit)
+        return Show.from_dict(show).to_api() if show is not None else None
+
+    def set_show_season_episodes(self, show_id, season_id, episodes):
+        """Replace a show season's episodes with (filename, path) pairs"""
+        def edit(show):
+            season = next((s for s in show['seasons'] if s['id'] == season_id), None)
+            if season is not None:
+                season['episodes'] = [{'filename': f, 'path': p} for f, p in episodes]
+            return season
+        season = self._edit_show(show_id, edit)
+        return Season.from_dict(season).to_api() if season is not None else None
+
+    def delete_show_season(self, show_id, season_id):
+        """True once deleted, False if the show has no such season, None
+        if there is no such show"""
+        def edit(show):
+            kept = [s for s in show['seasons'] if s['id'] != season_id]
+            if len(kept) == len(show['seasons']):
+                return False
+            show['seasons'] = kept
+            return True
+        return self._edit_show(show_id, edit)
+
+
+_json_catalogs = (
+    CatalogFile(CHANNELS_FILE, {}),
+    RecordCatalogFile(SEASONS_FILE, Season),
+    RecordCatalogFile(SHOWS_FILE, Show),
+)
+if CATALOG_BACKEND == 'sqlite':
+    from catalog_db import SqliteCatalog
+
+    catalog_store = SqliteCatalog(CATALOG_DB, import_from=_json_catalogs)
+else:
+    catalog_store = JsonCatalogStore(*_json_catalogs)
+
+# Read side: snapshot() / data / response(), whichever the backend
+channels_catalog = catalog_store.channels
+seasons_catalog = catalog_store.seasons
+shows_catalog = catalog_store.shows
+
+
+def library_paths():
+    """Every media file the catalog knows about: show and VOD season
+    episodes plus the current contents of each channel folder"""
+    paths = []
+    for show in shows_catalog.data:
+        paths.extend(show.paths())
+    for season in seasons_catalog.data:
+        paths.extend(season.paths())
+    for channel in channels_catalog.data.values():
+        folder_path = channel['folder_path']
+        paths.extend(os.path.join(folder_path, f) for f in folder_index.files(folder_path))
+    # Keep order, drop duplicates (a season can also be a channel)
+    return list(dict.fromkeys(paths))
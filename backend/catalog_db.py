@@ -0,0 +1,585 @@
+"""The catalog in SQLite instead of the JSON files (CATALOG_BACKEND=sqlite).
+
+Every admin change is one transaction touching only the rows it changes,
+so the main app and the admin app can both write without one overwriting
+the other's edit, and a crash mid-write leaves the last commit intact. The
+database runs in WAL mode, so readers never wait for a writer.
+
+Reads still come from memory, as the same records the JSON backend uses
+(see catalog_records). Every write bumps the version counter in the meta
+table and logs the channel, season or show it touched in the changes
+table, so when the version has moved (a single indexed read per request
+tells) only those items are read again and swapped into the cached
+catalog. The whole catalog is only read again when the log doesn't cover
+the gap: on the first read, or after CHANGE_LOG_SIZE more writes.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from flask import Response
+
+from catalog_records import RecordIndex, Season, Show, media_id, next_id, stream_records
+from library_import import sync_episodes
+
+# ===== CONFIG =====
+# Writes remembered in the changes table; a process that is further behind
+# than this reads the whole catalog again
+CHANGE_LOG_SIZE = 1000
+# ==================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    folder_path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shows (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    poster TEXT NOT NULL DEFAULT ''
+);
+-- Show seasons (show_id set) and VOD seasons (show_id NULL). season_id is
+-- the ID the API uses, unique within its show.
+CREATE TABLE IF NOT EXISTS seasons (
+    pk INTEGER PRIMARY KEY AUTOINCREMENT,
+    show_id INTEGER REFERENCES shows(id) ON DELETE CASCADE,
+    season_id TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS seasons_by_show ON seasons(IFNULL(show_id, 0), season_id);
+CREATE TABLE IF NOT EXISTS episodes (
+    pk INTEGER PRIMARY KEY AUTOINCREMENT,
+    season_pk INTEGER NOT NULL REFERENCES seasons(pk) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    episode_id TEXT,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    media_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS episodes_by_season ON episodes(season_pk, position);
+CREATE INDEX IF NOT EXISTS episodes_by_media_id ON episodes(media_id);
+-- What each version changed: the item with item_id in view ('channels',
+-- 'seasons' or 'shows') was added, edited or deleted
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER NOT NULL,
+    view TEXT NOT NULL,
+    item_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_by_version ON changes(version);
+"""
+
+
+class _View:
+    """Read side of one catalog, shaped like catalog.CatalogFile"""
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self._index = None
+
+    def snapshot(self):
+        data, version = self.db.read(self.name)
+        etag = hashlib.sha1(f'{self.db.path}:{self.name}:{version}'.encode('utf-8')).hexdigest()
+        return data, None, etag
+
+    @property
+    def data(self):
+        return self.snapshot()[0]
+
+    def load(self):
+        data = self.snapshot()[0]
+        if isinstance(data, dict):
+            return json.loads(json.dumps(data))
+        return [record.to_api() for record in data]
+
+    def index(self):
+        """RecordIndex of the seasons or shows, rebuilt with them"""
+        records = self.data
+        index = self._index
+        if index is None or index.records is not records:
+            index = self._index = RecordIndex(records)
+        return index
+
+    def response(self):
+        data, _, etag = self.snapshot()
+        if isinstance(data, dict):
+            body = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        else:
+            body = stream_records(data)
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response
+
+
+class SqliteCatalog:
+    """Catalog store backed by one SQLite file; see the module docstring.
+
+    The mutation methods match catalog.JsonCatalogStore, and channels,
+    seasons and shows are views with the CatalogFile read API.
+    """
+
+    def __init__(self, path, import_from=None):
+        """import_from: the JSON (channels, seasons, shows) catalogs, copied
+        in when the database is first created"""
+        self.path = str(path)
+        self._local = threading.local()
+        self._cache = {}  # view name -> (version, data)
+        self._cache_lock = threading.Lock()
+        self.channels = _View(self, 'channels')
+        self.seasons = _View(self, 'seasons')
+        self.shows = _View(self, 'shows')
+
+        db = self._db()
+        db.executescript(SCHEMA)
+        imported = db.execute("SELECT value FROM meta WHERE key = 'imported'").fetchone()
+        if imported is None:
+            with self._write() as db:
+                if import_from is not None:
+                    self._import(db, *(catalog.data for catalog in import_from))
+                db.execute("INSERT INTO meta (key, value) VALUES ('imported', 1)")
+
+    # ----- connections -----
+
+    def _db(self):
+        """This thread's connection"""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            # (A connection must not be used across fork(), e.g. by
+            # gunicorn's workers after the app is preloaded)
+            db = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            db.execute('PRAGMA journal_mode=WAL')
+            # Durable at every checkpoint; a power cut can lose the last
+            # commits, but never corrupt the file
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('PRAGMA foreign_keys=ON')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _write(self):
+        return _Transaction(self._db())
+
+    def version(self):
+        row = self._db().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    # ----- reads -----
+
+    def read(self, name):
+        """(data, version) for a view, brought up to date only when the
+        version moved"""
+        version = self.version()
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1], version
+        with self._cache_lock:
+            cached = self._cache.get(name)
+            if cached is None or cached[0] != version:
+                data = None
+                if cached is not None:
+                    data = self._update(name, cached[0], version, cached[1])
+                if data is None:
+                    data = getattr(self, '_read_' + name)()
+                cached = self._cache[name] = (version, data)
+        return cached[1], version
+
+    def _update(self, name, since, version, data):
+        """data (the view at version since) with the items changed up to
+        version read again, or None if the change log doesn't go back that
+        far"""
+        rows = self._db().execute(
+            'SELECT version, view, item_id FROM changes WHERE version > ? AND version <= ?',
+            (since, version)
+        ).fetchall()
+        if {row[0] for row in rows} != set(range(since + 1, version + 1)):
+            return None
+        item_ids = list(dict.fromkeys(item_id for _, view, item_id in rows if view == name))
+        if not item_ids:
+            return data
+
+        read_one = getattr(self, '_read_one_' + name)
+        if isinstance(data, dict):
+            data = dict(data)
+            for item_id in item_ids:
+                item = read_one(item_id)
+                if item is None:
+                    data.pop(item_id, None)
+                else:
+                    data[item_id] = item
+            return data
+
+        data = list(data)
+        for item_id in item_ids:
+            record = read_one(item_id)
+            index = next((i for i, r in enumerate(data) if r.id == item_id), None)
+            if record is None:
+                if index is not None:
+                    del data[index]
+            elif index is None:
+                # IDs only grow, so a new one goes last, as ORDER BY has it
+                data.append(record)
+            else:
+                data[index] = record
+        return data
+
+    def _read_channels(self):
+        rows = self._db().execute('SELECT id, name, folder_path FROM channels ORDER BY id')
+        return {
+            str(i): {'id': str(i), 'name': name, 'folder_path': folder_path}
+            for i, name, folder_path in rows
+        }
+
+    def _read_one_channels(self, channel_id):
+        if not channel_id.isdigit():
+            return None
+        row = self._db().execute(
+            'SELECT id, name, folder_path FROM channels WHERE id = ?', (int(channel_id),)
+        ).fetchone()
+        return {'id': str(row[0]), 'name': row[1], 'folder_path': row[2]} if row else None
+
+    def _season_records(self, where, params=()):
+        """(owner show_id, Season record) for every season matching where"""
+        db = self._db()
+        rows = list(db.execute(
+            f'SELECT pk, season_id, name, show_id FROM seasons s WHERE {where} ORDER BY pk', params
+        ))
+        episodes = {row[0]: [] for row in rows}
+        for season_pk, episode_id, filename, path in db.execute(
+            'SELECT e.season_pk, e.episode_id, e.filename, e.path '
+            f'FROM episodes e JOIN seasons s ON s.pk = e.season_pk WHERE {where} '
+            'ORDER BY e.season_pk, e.position', params
+        ):
+            episode = {'filename': filename, 'path': path}
+            if episode_id is not None:
+                episode['id'] = episode_id
+            episodes[season_pk].append(episode)
+        return [
+            (show_id, Season.from_dict({'id': season_id, 'name': name, 'episodes': episodes[pk]}))
+            for pk, season_id, name, show_id in rows
+        ]
+
+    def _read_seasons(self):
+        return [season for _, season in self._season_records('s.show_id IS NULL')]
+
+    def _read_one_seasons(self, season_id):
+        seasons = self._season_records('s.show_id IS NULL AND s.season_id = ?', (season_id,))
+        return seasons[0][1] if seasons else None
+
+    def _read_shows(self):
+        by_show = {}
+        for show_id, season in self._season_records('s.show_id IS NOT NULL'):
+            by_show.setdefault(show_id, []).append(season)
+        return [
+            Show(str(i), name, poster, by_show.get(i, []))
+            for i, name, poster in self._db().execute('SELECT id, name, poster FROM shows ORDER BY id')
+        ]
+
+    def _read_one_shows(self, show_id):
+        if not show_id.isdigit():
+            return None
+        row = self._db().execute(
+            'SELECT name, poster FROM shows WHERE id = ?', (int(show_id),)
+        ).fetchone()
+        if row is None:
+            return None
+        seasons = self._season_records('s.show_id = ?', (int(show_id),))
+        return Show(show_id, row[0], row[1], [season for _, season in seasons])
+
+    def media_path(self, key):
+        """Path of the show or VOD episode with this media_id, or None"""
+        row = self._db().execute(
+            'SELECT path FROM episodes WHERE media_id = ? LIMIT 1', (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    # ----- writes -----
+
+    def _season_pk(self, db, show_id, season_id):
+        row = db.execute(
+            'SELECT pk FROM seasons WHERE IFNULL(show_id, 0) = ? AND season_id = ?',
+            (int(show_id) if show_id is not None else 0, season_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _new_season(self, db, show_id, name):
+        ids = [r[0] for r in db.execute(
+            'SELECT season_id FROM seasons WHERE IFNULL(show_id, 0) = ?',
+            (int(show_id) if show_id is not None else 0,)
+        )]
+        season_id = next_id(ids)
+        db.execute(
+            'INSERT INTO seasons (show_id, season_id, name) VALUES (?, ?, ?)',
+            (int(show_id) if show_id is not None else None, season_id, name)
+        )
+        return season_id
+
+    def _insert_episodes(self, db, season_pk, episodes, numbered, first_position=0, first_id=1):
+        db.executemany(
+            'INSERT INTO episodes (season_pk, position, episode_id, filename, path, media_id) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (season_pk, first_position + i, str(first_id + i) if numbered else None,
+                 filename, path, media_id(path))
+                for i, (filename, path) in enumerate(episodes)
+            ]
+        )
+
+    def _show_exists(self, db, show_id):
+        return show_id.isdigit() and db.execute(
+            'SELECT 1 FROM shows WHERE id = ?', (int(show_id),)
+        ).fetchone() is not None
+
+    def _touch(self, db, view, item_id):
+        """Log that this write changed item_id in view (see the module
+        docstring); it goes in with the version the write commits as"""
+        db.execute(
+            'INSERT INTO changes (version, view, item_id) VALUES '
+            "(IFNULL((SELECT value FROM meta WHERE key = 'version'), 0) + 1, ?, ?)",
+            (view, str(item_id))
+        )
+
+    def _find(self, items, item_id):
+        return next((item.to_api() for item in items if item.id == item_id), None)
+
+    def add_channel(self, name, folder_path):
+        with self._write() as db:
+            cursor = db.execute(
+                'INSERT INTO channels (name, folder_path) VALUES (?, ?)', (name, folder_path)
+            )
+            self._touch(db, 'channels', cursor.lastrowid)
+        return {'id': str(cursor.lastrowid), 'name': name, 'folder_path': folder_path}
+
+    def delete_channel(self, channel_id):
+        if not channel_id.isdigit():
+            return False
+        with self._write() as db:
+            if db.execute('DELETE FROM channels WHERE id = ?', (int(channel_id),)).rowcount == 0:
+                return False
+            self._touch(db, 'channels', channel_id)
+        return True
+
+    def add_season(self, name):
+        with self._write() as db:
+            season_id = self._new_season(db, None, name)
+            self._touch(db, 'seasons', season_id)
+        return {'id': season_id, 'name': name, 'episodes': []}
+
+    def delete_season(self, season_id):
+        with self._write() as db:
+            if db.execute(
+                'DELETE FROM seasons WHERE show_id IS NULL AND season_id = ?', (season_id,)
+            ).rowcount == 0:
+                return False
+            self._touch(db, 'seasons', season_id)
+        return True
+
+    def add_season_episodes(self, season_id, episodes):
+        with self._write() as db:
+            season_pk = self._season_pk(db, None, season_id)
+            if season_pk is None:
+                return None
+            count, last_id = db.execute(
+                'SELECT COUNT(*), MAX(CAST(episode_id AS INTEGER)) FROM episodes WHERE season_pk = ?',
+                (season_pk,)
+            ).fetchone()
+            self._insert_episodes(db, season_pk, episodes, True, count, (last_id or 0) + 1)
+            self._touch(db, 'seasons', season_id)
+        return self._find(self.seasons.data, season_id)
+
+    def sync_season(self, show_id, season_id, folder, files):
+        if show_id is not None and not show_id.isdigit():
+            return None
+        with self._write() as db:
+            season_pk = self._season_pk(db, show_id, season_id)
+            if season_pk is None:
+                return None
+            episodes = []
+            for episode_id, filename, path in db.execute(
+                'SELECT episode_id, filename, path FROM episodes WHERE season_pk = ? ORDER BY position',
+                (season_pk,)
+            ):
+                episode = {'filename': filename, 'path': path}
+                if episode_id is not None:
+                    episode['id'] = episode_id
+                episodes.append(episode)
+            episodes, added, removed = sync_episodes(episodes, folder, files, numbered=show_id is None)
+            if added or removed:
+                db.execute('DELETE FROM episodes WHERE season_pk = ?', (season_pk,))
+                db.executemany(
+                    'INSERT INTO episodes (season_pk, position, episode_id, filename, path, media_id) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [
+                        (season_pk, i, e.get('id'), e['filename'], e['path'], media_id(e['path']))
+                        for i, e in enumerate(episodes)
+                    ]
+                )
+                if show_id is None:
+                    self._touch(db, 'seasons', season_id)
+                else:
+                    self._touch(db, 'shows', show_id)
+        return added, removed
+
+    def add_show(self, name):
+        with self._write() as db:
+            cursor = db.execute('INSERT INTO shows (name) VALUES (?)', (name,))
+            self._touch(db, 'shows', cursor.lastrowid)
+        return {'id': str(cursor.lastrowid), 'name': name, 'poster': '', 'seasons': []}
+
+    def set_show_poster(self, show_id, poster):
+        with self._write() as db:
+            if not self._show_exists(db, show_id):
+                return None
+            db.execute('UPDATE shows SET poster = ? WHERE id = ?', (poster, int(show_id)))
+            self._touch(db, 'shows', show_id)
+        return self._find(self.shows.data, show_id)
+
+    def delete_show(self, show_id):
+        if not show_id.isdigit():
+            return False
+        with self._write() as db:
+            if db.execute('DELETE FROM shows WHERE id = ?', (int(show_id),)).rowcount == 0:
+                return False
+            self._touch(db, 'shows', show_id)
+        return True
+
+    def import_show(self, name, seasons, show_id=None):
+        with self._write() as db:
+            if show_id is None:
+                show_id = str(db.execute('INSERT INTO shows (name) VALUES (?)', (name,)).lastrowid)
+            elif not self._show_exists(db, show_id):
+                return None
+            pks = {n: pk for pk, n in db.execute(
+                'SELECT pk, name FROM seasons WHERE show_id = ?', (int(show_id),)
+            )}
+            for season_name, episodes in seasons:
+                season_pk = pks.get(season_name)
+                if season_pk is None:
+                    season_pk = self._season_pk(db, show_id, self._new_season(db, show_id, season_name))
+                else:
+                    db.execute('DELETE FROM episodes WHERE season_pk = ?', (season_pk,))
+                self._insert_episodes(db, season_pk, episodes, False)
+            self._touch(db, 'shows', show_id)
+        return self._find(self.shows.data, show_id)
+
+    def add_show_season(self, show_id, name):
+        with self._write() as db:
+            if not self._show_exists(db, show_id):
+                return None
+            self._new_season(db, show_id, name)
+            self._touch(db, 'shows', show_id)
+        return self._find(self.shows.data, show_id)
+
+    def set_show_season_episodes(self, show_id, season_id, episodes):
+        with self._write() as db:
+            if not self._show_exists(db, show_id):
+                return None
+            season_pk = self._season_pk(db, show_id, season_id)
+            if season_pk is None:
+                return None
+            db.execute('DELETE FROM episodes WHERE season_pk = ?', (season_pk,))
+            self._insert_episodes(db, season_pk, episodes, False)
+            self._touch(db, 'shows', show_id)
+        show = self._find(self.shows.data, show_id)
+        return next((s for s in show['seasons'] if s['id'] == season_id), None)
+
+    def delete_show_season(self, show_id, season_id):
+        with self._write() as db:
+            if not self._show_exists(db, show_id):
+                return None
+            if db.execute(
+                'DELETE FROM seasons WHERE show_id = ? AND season_id = ?', (int(show_id), season_id)
+            ).rowcount == 0:
+                return False
+            self._touch(db, 'shows', show_id)
+        return True
+
+    # ----- import -----
+
+    def _import(self, db, channels, seasons, shows):
+        """Copy the JSON catalogs in, keeping their IDs where they are unique"""
+        for channel_id, channel in zip(_unique_ids(channels), channels.values()):
+            db.execute(
+                'INSERT INTO channels (id, name, folder_path) VALUES (?, ?, ?)',
+                (int(channel_id), channel.get('name', ''), channel['folder_path'])
+            )
+        self._import_seasons(db, None, seasons)
+        for show_id, show in zip(_unique_ids(s.id for s in shows), shows):
+            db.execute(
+                'INSERT INTO shows (id, name, poster) VALUES (?, ?, ?)',
+                (int(show_id), show.name, show.poster)
+            )
+            self._import_seasons(db, show_id, show.seasons)
+
+    def _import_seasons(self, db, show_id, seasons):
+        for season_id, season in zip(_unique_ids(s.id for s in seasons), seasons):
+            cursor = db.execute(
+                'INSERT INTO seasons (show_id, season_id, name) VALUES (?, ?, ?)',
+                (int(show_id) if show_id is not None else None, season_id, season.name)
+            )
+            db.executemany(
+                'INSERT INTO episodes (season_pk, position, episode_id, filename, path, media_id) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (cursor.lastrowid, i, episode.get('id'), episode['filename'], episode['path'],
+                     episode['media_id'])
+                    for i, episode in enumerate(season.episodes())
+                ]
+            )
+
+
+def _unique_ids(ids):
+    """ids, with repeats (and non-numeric ones) replaced by fresh numbers.
+    len() + 1 IDs collide after a delete, so older files can have two shows
+    with the same ID; the first keeps it."""
+    ids = list(ids)
+    taken = set()
+    unique = []
+    for i in ids:
+        i = str(i)
+        unique.append(i if i.isdigit() and i not in taken else None)
+        taken.add(i)
+    for n, i in enumerate(unique):
+        if i is None:
+            unique[n] = next_id(taken)
+            taken.add(unique[n])
+    return unique
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT that also bumps the catalog version"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        # Takes the write lock up front, so two writers queue instead of
+        # failing halfway through
+        self.db.execute('BEGIN IMMEDIATE')
+        self.changes = self.db.total_changes
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.db.execute('ROLLBACK')
+            return False
+        if self.db.total_changes == self.changes:
+            # Nothing written, so every cached read is still good
+            self.db.execute('COMMIT')
+            return False
+        self.db.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', 1) "
+            'ON CONFLICT(key) DO UPDATE SET value = value + 1'
+        )
+        self.db.execute(
+            "DELETE FROM changes WHERE version <= (SELECT value FROM meta WHERE key = 'version') - ?",
+            (CHANGE_LOG_SIZE,)
+        )
+        self.db.execute('COMMIT')
+        return False
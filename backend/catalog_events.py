@@ -0,0 +1,91 @@
+import threading
+import time
+import traceback
+
+from catalog import channels_catalog, seasons_catalog, shows_catalog
+from events import event_bus
+
+# ===== CONFIG =====
+# How often the catalog is checked for changes while anyone is listening
+# to /api/events; a check is a stat of each catalog file
+CATALOG_CHECK_SECONDS = 1.0
+# ==================
+
+
+class CatalogMonitor:
+    """Publishes 'channels', 'seasons' and 'shows' events with the IDs added,
+    removed and changed, whichever process changed the catalog.
+
+    The admin app and the main app are separate processes, so this doesn't
+    hook the writes: it compares the catalog with what it saw last time,
+    which costs a stat per file when nothing changed. One timer does it for
+    every event stream, and only while one is open (see listen()), so
+    without listeners nothing is checked at all.
+    """
+
+    def __init__(self, bus=event_bus, interval=CATALOG_CHECK_SECONDS):
+        self.bus = bus
+        self.interval = interval
+        self._catalogs = {'channels': channels_catalog, 'seasons': seasons_catalog, 'shows': shows_catalog}
+        self._seen = {}  # name -> (data, {id: item})
+        self._listeners = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def listen(self):
+        """An event stream opened: check every interval until all of them
+        have called unlisten()"""
+        with self._lock:
+            self._listeners += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='catalog-events', daemon=True)
+                self._thread.start()
+
+    def unlisten(self):
+        with self._lock:
+            self._listeners -= 1
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                traceback.print_exc()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._listeners:
+                    self._thread = None
+                    return
+
+    def check(self):
+        """Publish what changed in the catalog since the last check"""
+        for name, catalog in self._catalogs.items():
+            self._compare(name, catalog.data)
+
+    def _compare(self, name, data):
+        seen = self._seen.get(name)
+        if seen is not None and seen[0] is data:
+            return
+        items = dict(data) if isinstance(data, dict) else {record.id: record for record in data}
+        self._seen[name] = (data, items)
+        if seen is None:
+            return
+
+        old = seen[1]
+        changed = [
+            i for i in items
+            if i in old and old[i] is not items[i] and _disk(old[i]) != _disk(items[i])
+        ]
+        added = [i for i in items if i not in old]
+        removed = [i for i in old if i not in items]
+        if added or removed or changed:
+            self.bus.publish(name, {'added': added, 'removed': removed, 'changed': changed})
+
+
+def _disk(item):
+    # Records from a fresh SQLite read are new objects even when nothing
+    # in them changed
+    return item.to_disk() if hasattr(item, 'to_disk') else item
+
+
+catalog_monitor = CatalogMonitor()
@@ -0,0 +1,145 @@
+"""Append-only journal of changes to a JSON catalog file.
+
+Saving a catalog file used to mean writing the whole pretty-printed
+document again, for every poster changed or season added. Now a change is
+one compact line appended to <file>.journal and fsync'd, and the file
+itself (the snapshot) is only rewritten now and then, when the journal is
+folded back into it.
+
+The journal's first line holds a hash of the snapshot it continues, so a
+journal that was already folded into the snapshot (a crash between
+writing the two) is recognised and never replayed twice. Every line after
+it replaces or deletes one whole item, so replaying them is the same as
+having made the changes.
+"""
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+APPEND_FLAGS = os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+
+
+def snapshot_hash(raw):
+    return hashlib.sha1(raw).hexdigest()
+
+
+def _encode(entry):
+    return json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _decode(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return {}
+
+
+def write_atomic(path, raw):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock on path, held against other processes too"""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    # Gives up after about 10 seconds; keep waiting
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def locked(self):
+        """Keep every other writer out, in this process or another"""
+        with self._lock:
+            with _file_lock(self.lock_path):
+                yield
+
+    def signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def read(self, base, offset=0):
+        """(entries, offset) of the whole lines from offset on, where offset
+        is where the next read should start. From offset 0, None if the
+        journal continues some other snapshot than base."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                raw = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # A line still being written (or cut short by a crash) is left for later
+        end = raw.rfind(b'\n') + 1
+        lines = raw[:end].splitlines()
+        if offset == 0:
+            if not lines or _decode(lines[0]).get('base') != base:
+                return None
+            lines = lines[1:]
+        # Skipping the remains of a line a crash cut short
+        return [e for e in map(_decode, lines) if e], offset + end
+
+    def append(self, base, entry):
+        """Add entry and fsync; returns the journal's size after it. Call
+        while holding locked()."""
+        fd = os.open(self.path, APPEND_FLAGS, 0o644)
+        try:
+            raw = _encode(entry)
+            size = os.fstat(fd).st_size
+            if size == 0:
+                raw = _encode({'base': base}) + raw
+            else:
+                os.lseek(fd, size - 1, os.SEEK_SET)
+                if os.read(fd, 1) != b'\n':
+                    # Ended in a line cut short by a crash
+                    raw = b'\n' + raw
+            os.write(fd, raw)
+            os.fsync(fd)
+            return os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+    def reset(self, base):
+        """Start an empty journal continuing the snapshot with hash base;
+        returns its size. Call while holding locked()."""
+        raw = _encode({'base': base})
+        write_atomic(self.path, raw)
+        return len(raw)
@@ -0,0 +1,94 @@
+"""The shows catalog a piece at a time, for both apps.
+
+GET /api/shows is every show with every season's episodes in one body,
+which grows with the library. A list of posters or a dropdown of names
+only needs a few fields of the shows on screen, so these responses carry
+only the fields asked for, a page at a time, and episodes only for the one
+season being opened. Lookups go through the catalog's RecordIndex, so
+they cost the same for ten shows or ten thousand.
+"""
+from operator import itemgetter
+
+from flask import jsonify, request
+
+from catalog import shows_catalog
+from catalog_records import RecordIndex
+from http_cache import conditional
+
+# ===== CONFIG =====
+# Shows per page when ?limit= isn't given, and the most one page can hold
+SHOWS_PAGE_SIZE = 50
+SHOWS_PAGE_MAX = 500
+# A show's fields when ?fields= isn't given; seasons come without episodes
+SHOW_FIELDS = ('id', 'name', 'poster', 'seasons')
+# Episodes per page of a season, the same way
+EPISODES_PAGE_SIZE = 100
+EPISODES_PAGE_MAX = 1000
+# ==================
+
+PAGE_ARGS = ('fields', 'limit', 'cursor')
+
+
+def _limit(default, most):
+    """?limit=, clamped to 1..most; None if it isn't a number"""
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        return None
+    return max(1, min(limit, most))
+
+
+def _fields():
+    fields = request.args.get('fields', '')
+    fields = [f.strip() for f in fields.split(',') if f.strip()]
+    return fields or SHOW_FIELDS
+
+
+def shows_page():
+    """GET /api/shows. With ?fields=id,name,poster, ?limit= or ?cursor=,
+    {'shows': [...], 'next_cursor': ...}, where the cursor asks for the
+    next page and is null after the last one; without any, the whole
+    catalog as it always was."""
+    if not any(arg in request.args for arg in PAGE_ARGS):
+        return conditional(shows_catalog.response(), 'shows')
+
+    limit = _limit(SHOWS_PAGE_SIZE, SHOWS_PAGE_MAX)
+    if limit is None:
+        return jsonify({'error': 'limit must be a number'}), 400
+
+    fields = _fields()
+    shows, cursor = shows_catalog.index().page(request.args.get('cursor'), limit)
+    return conditional(jsonify({
+        'shows': [show.summary(fields) for show in shows],
+        'next_cursor': cursor,
+    }), 'shows')
+
+
+def show_response(show_id):
+    """GET /api/shows/<id>: the show, with only ?fields= if given"""
+    show = shows_catalog.index().get(show_id)
+    if show is None:
+        return jsonify({'error': 'Show not found'}), 404
+    return conditional(jsonify(show.summary(_fields())), 'shows')
+
+
+def season_episodes_response(show_id, season_id):
+    """GET /api/shows/<id>/seasons/<id>/episodes: that season's episodes.
+    With ?limit= or ?cursor=, {'episodes': [...], 'next_cursor': ...} a
+    page at a time, the cursor following the episode's media_id as the
+    shows' follows the show's ID; without, all of them."""
+    show = shows_catalog.index().get(show_id)
+    if show is None:
+        return jsonify({'error': 'Show not found'}), 404
+    season = show.season(season_id)
+    if season is None:
+        return jsonify({'error': 'Season not found'}), 404
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return conditional(jsonify(season.episodes()), 'shows')
+
+    limit = _limit(EPISODES_PAGE_SIZE, EPISODES_PAGE_MAX)
+    if limit is None:
+        return jsonify({'error': 'limit must be a number'}), 400
+    index = RecordIndex(season.episodes(), key=itemgetter('media_id'))
+    episodes, cursor = index.page(request.args.get('cursor'), limit)
+    return conditional(jsonify({'episodes': episodes, 'next_cursor': cursor}), 'shows')
@@ -0,0 +1,238 @@
+"""In-memory model of the shows and VOD seasons catalogs.
+
+The JSON API hands out every episode as {'filename', 'path', 'media_id'},
+and the catalogs used to be stored and kept in memory that way too, with
+the season's folder (often 150 characters of Windows path) repeated for
+every episode. Here a season keeps its folder once, interned, and a tuple
+of filenames; full episode dicts are only built when a response or an
+admin edit asks for them.
+"""
+import base64
+import hashlib
+import json
+import os
+import sys
+
+MEDIA_ID_LENGTH = 12
+
+
+def media_id(path):
+    """Short, URL-safe ID for a media file, the same for a path across
+    restarts and in every catalog that lists it"""
+    digest = hashlib.sha1(os.path.normpath(path).encode('utf-8')).digest()
+    return base64.urlsafe_b64encode(digest[:9]).decode('ascii')
+
+
+def next_id(ids):
+    """One more than the highest numeric ID. len() + 1 handed out an ID
+    that was still in use as soon as anything but the last item had been
+    deleted."""
+    return str(max((int(i) for i in ids if str(i).isdigit()), default=0) + 1)
+
+
+def _split(path):
+    """(folder with its trailing separator, filename); either separator
+    counts, since the catalog may hold Windows paths on any OS"""
+    cut = max(path.rfind('/'), path.rfind('\\')) + 1
+    return path[:cut], path[cut:]
+
+
+class Season:
+    """A season's episodes as one folder and the files in it.
+
+    folder ends with a separator, so an episode's path is folder + file
+    exactly as it was given. titles is only kept when some episode's
+    filename isn't the last part of its path, and episode_ids only when the
+    episodes have IDs other than '1', '2', ... (numbered says whether they
+    have IDs at all).
+    """
+
+    __slots__ = ('id', 'name', 'folder', 'files', 'titles', 'numbered', 'episode_ids',
+                 'extra', '_media_ids')
+
+    def __init__(self, id, name, folder, files, titles=None, numbered=False,
+                 episode_ids=None, extra=None):
+        self.id = id
+        self.name = name
+        self.folder = sys.intern(folder)
+        self.files = tuple(files)
+        self.titles = tuple(titles) if titles is not None else None
+        self.numbered = numbered
+        self.episode_ids = tuple(episode_ids) if episode_ids is not None else None
+        self.extra = extra or None
+        self._media_ids = None
+
+    @classmethod
+    def from_dict(cls, season):
+        """From a season as stored (compact) or as the API shows it"""
+        season = dict(season)
+        if 'files' in season:
+            return cls(
+                season.pop('id'), season.pop('name', ''), season.pop('folder', ''),
+                season.pop('files'), season.pop('titles', None), season.pop('numbered', False),
+                season.pop('episode_ids', None), season
+            )
+
+        episodes = season.pop('episodes', [])
+        paths = [e['path'] for e in episodes]
+        # Common folder of all the episodes, cut back to a separator
+        folder = _split(os.path.commonprefix(paths))[0] if paths else ''
+        files = [p[len(folder):] for p in paths]
+        titles = [e.get('filename', '') for e in episodes]
+        if all(title == _split(p)[1] for title, p in zip(titles, paths)):
+            titles = None
+        numbered = bool(episodes) and all('id' in e for e in episodes)
+        episode_ids = [e['id'] for e in episodes] if numbered else None
+        if episode_ids == [str(i) for i in range(1, len(episodes) + 1)]:
+            episode_ids = None
+        return cls(season.pop('id'), season.pop('name', ''), folder, files, titles,
+                   numbered, episode_ids, season)
+
+    def __len__(self):
+        return len(self.files)
+
+    def paths(self):
+        folder = self.folder
+        return [folder + f for f in self.files]
+
+    def media_ids(self):
+        """IDs of the episodes, packed into one bytes object"""
+        if self._media_ids is None:
+            self._media_ids = ''.join(media_id(p) for p in self.paths()).encode('ascii')
+        return self._media_ids
+
+    def episodes(self):
+        """Episode dicts as the API shows them"""
+        ids = self.media_ids()
+        episodes = []
+        for i, path in enumerate(self.paths()):
+            episode = {
+                'filename': self.titles[i] if self.titles is not None else _split(path)[1],
+                'path': path,
+                'media_id': ids[i * MEDIA_ID_LENGTH:(i + 1) * MEDIA_ID_LENGTH].decode('ascii'),
+            }
+            if self.numbered:
+                episode['id'] = self.episode_ids[i] if self.episode_ids is not None else str(i + 1)
+            episodes.append(episode)
+        return episodes
+
+    def to_api(self):
+        season = dict(self.extra or {})
+        season.update(id=self.id, name=self.name, episodes=self.episodes())
+        return season
+
+    def summary(self):
+        """The season without its episodes, only how many there are"""
+        season = dict(self.extra or {})
+        season.update(id=self.id, name=self.name, episode_count=len(self.files))
+        return season
+
+    def to_disk(self):
+        season = dict(self.extra or {})
+        season.update(id=self.id, name=self.name, folder=self.folder, files=list(self.files))
+        if self.titles is not None:
+            season['titles'] = list(self.titles)
+        if self.numbered:
+            season['numbered'] = True
+        if self.episode_ids is not None:
+            season['episode_ids'] = list(self.episode_ids)
+        return season
+
+
+class Show:
+    __slots__ = ('id', 'name', 'poster', 'seasons', 'extra')
+
+    def __init__(self, id, name, poster, seasons, extra=None):
+        self.id = id
+        self.name = name
+        self.poster = poster
+        self.seasons = seasons
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, show):
+        show = dict(show)
+        seasons = [Season.from_dict(s) for s in show.pop('seasons', [])]
+        return cls(show.pop('id'), show.pop('name', ''), show.pop('poster', ''), seasons, show)
+
+    def paths(self):
+        return [path for season in self.seasons for path in season.paths()]
+
+    def to_api(self):
+        show = dict(self.extra or {})
+        show.update(id=self.id, name=self.name, poster=self.poster,
+                    seasons=[s.to_api() for s in self.seasons])
+        return show
+
+    def summary(self, fields):
+        """Only the given fields of the show; its seasons, if asked for,
+        as Season.summary() has them"""
+        show = {}
+        for field in fields:
+            if field == 'seasons':
+                show['seasons'] = [s.summary() for s in self.seasons]
+            elif field in ('id', 'name', 'poster'):
+                show[field] = getattr(self, field)
+            elif self.extra and field in self.extra:
+                show[field] = self.extra[field]
+        return show
+
+    def season(self, season_id):
+        return next((s for s in self.seasons if s.id == season_id), None)
+
+    def to_disk(self):
+        show = dict(self.extra or {})
+        show.update(id=self.id, name=self.name, poster=self.poster,
+                    seasons=[s.to_disk() for s in self.seasons])
+        return show
+
+
+class RecordIndex:
+    """A snapshot's records by ID, and where each one is in the list.
+
+    Built once per snapshot (see index() on the catalogs) so looking up a
+    record or resuming a page is a dict lookup rather than a walk over the
+    catalog. Where old files have two records with one ID, the first is
+    the one found, as get() finds it. key gives a record's ID, for lists
+    of something other than records (a season's episode dicts).
+    """
+
+    def __init__(self, records, key=None):
+        self.records = records
+        self._key = key or (lambda record: record.id)
+        self._positions = {}
+        for i, record in enumerate(records):
+            self._positions.setdefault(self._key(record), i)
+
+    def get(self, record_id):
+        i = self._positions.get(record_id)
+        return self.records[i] if i is not None else None
+
+    def page(self, cursor, limit):
+        """(records, next cursor) for up to limit records from cursor on.
+        The cursor is 'position:ID' of the last record sent, so a page is
+        found again by position even with duplicate IDs, and by ID when
+        records before it were added or removed; None when done."""
+        start = 0
+        if cursor:
+            position, _, last_id = cursor.partition(':')
+            start = int(position) + 1 if position.isdigit() else 0
+            if not (0 < start <= len(self.records) and self._key(self.records[start - 1]) == last_id):
+                # Moved since: go on after it, or where it was if it's gone
+                i = self._positions.get(last_id)
+                start = i + 1 if i is not None else min(start, len(self.records))
+        records = self.records[start:start + limit]
+        end = start + len(records)
+        if end >= len(self.records):
+            return records, None
+        return records, f'{end - 1}:{self._key(self.records[end - 1])}'
+
+
+def stream_records(records):
+    """The API's JSON array of records, a record at a time"""
+    yield b'['
+    for i, record in enumerate(records):
+        if i:
+            yield b','
+        yield json.dumps(record.to_api(), sort_keys=True, separators=(',', ':')).encode('utf-8')
+    yield b']'
@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from fd_pool import file_pool
+
+# ===== CONFIG =====
+# How often the order files were watched in is written to their mtimes, and
+# the directory read again for what other processes added or evicted
+TOUCH_SECONDS = 60
+RESCAN_SECONDS = 30
+# A .tmp or .lock file this old is left over, whoever it belongs to
+STALE_SECONDS = 24 * 3600
+# ==================
+
+
+def _alive(pid):
+    if os.name == 'nt':
+        # os.kill would end it; there the age is all we go by
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Someone else's
+        return True
+    return True
+
+
+class DiskCache:
+    """Generated files kept in one directory, capped at max_bytes by deleting
+    the least recently used ones.
+
+    Files are written by the caller to tmp_path() and handed over with put(),
+    which renames them into place, so a crash never leaves half a file under
+    a real key. Recency is kept in memory and written to the files' mtimes
+    every TOUCH_SECONDS, so the LRU order survives a restart. Pinned keys
+    are never evicted.
+
+    The directory may be shared by several processes (both apps, gunicorn
+    workers): tmp names carry the pid, so only files of processes that are
+    gone are cleaned up; the listing is read again every RESCAN_SECONDS, so
+    the size limit covers what all of them wrote; and claim() lets only one
+    of them make a given key.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = None  # key -> size, least recently used first
+        self._used = OrderedDict()  # keys used since the mtimes were written
+        self._claims = set()
+        self._scanned_at = 0.0
+        self._touched_at = time.monotonic()
+        self._pinned = frozenset()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self):
+        now = time.monotonic()
+        if self._entries is None or now - self._scanned_at >= RESCAN_SECONDS:
+            self._scan()
+            self._scanned_at = now
+        return self._entries
+
+    def _scan(self):
+        first = self._entries is None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(('.tmp', '.lock')):
+                    if self._abandoned(entry.path, first):
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                if entry.is_file():
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, entry.name, st.st_size))
+        found.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in found)
+        # Watched here since the mtimes were last written
+        for key in self._used:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        self.size = sum(self._entries.values())
+
+    def _abandoned(self, path, first):
+        """True for a .tmp or .lock file no running process will finish"""
+        name = os.path.basename(path)
+        try:
+            if time.time() - os.stat(path).st_mtime > STALE_SECONDS:
+                return True
+            if name.endswith('.tmp'):
+                # <key>.<pid>.<thread>.tmp
+                pid = name.rsplit('.', 3)[1]
+            else:
+                with open(path, 'r', encoding='utf-8') as f:
+                    pid = f.read().strip()
+        except OSError:
+            return False
+        if not pid.isdigit():
+            return False
+        if int(pid) == os.getpid():
+            # Ours only if we wrote it: from before a restart that got the
+            # same pid (pid 1 in a container) otherwise
+            if name.endswith('.tmp'):
+                return first
+            return name[:-len('.lock')] not in self._claims
+        return not _alive(int(pid))
+
+    def path(self, key):
+        return self.directory / key
+
+    def tmp_path(self, key):
+        """Where to write a new file before put()ing it in as key"""
+        with self._lock:
+            self._load()
+        return self.directory / f'{key}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._load()
+
+    def get(self, key):
+        """Path of the cached file for key, or None. The file may still have
+        been evicted by another process since; callers handle it not being
+        there as a miss."""
+        with self._lock:
+            entries = self._load()
+            if key not in entries:
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self._used.pop(key, None)
+            self._used[key] = None
+            self.hits += 1
+            due = None
+            if time.monotonic() - self._touched_at >= TOUCH_SECONDS:
+                self._touched_at = time.monotonic()
+                due = list(self._used)
+                self._used.clear()
+
+        if due:
+            self._touch(due)
+        return self.path(key)
+
+    def _touch(self, keys):
+        gone = []
+        for key in keys:
+            try:
+                os.utime(self.path(key))
+            except OSError:
+                # Evicted by another process, or deleted behind our back
+                gone.append(key)
+        if gone:
+            with self._lock:
+                for key in gone:
+                    self.size -= self._entries.pop(key, 0)
+
+    def claim(self, key):
+        """Take the lock file for making key; False while another running
+        process holds it. Give it back with release()."""
+        lock_path = self.directory / f'{key}.lock'
+        with self._lock:
+            self._load()
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            with self._lock:
+                stale = self._abandoned(lock_path, False)
+            if not stale:
+                return False
+            # Its process died mid-conversion
+            try:
+                os.remove(lock_path)
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(str(os.getpid()))
+        with self._lock:
+            self._claims.add(key)
+        return True
+
+    def release(self, key):
+        with self._lock:
+            self._claims.discard(key)
+        try:
+            os.remove(self.directory / f'{key}.lock')
+        except OSError:
+            pass
+
+    def adopt(self, key):
+        """True if key is in the cache, taking it in if another process put
+        it there since the directory was last read"""
+        try:
+            size = os.path.getsize(self.path(key))
+        except OSError:
+            return False
+        with self._lock:
+            entries = self._load()
+            if key not in entries:
+                entries[key] = size
+                self.size += size
+        return True
+
+    def put(self, key, tmp_path):
+        """Move the finished tmp_path into the cache as key; returns its path"""
+        size = os.path.getsize(tmp_path)
+        path = self.path(key)
+        os.replace(tmp_path, path)
+        with self._lock:
+            entries = self._load()
+            self.size -= entries.pop(key, 0)
+            entries[key] = size
+            self.size += size
+            self._used.pop(key, None)
+            self._evict()
+        return path
+
+    def pin(self, keys):
+        """Replace the set of keys that must not be evicted"""
+        with self._lock:
+            self._pinned = frozenset(keys)
+
+    def _evict(self):
+        # The newest entry always stays, even if it alone is over the limit
+        newest = next(reversed(self._entries), None)
+        for key in list(self._entries):
+            if self.size <= self.max_bytes:
+                break
+            if key == newest or key in self._pinned:
+                continue
+            self.size -= self._entries.pop(key)
+            self._used.pop(key, None)
+            self.evictions += 1
+            # Let go of it if it is being served through the pool
+            file_pool.forget(str(self.path(key)))
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                # Still open for sending on Windows; it will be picked up
+                # again (and evicted) on the next scan
+                pass
+
+    def clear(self):
+        with self._lock:
+            entries = self._load()
+            for key in entries:
+                file_pool.forget(str(self.path(key)))
+                try:
+                    os.remove(self.path(key))
+                except OSError:
+                    pass
+            entries.clear()
+            self._used.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._load()
+            lookups = self.hits + self.misses
+            return {
+                'max_bytes': self.max_bytes,
+                'used_bytes': self.size,
+                'files': len(entries),
+                'pinned': len(self._pinned & entries.keys()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
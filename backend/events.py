@@ -0,0 +1,182 @@
+"""In-process publish/subscribe, and the /api/events stream that carries it
+to browsers as Server-Sent Events.
+
+Events are kept in a short numbered log rather than pushed into a queue
+per subscriber. A stream remembers the last ID it sent and reads on from
+there, so a browser that reconnects (EventSource does so by itself, with
+a Last-Event-ID header) gets what it missed. If it was gone so long that
+those events are no longer kept, it gets a 'reset' event and reloads
+everything.
+
+The bus lives in one process, so live updates assume the single-process
+async runtime (serve.py's default). Under gunicorn with several workers a
+stream only hears what happened in its own worker: catalog changes still
+reach every stream, since each worker's catalog_events monitor compares
+the shared catalog itself, but stream, transcode and fast-start events
+do not, and serve.py warns about it.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from flask import Response, request
+
+# ===== CONFIG =====
+# Recent events kept for streams that fell behind or reconnected
+EVENT_HISTORY = 256
+# A comment line this often keeps proxies and idle timeouts from closing
+# a quiet stream, and shows when the browser has gone
+SSE_HEARTBEAT_SECONDS = 15.0
+# ==================
+
+# Where the async server puts its Pacer (see async_server, shaping)
+PACER_KEY = 'async_server.pacer'
+
+
+class EventBus:
+    """Publish/subscribe for changes to the catalog and the library.
+
+    Callbacks run on the publishing thread, so they should only hand the
+    event on (to a queue, say) and return.
+    """
+
+    def __init__(self, history=EVENT_HISTORY):
+        self._subscribers = []
+        self._waiters = []
+        self._changed = threading.Condition()
+        self._next_id = 1
+        self.recent = deque(maxlen=history)
+
+    @property
+    def last_id(self):
+        return self._next_id - 1
+
+    def subscribe(self, callback):
+        """Call callback(event) for every event from now on"""
+        with self._changed:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._changed:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, kind, data):
+        with self._changed:
+            event = {'id': self._next_id, 'type': kind, 'time': time.time(), 'data': data}
+            self._next_id += 1
+            self.recent.append(event)
+            subscribers = list(self._subscribers)
+            waiters, self._waiters = self._waiters, []
+            self._changed.notify_all()
+        for callback in subscribers:
+            callback(event)
+        for wake in waiters:
+            wake()
+        return event
+
+    def after(self, last_id):
+        """Events published since last_id, or None if some of them are no
+        longer kept"""
+        with self._changed:
+            if last_id >= self.last_id:
+                return []
+            if not self.recent or self.recent[0]['id'] > last_id + 1:
+                return None
+            return [e for e in self.recent if e['id'] > last_id]
+
+    def wait(self, last_id, timeout):
+        """Until something is published after last_id, or timeout"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.last_id > last_id, timeout)
+
+    def notify(self, last_id, wake):
+        """Call wake() once, as soon as something is published after
+        last_id (on the publishing thread); returns a function that
+        cancels it. For waiting without a thread, see event_stream."""
+        with self._changed:
+            published = self.last_id > last_id
+            if not published:
+                self._waiters.append(wake)
+        if published:
+            wake()
+
+        def cancel():
+            with self._changed:
+                if wake in self._waiters:
+                    self._waiters.remove(wake)
+        return cancel
+
+
+def _format(event):
+    data = json.dumps(event['data'], separators=(',', ':'))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n".encode('utf-8')
+
+
+def event_stream(bus, last_id=None, pacer=None, monitor=None):
+    """SSE body: every event after last_id (default: from now on).
+
+    Under the async server a quiet stream hands the server a pause until the
+    next heartbeat, which the bus cuts short when something is published,
+    so it holds no thread and costs nothing while idle. monitor, if given,
+    is told while the stream is open, for sources that are checked rather
+    than pushed (see catalog_events).
+    """
+    # An ID from before a restart: what it missed is gone
+    restarted = last_id is not None and last_id > bus.last_id
+    if last_id is None or restarted:
+        last_id = bus.last_id
+    yield b'retry: 3000\n\n'
+    if restarted:
+        yield _format({'id': last_id, 'type': 'reset', 'data': {}})
+    if monitor is not None:
+        monitor.listen()
+    try:
+        yield from _events(bus, last_id, pacer)
+    finally:
+        if monitor is not None:
+            monitor.unlisten()
+
+
+def _events(bus, last_id, pacer):
+    quiet_since = time.monotonic()
+    while True:
+        events = bus.after(last_id)
+        if events is None:
+            events = [{'id': bus.last_id, 'type': 'reset', 'data': {}}]
+        if events:
+            last_id = events[-1]['id']
+            quiet_since = time.monotonic()
+            yield b''.join(_format(e) for e in events)
+            continue
+
+        now = time.monotonic()
+        quiet = now - quiet_since
+        if quiet >= SSE_HEARTBEAT_SECONDS:
+            quiet_since = now
+            yield b': ping\n\n'
+        elif pacer is not None:
+            pacer.delay = SSE_HEARTBEAT_SECONDS - quiet
+            pacer.wake_on = lambda wake, last_id=last_id: bus.notify(last_id, wake)
+            yield b''
+        else:
+            bus.wait(last_id, SSE_HEARTBEAT_SECONDS - quiet)
+
+
+def sse_response(bus, monitor=None):
+    """Response streaming bus to the browser; see the module docstring"""
+    try:
+        last_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_id = None
+    body = event_stream(bus, last_id, request.environ.get(PACER_KEY), monitor)
+    return Response(body, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Tell nginx and the like not to hold events back
+        'X-Accel-Buffering': 'no',
+    })
+
+
+event_bus = EventBus()
@@ -0,0 +1,248 @@
+import argparse
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from events import event_bus
+from media_probe import media_cache, iter_boxes
+
+# ===== CONFIG =====
+FASTSTART_WORKERS = 2
+COPY_CHUNK = 1024 * 1024
+# ==================
+
+# Boxes we descend into to find every chunk offset table
+OFFSET_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+
+class FaststartError(Exception):
+    """The file can't be rewritten in place by us"""
+
+
+def needs_faststart(info):
+    """True for probe info of an mp4 whose moov comes after its media data"""
+    return bool(info) and info.get('container') == 'mp4' and info.get('faststart') is False
+
+
+def _patch_offsets(moov, start, end, shift):
+    """Apply shift(offset) to every stco/co64 entry in moov[start:end]"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', moov, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', moov, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise FaststartError(f'Corrupt {box_type!r} box in moov')
+
+        payload = offset + header
+        if box_type in OFFSET_CONTAINERS:
+            _patch_offsets(moov, payload, offset + size, shift)
+        elif box_type == b'stco':
+            count = struct.unpack_from('>I', moov, payload + 4)[0]
+            for i in range(count):
+                position = payload + 8 + i * 4
+                value = shift(struct.unpack_from('>I', moov, position)[0])
+                if value > 0xFFFFFFFF:
+                    raise FaststartError('32-bit chunk offsets would overflow')
+                struct.pack_into('>I', moov, position, value)
+        elif box_type == b'co64':
+            count = struct.unpack_from('>I', moov, payload + 4)[0]
+            for i in range(count):
+                position = payload + 8 + i * 8
+                value = shift(struct.unpack_from('>Q', moov, position)[0])
+                struct.pack_into('>Q', moov, position, value)
+        offset += size
+
+
+def _copy_range(src, dst, start, end):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = src.read(min(COPY_CHUNK, remaining))
+        if not chunk:
+            raise FaststartError('File shrank while rewriting')
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def make_faststart(path):
+    """Move the moov box of path in front of its media data, atomically.
+
+    Everything between the old media start and the old moov moves down by
+    the size of moov, so every chunk offset pointing there is shifted by
+    the same amount. The new file is written next to the original and
+    renamed over it. Returns False if path was already fast-start.
+    """
+    with open(path, 'rb') as src:
+        file_size = os.fstat(src.fileno()).st_size
+        boxes = list(iter_boxes(src, 0, file_size))
+
+        moov = next((b for b in boxes if b[0] == b'moov'), None)
+        first_mdat = next((b for b in boxes if b[0] == b'mdat'), None)
+        if moov is None:
+            raise FaststartError('No moov box')
+        if first_mdat is None or moov[1] < first_mdat[1]:
+            return False
+
+        _, moov_start, _, moov_end = moov
+        insert_at = first_mdat[1]
+        moov_size = moov_end - moov_start
+
+        src.seek(moov_start)
+        moov_data = bytearray(src.read(moov_size))
+
+        def shift(offset):
+            if insert_at <= offset < moov_start:
+                return offset + moov_size
+            return offset
+
+        _patch_offsets(moov_data, 0, moov_size, shift)
+
+        tmp_path = f'{path}.faststart.tmp'
+        try:
+            with open(tmp_path, 'wb') as dst:
+                _copy_range(src, dst, 0, insert_at)
+                dst.write(moov_data)
+                _copy_range(src, dst, insert_at, moov_start)
+                _copy_range(src, dst, moov_end, file_size)
+                dst.flush()
+                os.fsync(dst.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    # Permissions only; the new mtime is what tells the probe cache and the
+    # block cache that the file changed
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _make_faststart_ffmpeg(path):
+    """Fallback for files we can't patch ourselves (e.g. stco overflow)"""
+    if not shutil.which('ffmpeg'):
+        raise FaststartError('ffmpeg is not installed')
+    tmp_path = f'{path}.faststart.tmp'
+    result = subprocess.run(
+        ['ffmpeg', '-y', '-v', 'error', '-i', path, '-map', '0', '-c', 'copy',
+         '-movflags', '+faststart', '-f', 'mp4', tmp_path],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise FaststartError(result.stderr.strip() or 'ffmpeg failed')
+    os.replace(tmp_path, path)
+    return True
+
+
+def fix_file(path):
+    """Worker entry point: rewrite one file, return (path, error or None)"""
+    try:
+        try:
+            make_faststart(path)
+        except FaststartError:
+            _make_faststart_ffmpeg(path)
+    except (OSError, FaststartError) as e:
+        return path, str(e)
+    return path, None
+
+
+def _result(future, path):
+    """(path, error) of a fix_file future, also when the worker itself died"""
+    try:
+        return future.result()
+    except Exception as e:
+        return path, str(e) or type(e).__name__
+
+
+def find_candidates(paths):
+    """The paths (mp4s) whose moov is at the end of the file"""
+    infos = media_cache.get_many(paths)
+    return [path for path, info in zip(paths, infos) if needs_faststart(info)]
+
+
+class FaststartJob:
+    """Background batch fix of a library, with progress for the admin page"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.state = {'running': False, 'total': 0, 'done': 0, 'failed': []}
+
+    def status(self):
+        with self._lock:
+            return dict(self.state, failed=list(self.state['failed']))
+
+    def start(self, paths, workers=FASTSTART_WORKERS):
+        with self._lock:
+            if self.state['running']:
+                return False
+            self.state = {'running': True, 'total': len(paths), 'done': 0, 'failed': []}
+        event_bus.publish('faststart', self.status())
+        self._thread = threading.Thread(target=self._run, args=(paths, workers), daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self, paths, workers):
+        try:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = {pool.submit(fix_file, path): path for path in paths}
+                for future in as_completed(futures):
+                    path, error = _result(future, futures[future])
+                    with self._lock:
+                        self.state['done'] += 1
+                        if error:
+                            self.state['failed'].append({'path': path, 'error': error})
+                    event_bus.publish('faststart', self.status())
+        finally:
+            with self._lock:
+                self.state['running'] = False
+            event_bus.publish('faststart', self.status())
+
+
+faststart_job = FaststartJob()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find mp4s with the moov atom at the end and rewrite them to fast-start."
+    )
+    parser.add_argument("paths", nargs="+", help="mp4 files or folders to scan recursively")
+    parser.add_argument("--fix", action="store_true", help="Rewrite the files (default: only list them)")
+    parser.add_argument("-j", "--jobs", type=int, default=FASTSTART_WORKERS, help="Files to rewrite at once")
+    args = parser.parse_args()
+
+    files = []
+    for arg in args.paths:
+        if os.path.isdir(arg):
+            for dirpath, _, filenames in os.walk(arg):
+                files.extend(
+                    os.path.join(dirpath, f) for f in sorted(filenames)
+                    if f.lower().endswith(('.mp4', '.m4v', '.mov'))
+                )
+        else:
+            files.append(arg)
+
+    candidates = find_candidates(files)
+    print(f"{len(candidates)} of {len(files)} files need fast-start")
+    for path in candidates:
+        print(f"  {path}")
+
+    if args.fix and candidates:
+        with ProcessPoolExecutor(args.jobs) as pool:
+            futures = {pool.submit(fix_file, path): path for path in candidates}
+            for future in as_completed(futures):
+                path, error = _result(future, futures[future])
+                print(f"{'FAILED' if error else 'FIXED'}: {path}{f' ({error})' if error else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ===== CONFIG =====
+# Open media files kept around between range requests. Each costs a file
+# descriptor (handle on Windows); keep it well under `ulimit -n`.
+FD_POOL_SIZE = int(os.environ.get('FD_POOL_SIZE', 64))
+# Files nobody has read for this long are closed. Windows won't replace or
+# delete a file that is open, so this is how long that can be held up.
+FD_IDLE_SECONDS = float(os.environ.get('FD_IDLE_SECONDS', 30))
+# ==================
+
+OPEN_FLAGS = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+
+
+def file_identity(path, st):
+    """Key that changes whenever the file at path is replaced or rewritten"""
+    return (path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class _Handle:
+    __slots__ = ('fd', 'identity', 'refs', 'used_at', 'retired', 'lock')
+
+    def __init__(self, fd, identity, now):
+        self.fd = fd
+        self.identity = identity
+        self.refs = 0
+        self.used_at = now
+        self.retired = False
+        # Only needed where there is no pread and reads must seek first
+        self.lock = threading.Lock()
+
+
+def _pread(handle, size, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(handle.fd, size, offset)
+    with handle.lock:
+        os.lseek(handle.fd, offset, os.SEEK_SET)
+        return os.read(handle.fd, size)
+
+
+def _fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+class FilePool:
+    """LRU pool of open file descriptors, shared by every stream of a file.
+
+    A player sends a range request every few seconds, and every one used to
+    open, seek, read and close the episode again. Handles here are read
+    with pread(), which takes the offset with each call, so any number of
+    threads can read one without getting in each other's way. A handle is
+    keyed by path and dropped as soon as the file's identity changes, so a
+    replaced or rewritten file is never read through a stale descriptor.
+    """
+
+    def __init__(self, max_open=FD_POOL_SIZE, idle_seconds=FD_IDLE_SECONDS):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._handles = OrderedDict()  # path -> _Handle, least recent first
+        self._lock = threading.Lock()
+        self._swept_at = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_open > 0
+
+    def _acquire(self, path, identity):
+        now = time.monotonic()
+        with self._lock:
+            handle = self._handles.get(path)
+            if handle is not None and handle.identity == identity:
+                self._handles.move_to_end(path)
+                self.hits += 1
+                handle.refs += 1
+                handle.used_at = now
+                to_close = self._evict(now)
+            else:
+                handle = None
+                self.misses += 1
+        if handle is not None:
+            for old in to_close:
+                os.close(old)
+            return handle
+
+        fd = os.open(path, OPEN_FLAGS)
+        to_close = []
+        with self._lock:
+            handle = self._handles.get(path)
+            if handle is not None and handle.identity == identity:
+                # Someone else opened it meanwhile
+                to_close.append(fd)
+            else:
+                if handle is not None:
+                    self.invalidations += 1
+                    to_close.extend(self._retire(path))
+                handle = self._handles[path] = _Handle(fd, identity, now)
+                to_close.extend(self._evict(now))
+            handle.refs += 1
+        for old in to_close:
+            os.close(old)
+        return handle
+
+    def _release(self, handle):
+        with self._lock:
+            handle.refs -= 1
+            close = handle.retired and handle.refs == 0
+        if close:
+            os.close(handle.fd)
+
+    def _retire(self, path):
+        """Take path out of the pool; returns the fds to close now (handles
+        still being read from are closed by their last reader)"""
+        handle = self._handles.pop(path)
+        handle.retired = True
+        return [handle.fd] if handle.refs == 0 else []
+
+    def _evict(self, now):
+        to_close = []
+        sweep = now - self._swept_at >= self.idle_seconds / 2
+        if sweep:
+            self._swept_at = now
+        elif len(self._handles) <= self.max_open:
+            return to_close
+        for path, handle in list(self._handles.items()):
+            over = len(self._handles) > self.max_open
+            idle = sweep and handle.refs == 0 and now - handle.used_at > self.idle_seconds
+            if not (over or idle):
+                if not sweep:
+                    break
+                continue
+            to_close.extend(self._retire(path))
+            self.evictions += 1
+        return to_close
+
+    def read(self, path, identity, size, offset):
+        """Up to size bytes of path from offset"""
+        if not self.enabled:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return f.read(size)
+        handle = self._acquire(path, identity)
+        try:
+            return _pread(handle, size, offset)
+        finally:
+            self._release(handle)
+
+    def iter_range(self, path, st, start, length, chunk_size):
+        """Yield length bytes of path starting at start, chunk_size at a
+        time, through one handle for the whole range"""
+        if not self.enabled:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+            return
+
+        handle = self._acquire(path, file_identity(path, st))
+        try:
+            offset, end = start, start + length
+            while offset < end:
+                chunk = _pread(handle, min(chunk_size, end - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            self._release(handle)
+
+    def forget(self, path=None):
+        """Close path's handle (or every handle) once nothing reads from it"""
+        with self._lock:
+            paths = list(self._handles) if path is None else [path]
+            to_close = []
+            for p in paths:
+                if p in self._handles:
+                    to_close.extend(self._retire(p))
+        for fd in to_close:
+            os.close(fd)
+
+    def stats(self):
+        with self._lock:
+            in_use = sum(1 for h in self._handles.values() if h.refs)
+            open_now = len(self._handles)
+        lookups = self.hits + self.misses
+        return {
+            'max_open': self.max_open,
+            'open': open_now,
+            'in_use': in_use,
+            'process_fd_limit': _fd_limit(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+        }
+
+
+file_pool = FilePool()
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+# ===== CONFIG =====
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm'}
+# How long a listing is trusted before the folder's mtime is checked again.
+# A directory's mtime changes whenever a file is added, removed or renamed.
+CHECK_INTERVAL = float(os.environ.get('FOLDER_CHECK_INTERVAL', 2.0))
+# ==================
+
+
+class _Listing:
+    __slots__ = ('mtime_ns', 'checked_at', 'files')
+
+    def __init__(self, mtime_ns, checked_at, files):
+        self.mtime_ns = mtime_ns
+        self.checked_at = checked_at
+        self.files = files
+
+
+class FolderIndex:
+    """Sorted media listings per folder, rescanned only when a folder changes.
+
+    A lookup normally costs nothing; at most once per CHECK_INTERVAL it costs
+    a single stat of the folder itself, never one per file. That matters on
+    SMB mounts, where every stat is a network round trip.
+    """
+
+    def __init__(self, extensions=VIDEO_EXTENSIONS, check_interval=CHECK_INTERVAL):
+        self.extensions = extensions
+        self.check_interval = check_interval
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def _scan(self, folder_path):
+        # scandir returns the file type with each entry, so unlike
+        # listdir + isfile this needs no extra stat per file
+        with os.scandir(folder_path) as entries:
+            files = [
+                entry.name for entry in entries
+                if Path(entry.name).suffix.lower() in self.extensions
+                and entry.is_file()
+            ]
+        return tuple(sorted(files))
+
+    def files(self, folder_path):
+        """Sorted media filenames in folder_path, or () if it can't be read"""
+        now = time.monotonic()
+        listing = self._listings.get(folder_path)
+        if listing is not None and now - listing.checked_at < self.check_interval:
+            return listing.files
+
+        try:
+            mtime_ns = os.stat(folder_path).st_mtime_ns
+            if listing is not None and listing.mtime_ns == mtime_ns:
+                listing.checked_at = now
+                return listing.files
+            files = self._scan(folder_path)
+        except OSError:
+            with self._lock:
+                self._listings.pop(folder_path, None)
+            return ()
+
+        with self._lock:
+            self._listings[folder_path] = _Listing(mtime_ns, now, files)
+        return files
+
+    def refresh(self, folder_path):
+        """List folder_path now and keep the listing; unlike files(), raises
+        OSError when the folder can't be read"""
+        mtime_ns = os.stat(folder_path).st_mtime_ns
+        files = self._scan(folder_path)
+        with self._lock:
+            self._listings[folder_path] = _Listing(mtime_ns, time.monotonic(), files)
+        return files
+
+    def rescan(self, folder_path=None):
+        """Forget cached listings for folder_path (or all folders)"""
+        with self._lock:
+            if folder_path is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(folder_path, None)
+
+
+folder_index = FolderIndex()
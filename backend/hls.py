@@ -0,0 +1,285 @@
+import hashlib
+import math
+import os
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from catalog import DATA_DIR
+from disk_cache import DiskCache
+from media_probe import media_cache, keyframe_index, ProbeError
+from transcode import video_playable, audio_playable
+
+# ===== CONFIG =====
+HLS_CACHE_DIR = DATA_DIR / 'hls_cache'
+HLS_CACHE_MB = int(os.environ.get('HLS_CACHE_MB', 4096))
+SEGMENT_SECONDS = 6
+# Segments generated ahead of the one the player just asked for
+PREFETCH_SEGMENTS = int(os.environ.get('HLS_PREFETCH', 3))
+PREFETCH_WORKERS = 2
+TRANSCODE_PRESET = 'veryfast'
+TRANSCODE_CRF = 21
+AUDIO_BITRATE = '160k'
+PLANS_KEPT = 64
+# ==================
+
+# ffmpeg seeks up to 3/23 s early in containers that index by decode time
+# (Matroska with B-frames); aiming this far past a keyframe still lands on it
+COPY_SEEK_SLACK = 0.15
+# Well under one frame at any real frame rate
+CUT_SLACK = 0.001
+
+
+class HlsError(Exception):
+    """A playlist or segment couldn't be produced"""
+
+
+class HlsPlan:
+    """How one file is cut into segments.
+
+    When the video can be stream-copied, segments start on keyframes
+    (taken from the container index) roughly SEGMENT_SECONDS apart, so
+    each one is a cheap copy of a byte range. Otherwise they are cut every
+    SEGMENT_SECONDS and each is encoded the first time it is asked for.
+    """
+
+    __slots__ = ('path', 'key', 'copy_video', 'copy_audio', 'boundaries', 'frames')
+
+    def __init__(self, path, key, copy_video, copy_audio, boundaries, frames):
+        self.path = path
+        self.key = key
+        self.copy_video = copy_video
+        self.copy_audio = copy_audio
+        self.boundaries = boundaries  # segment start times, then the end
+        self.frames = frames  # video frames per segment, where known
+
+    def __len__(self):
+        return len(self.boundaries) - 1
+
+    def segment(self, index):
+        """(start, duration) in seconds of segment index"""
+        start = self.boundaries[index]
+        return start, self.boundaries[index + 1] - start
+
+    def segment_key(self, index):
+        return f'{self.key}-{index:05d}.ts'
+
+    def playlist(self):
+        durations = [self.segment(i)[1] for i in range(len(self))]
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{math.ceil(max(durations))}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        for index, duration in enumerate(durations):
+            lines.append(f'#EXTINF:{duration:.3f},')
+            lines.append(f'{index}.ts')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+
+def _cut(duration, keyframes):
+    """(segment start times plus the end time, frames per segment) for
+    keyframes as given by keyframe_index, or fixed-length cuts without"""
+    if not keyframes:
+        keyframes = [
+            (i * SEGMENT_SECONDS, None)
+            for i in range(1, math.ceil(duration / SEGMENT_SECONDS))
+        ]
+
+    # No sliver of a last segment: fold it into the one before
+    last_cut = duration - SEGMENT_SECONDS / 2
+    boundaries = [0.0]
+    first_frames = [0]
+    for time, frame in keyframes:
+        if time - boundaries[-1] >= SEGMENT_SECONDS and time <= last_cut:
+            boundaries.append(time)
+            first_frames.append(frame)
+    boundaries.append(duration)
+
+    frames = [
+        end - start if start is not None and end is not None else None
+        for start, end in zip(first_frames, first_frames[1:])
+    ]
+    # The last segment runs to the end of the file
+    frames.append(None)
+    return boundaries, frames
+
+
+def build_plan(path, st):
+    info = media_cache.get(path)
+    if not info or 'error' in info or not info.get('duration'):
+        raise HlsError(f"Can't read {os.path.basename(path)}")
+
+    if not any(t['type'] == 'video' for t in info['tracks']):
+        raise HlsError('No video track')
+    # What any browser plays goes into the stream as it is
+    copy_video = video_playable(info)
+
+    keyframes = None
+    if copy_video:
+        try:
+            keyframes = keyframe_index(path)
+        except (OSError, ProbeError):
+            pass
+        # Without an index we can't tell where copied segments may start
+        copy_video = bool(keyframes)
+    # Copied audio would start from the demuxer's seek point rather than the
+    # cut, so it is only copied along with copied video
+    copy_audio = copy_video and audio_playable(info)
+
+    identity = f'{path}|{st.st_size}|{st.st_mtime_ns}|{copy_video}|{SEGMENT_SECONDS}'
+    key = hashlib.sha1(identity.encode('utf-8')).hexdigest()[:20]
+    boundaries, frames = _cut(info['duration'], keyframes)
+    return HlsPlan(path, key, copy_video, copy_audio, boundaries, frames)
+
+
+def segment_command(plan, index, out_path):
+    start, duration = plan.segment(index)
+    seek = start
+    if plan.copy_video:
+        # A copy starts at the last keyframe before the seek point, so aim
+        # just past the segment's own; the cut at the end goes by decode
+        # time, so with B-frames it runs a few frames long unless the frame
+        # count (known for mp4) trims it exactly
+        seek = start + COPY_SEEK_SLACK
+        duration = start + duration - CUT_SLACK - seek
+        video = ['-c:v', 'copy']
+        if plan.frames[index] is not None:
+            video += ['-frames:v', str(plan.frames[index])]
+    else:
+        # Cut a hair before each boundary so a frame sitting exactly on one
+        # goes to the later segment instead of being dropped by both
+        seek = max(0.0, start - CUT_SLACK)
+        duration = start + duration - CUT_SLACK - seek
+        video = [
+            '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+            '-preset', TRANSCODE_PRESET, '-crf', str(TRANSCODE_CRF),
+            # Source timestamps as they are; frame rate conversion would
+            # drop or repeat frames at the cuts
+            '-fps_mode', 'passthrough',
+        ]
+    if plan.copy_audio:
+        audio = ['-c:a', 'copy']
+    else:
+        audio = ['-c:a', 'aac', '-b:a', AUDIO_BITRATE, '-ac', '2']
+
+    return [
+        'ffmpeg', '-y', '-v', 'error', '-nostdin',
+        '-ss', f'{seek:.6f}', '-t', f'{duration:.6f}', '-i', plan.path,
+        '-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn',
+        *video,
+        *audio,
+        # Keep the segment's timestamps where it sits in the episode, so the
+        # player can line segments up however they were cut
+        '-output_ts_offset', f'{seek:.6f}',
+        '-f', 'mpegts', str(out_path)
+    ]
+
+
+class HlsPackager:
+    """Plans and segments for /api/media/<id>/hls, with generated segments
+    kept in a size-bounded disk cache. Concurrent requests for a segment
+    share one ffmpeg run, and the next few segments are made in the
+    background so the player rarely waits for one."""
+
+    def __init__(self, cache, prefetch=PREFETCH_SEGMENTS, workers=PREFETCH_WORKERS):
+        self.cache = cache
+        self.prefetch = prefetch
+        self._plans = OrderedDict()
+        self._pending = {}
+        self._playheads = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='hls-prefetch')
+
+    def plan(self, path):
+        """The plan for path, rebuilt when the file changes"""
+        st = os.stat(path)
+        identity = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._plans.get(path)
+            if cached is not None and cached[0] == identity:
+                self._plans.move_to_end(path)
+                return cached[1]
+
+        plan = build_plan(path, st)
+        with self._lock:
+            self._plans[path] = (identity, plan)
+            self._plans.move_to_end(path)
+            while len(self._plans) > PLANS_KEPT:
+                _, (_, old) = self._plans.popitem(last=False)
+                self._playheads.pop(old.key, None)
+        return plan
+
+    def segment(self, plan, index):
+        """Path of segment index of plan, generating it if needed"""
+        with self._lock:
+            self._playheads[plan.key] = index
+        path = self._get(plan, index)
+        for ahead in range(index + 1, min(index + 1 + self.prefetch, len(plan))):
+            self._pool.submit(self._prefetch, plan, ahead)
+        return path
+
+    def _get(self, plan, index):
+        key = plan.segment_key(index)
+        path = self.cache.get(key)
+        if path is not None:
+            return path
+
+        with self._lock:
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = Future()
+
+        if not leader:
+            return pending.result()
+
+        try:
+            path = self._generate(plan, index, key)
+            pending.set_result(path)
+            return path
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _generate(self, plan, index, key):
+        if not shutil.which('ffmpeg'):
+            raise HlsError('ffmpeg is not installed')
+        tmp_path = self.cache.tmp_path(key)
+        result = subprocess.run(
+            segment_command(plan, index, tmp_path),
+            capture_output=True, text=True, encoding='utf-8', errors='replace'
+        )
+        if result.returncode != 0 or not os.path.exists(tmp_path):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            errors = result.stderr.strip().splitlines()
+            raise HlsError(errors[-1] if errors else 'ffmpeg failed')
+        return self.cache.put(key, tmp_path)
+
+    def _prefetch(self, plan, index):
+        # The player may have seeked away while this waited in the queue
+        playhead = self._playheads.get(plan.key, -1)
+        if not playhead < index <= playhead + self.prefetch:
+            return
+        try:
+            self._get(plan, index)
+        except (OSError, HlsError):
+            pass
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['plans'] = len(self._plans)
+        stats['generating'] = len(self._pending)
+        return stats
+
+
+hls_packager = HlsPackager(DiskCache(HLS_CACHE_DIR, HLS_CACHE_MB * 1024 * 1024))
@@ -0,0 +1,35 @@
+import os
+
+from flask import request
+
+# ===== CONFIG =====
+# Cache-Control per route. 'no-cache' still lets browsers keep a copy; they
+# just revalidate it with If-None-Match and get an empty 304 back when
+# nothing changed. Override one with e.g. CACHE_CONTROL_SHOWS=max-age=60
+CACHE_POLICIES = {
+    'channels': 'no-cache',
+    'channel_episodes': 'no-cache',
+    'seasons': 'no-cache',
+    'shows': 'no-cache',
+    # Revalidated every time: fast-start rewrites files in place, and the
+    # ETag (size, mtime, inode) tells a browser its cached ranges are stale
+    'media': 'no-cache',
+    'hls_playlist': 'no-cache',
+    'hls_segment': 'private, max-age=3600',
+}
+# ==================
+
+
+def cache_policy(route):
+    """Cache-Control value for route, honouring environment overrides"""
+    override = os.environ.get(f'CACHE_CONTROL_{route.upper()}')
+    return override or CACHE_POLICIES.get(route, 'no-cache')
+
+
+def conditional(response, route):
+    """Apply route's cache policy and turn the response into a 304 if the
+    client's If-None-Match / If-Modified-Since still matches it"""
+    if response.get_etag() == (None, None) and not response.direct_passthrough:
+        response.add_etag()
+    response.headers['Cache-Control'] = cache_policy(route)
+    return response.make_conditional(request)
@@ -0,0 +1,158 @@
+import argparse
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog_records import next_id
+from folder_index import VIDEO_EXTENSIONS
+
+# ===== CONFIG =====
+# Season folders listed at once. On an SMB share listing a folder is
+# mostly waiting on the network, so this can be well above the CPU count.
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 8))
+# ==================
+
+# "Season 1", "season 02", "S3", "Series 4 (extras)"...
+SEASON_FOLDER = re.compile(r'^(?:season|series|s)[\s._-]*(\d+)(?!\d)', re.IGNORECASE)
+EPISODE_TAG = re.compile(r'S(\d{1,2})E(\d{1,3})', re.IGNORECASE)
+# The show's name is a release folder's name up to "(1998)"
+SHOW_NAME = re.compile(r'^(.*?)\s*[(\[](?:19|20)\d{2}[)\]]')
+
+
+def extract_episode(name):
+    """(season, episode) from an S06E01-style tag in name, or None"""
+    match = EPISODE_TAG.search(name)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def show_name(root):
+    name = os.path.basename(os.path.normpath(root))
+    match = SHOW_NAME.match(name)
+    return match.group(1) if match and match.group(1) else name
+
+
+def is_video(name):
+    """True for a video file that belongs in a season, for the import, the
+    watcher and the admin route alike. Hidden files are not: a
+    '._Episode.mp4' is macOS metadata on a share, not an episode."""
+    return not name.startswith('.') and os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS
+
+
+def _videos(folder):
+    """Paths of the video files right in folder"""
+    with os.scandir(folder) as entries:
+        return [e.path for e in entries if is_video(e.name) and e.is_file()]
+
+
+def episode_order(path):
+    """Sort key: the SxxEyy tag's episode number, then the filename"""
+    name = os.path.basename(path)
+    tag = extract_episode(name)
+    return (tag[1] if tag else math.inf, name)
+
+
+def sync_episodes(episodes, folder, files, numbered=False):
+    """Bring episodes (API dicts) in line with files, the current listing
+    of folder (ending in a separator, as Season.folder does).
+
+    Episodes from folder that are no longer there are dropped, and each new
+    file goes in before the first episode from folder that comes after it
+    in episode_order; everything else keeps its place. Returns (episodes,
+    added, removed), the last two as filenames.
+    """
+    def name_in_folder(episode):
+        path = episode['path']
+        if path.startswith(folder):
+            name = path[len(folder):]
+            if '/' not in name and '\\' not in name:
+                return name
+        return None
+
+    present = set(files)
+    kept, removed = [], []
+    for episode in episodes:
+        name = name_in_folder(episode)
+        if name is not None and name not in present:
+            removed.append(name)
+        else:
+            kept.append(episode)
+
+    known = {name_in_folder(e) for e in kept}
+    added = sorted((f for f in files if f not in known), key=episode_order)
+    first_id = int(next_id(e.get('id') for e in episodes))
+    for i, name in enumerate(added):
+        episode = {'filename': name, 'path': folder + name}
+        if numbered:
+            episode['id'] = str(first_id + i)
+        key = episode_order(name)
+        at = next((j for j, e in enumerate(kept)
+                   if name_in_folder(e) is not None and episode_order(name_in_folder(e)) > key),
+                  len(kept))
+        kept.insert(at, episode)
+    return kept, added, removed
+
+
+def scan_show(root, workers=IMPORT_WORKERS):
+    """The seasons of the show in root, as [(name, [(filename, path)])] in
+    season order.
+
+    Each `Season N` folder (or `S01`, `Series 2`...) is a season, listed in
+    a thread pool. Videos right in root go by their SxxEyy tag, or to
+    season 1 without one. Episodes are ordered by their tag's episode
+    number, then by filename.
+    """
+    folders = []
+    seasons = {}
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                match = SEASON_FOLDER.match(entry.name)
+                if match:
+                    folders.append((int(match.group(1)), entry.path))
+            elif is_video(entry.name):
+                tag = extract_episode(entry.name)
+                seasons.setdefault(tag[0] if tag else 1, []).append(entry.path)
+
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        listings = pool.map(_videos, [path for _, path in folders])
+        for (number, _), paths in zip(folders, listings):
+            seasons.setdefault(number, []).extend(paths)
+
+    return [
+        (f'Season {number}',
+         [(os.path.basename(p), p) for p in sorted(paths, key=episode_order)])
+        for number, paths in sorted(seasons.items()) if paths
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Add a show to the catalog from a folder with a subfolder per season."
+    )
+    parser.add_argument("root", help="The show's folder")
+    parser.add_argument("--name", help="Show name (default: the folder's name up to the year)")
+    parser.add_argument("--show-id", help="Import into this existing show instead; seasons it already has are replaced")
+    parser.add_argument("-j", "--jobs", type=int, default=IMPORT_WORKERS, help="Folders to list at once")
+    parser.add_argument("--dry-run", action="store_true", help="Only list what would be imported")
+    args = parser.parse_args()
+
+    seasons = scan_show(args.root, args.jobs)
+    for name, episodes in seasons:
+        print(f"{name}: {len(episodes)} episodes")
+    if not seasons:
+        parser.exit(1, "No video files found\n")
+    if args.dry_run:
+        return
+
+    # Not imported above, so --help and --dry-run don't load the catalog
+    from catalog import catalog_store
+
+    show = catalog_store.import_show(args.name or show_name(args.root), seasons, args.show_id)
+    if show is None:
+        parser.exit(1, f"No show with ID {args.show_id}\n")
+    print(f"Imported into show {show['id']} ({show['name']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+import traceback
+
+from catalog import catalog_store, channels_catalog, seasons_catalog, shows_catalog
+from events import event_bus
+from folder_index import folder_index
+from library_import import is_video
+
+# ===== CONFIG =====
+# 0 leaves the library alone; channels are then still listed when asked
+# for, and show and VOD seasons only change through the admin panel
+WATCH_LIBRARY = os.environ.get('WATCH_LIBRARY', '1') != '0'
+# Folders inotify can't watch (Windows, macOS) are checked with a stat
+# this often
+WATCH_POLL_SECONDS = float(os.environ.get('WATCH_POLL_SECONDS', 5.0))
+# And folders it does watch this often, for changes it can't see: ones
+# made from another machine on a network share
+WATCH_RECHECK_SECONDS = float(os.environ.get('WATCH_RECHECK_SECONDS', 60.0))
+# A folder is synced once it has had no new changes for this long, so a
+# batch rename or a season being copied in is one change, not dozens. A
+# new file is only added once its size and mtime have stayed the same
+# for at least this long, so one still being copied isn't.
+WATCH_SETTLE_SECONDS = 1.0
+# ==================
+
+IN_CLOSE_WRITE = 0x08
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+              | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify:
+    """Change notifications for folders, from the Linux kernel"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # Windows and macOS have no inotify_init1: AttributeError
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._keys = {}  # watch descriptor -> folder key
+        self._wds = {}  # folder key -> watch descriptor
+
+    @classmethod
+    def create(cls):
+        """An _Inotify, or None where there is none"""
+        try:
+            return cls()
+        except (OSError, AttributeError, TypeError):
+            return None
+
+    def watching(self, key):
+        return key in self._wds
+
+    def watch(self, key):
+        wd = self._add_watch(self.fd, os.fsencode(key), WATCH_MASK)
+        if wd < 0:
+            return False
+        self._keys[wd] = key
+        self._wds[key] = wd
+        return True
+
+    def unwatch(self, key):
+        wd = self._wds.pop(key, None)
+        if wd is not None:
+            self._keys.pop(wd, None)
+            # Fails harmlessly if the kernel already dropped it
+            self._rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        """Keys of the folders that changed within timeout seconds, or
+        None if the kernel dropped events and anything may have changed"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        try:
+            raw = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(raw):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(raw, offset)
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            key = self._keys.get(wd)
+            if key is None:
+                continue
+            changed.add(key)
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # The folder is gone (a moved one would still be watched
+                # under its new name); a new one there is watched afresh
+                self.unwatch(key)
+        return changed
+
+
+class _Folder:
+    """A folder some channel or season lists, and what we last saw in it"""
+    __slots__ = ('path', 'channels', 'seasons', 'known', 'mtime_ns', 'files', 'checked_at',
+                 'synced_at', 'sizes', 'pending', 'missing')
+
+    def __init__(self, path):
+        self.path = path  # as the catalog has it
+        self.channels = []  # channel IDs
+        self.seasons = []  # (show ID or None, season ID, Season.folder)
+        self.known = set()  # filenames its seasons already list
+        self.mtime_ns = None
+        self.files = None
+        self.checked_at = None
+        self.synced_at = None
+        self.sizes = {}  # new filename -> (size, mtime_ns) when last looked at
+        self.pending = frozenset()  # new files still changing
+        self.missing = {}  # listed filename not there -> when first missed
+
+
+def _watchable(season):
+    """True for a season whose episodes are all right in its folder"""
+    return bool(season.folder) and not any('/' in f or '\\' in f for f in season.files)
+
+
+class LibraryWatcher:
+    """Keeps the catalog in step with the folders it lists.
+
+    Every channel folder and every show or VOD season folder is watched,
+    with inotify where there is one and otherwise by checking the folder's
+    mtime every WATCH_POLL_SECONDS. A folder that changed is listed once and
+    compared with the catalog: new files are added to its seasons and
+    missing ones taken out (a rename is both), channel listings are
+    refreshed, and an event saying what changed is published on event_bus.
+    A folder that can't be read (an unplugged drive, a share that's down)
+    is left alone rather than emptied, and a file is only taken out once a
+    look recheck_seconds later still doesn't find it, so nothing is lost
+    to a share that's half mounted when we start.
+    """
+
+    def __init__(self, poll_seconds=WATCH_POLL_SECONDS, recheck_seconds=WATCH_RECHECK_SECONDS,
+                 settle_seconds=WATCH_SETTLE_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.recheck_seconds = recheck_seconds
+        self.settle_seconds = settle_seconds
+        self._folders = {}  # normalized path -> _Folder
+        self._catalogs = None
+        self._inotify = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.syncs = 0
+        self.changes = 0
+
+    def ensure_running(self):
+        """Start watching in this process, unless it already is (a forked
+        worker starts its own)"""
+        if not WATCH_LIBRARY or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._folders = {}
+            self._catalogs = None
+            self._inotify = _Inotify.create()
+            threading.Thread(target=self._run, name='library-watch', daemon=True).start()
+
+    def _run(self):
+        changed = set()
+        while True:
+            try:
+                self._update_folders()
+                changed |= self._due()
+                for key in changed:
+                    self._sync(key)
+                changed = self._wait()
+            except Exception:
+                traceback.print_exc()
+                changed = set()
+                time.sleep(self.poll_seconds)
+
+    def _update_folders(self):
+        """Match the folders watched to the catalog, if it changed"""
+        catalogs = (channels_catalog.data, seasons_catalog.data, shows_catalog.data)
+        if self._catalogs is not None and all(a is b for a, b in zip(catalogs, self._catalogs)):
+            return
+        self._catalogs = catalogs
+        channels, seasons, shows = catalogs
+
+        folders = {}
+
+        def folder(path):
+            key = os.path.normpath(path)
+            if key not in folders:
+                known = self._folders.get(key)
+                folders[key] = _Folder(path)
+                if known is not None:
+                    for attr in ('mtime_ns', 'files', 'checked_at', 'synced_at', 'sizes', 'pending',
+                                 'missing'):
+                        setattr(folders[key], attr, getattr(known, attr))
+            return folders[key]
+
+        for channel in channels.values():
+            folder(channel['folder_path']).channels.append(channel['id'])
+        for season in seasons:
+            if _watchable(season):
+                watched = folder(season.folder)
+                watched.seasons.append((None, season.id, season.folder))
+                watched.known.update(season.files)
+        for show in shows:
+            for season in show.seasons:
+                if _watchable(season):
+                    watched = folder(season.folder)
+                    watched.seasons.append((show.id, season.id, season.folder))
+                    watched.known.update(season.files)
+
+        if self._inotify is not None:
+            for key in set(self._folders) - set(folders):
+                self._inotify.unwatch(key)
+        self._folders = folders
+
+    def _due(self):
+        """Folders whose mtime changed, checked with a stat when it's their
+        turn; the ones never synced yet are always due"""
+        now = time.monotonic()
+        due = set()
+        for key, folder in self._folders.items():
+            if folder.checked_at is None:
+                due.add(key)
+                continue
+            if folder.pending and now - folder.synced_at >= self.settle_seconds:
+                # Files still being copied: see whether they're done
+                due.add(key)
+                continue
+            if folder.missing and now - folder.synced_at >= self.recheck_seconds:
+                # Files gone since the last look: see whether they still are
+                due.add(key)
+                continue
+            inotify = self._inotify is not None and (
+                self._inotify.watching(key) or self._inotify.watch(key)
+            )
+            interval = self.recheck_seconds if inotify else self.poll_seconds
+            if now - folder.checked_at < interval:
+                continue
+            folder.checked_at = now
+            try:
+                if os.stat(folder.path).st_mtime_ns != folder.mtime_ns:
+                    due.add(key)
+            except OSError:
+                pass
+        return due
+
+    def _wait(self):
+        """Folders inotify saw change, once they've settled; an empty set
+        after WATCH_POLL_SECONDS without any"""
+        if self._inotify is None:
+            time.sleep(self.poll_seconds)
+            return set()
+        changed = self._inotify.wait(self.poll_seconds)
+        while changed:
+            more = self._inotify.wait(self.settle_seconds)
+            if more is None:
+                changed = None
+            if not more:
+                break
+            changed |= more
+        # None: the kernel dropped events, so anything may have changed
+        return set(self._folders) if changed is None else changed
+
+    def _sync(self, key):
+        folder = self._folders.get(key)
+        if folder is None:
+            return
+        folder.checked_at = folder.synced_at = time.monotonic()
+        if self._inotify is not None and not self._inotify.watching(key):
+            # Before listing it, so nothing is missed in between
+            self._inotify.watch(key)
+        try:
+            mtime_ns = os.stat(folder.path).st_mtime_ns
+            files = folder_index.refresh(folder.path)
+        except OSError:
+            return
+        self.syncs += 1
+
+        first = folder.files is None
+        previous = folder.files or frozenset()
+        folder.files = frozenset(files)
+        folder.mtime_ns = mtime_ns
+        if not first and folder.files != previous:
+            for channel_id in folder.channels:
+                self._publish('channel', {
+                    'id': channel_id,
+                    'added': sorted(folder.files - previous),
+                    'removed': sorted(previous - folder.files),
+                })
+
+        if not folder.seasons:
+            return
+        # New videos go in once they've stopped changing; the ones still
+        # being copied in are left out (they aren't listed yet, so that
+        # removes nothing) until a look settle_seconds later finds them
+        # unchanged
+        videos = [f for f in files if is_video(f)]
+        sizes = {}
+        pending = set()
+        for name in videos:
+            if name in folder.known:
+                continue
+            try:
+                st = os.stat(os.path.join(folder.path, name))
+            except OSError:
+                pending.add(name)
+                continue
+            sizes[name] = (st.st_size, st.st_mtime_ns)
+            if folder.sizes.get(name) != sizes[name]:
+                pending.add(name)
+        folder.sizes = sizes
+        folder.pending = frozenset(pending)
+        videos = [f for f in videos if f not in pending]
+
+        # Listed files that aren't there stay listed until they have been
+        # missing for recheck_seconds: on the first look after a start, or
+        # on a share that's half mounted, they may well come back
+        now = folder.synced_at
+        folder.missing = {
+            name: folder.missing.get(name, now) for name in folder.known.difference(files)
+        }
+        videos += [name for name, since in folder.missing.items() if now - since < self.recheck_seconds]
+
+        for show_id, season_id, season_folder in folder.seasons:
+            result = catalog_store.sync_season(show_id, season_id, season_folder, videos)
+            if result is None or not (result[0] or result[1]):
+                continue
+            added, removed = result
+            if show_id is None:
+                self._publish('season', {'id': season_id, 'added': added, 'removed': removed})
+            else:
+                self._publish('show_season', {
+                    'show_id': show_id, 'id': season_id, 'added': added, 'removed': removed
+                })
+
+    def _publish(self, kind, data):
+        self.changes += 1
+        event_bus.publish(kind, data)
+
+    def stats(self):
+        folders = self._folders
+        inotify = self._inotify
+        return {
+            'enabled': WATCH_LIBRARY,
+            'running': self._pid == os.getpid(),
+            'inotify': inotify is not None,
+            'folders': len(folders),
+            'watched_by_inotify': sum(1 for k in folders if inotify is not None and inotify.watching(k)),
+            'polled': sum(1 for k in folders if inotify is None or not inotify.watching(k)),
+            'syncs': self.syncs,
+            'changes': self.changes,
+        }
+
+
+library_watcher = LibraryWatcher()
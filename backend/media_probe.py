@@ -0,0 +1,874 @@
+import argparse
+import atexit
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# ===== CONFIG =====
+DATA_DIR = Path(__file__).parent.parent / 'data'
+MEDIA_CACHE_FILE = DATA_DIR / 'media_cache.json'
+PROBE_WORKERS = 8
+# Seconds new probe results wait before the cache file is written, so a
+# library being probed a file at a time is written once, not per file
+FLUSH_SECONDS = 5
+# ==================
+
+# sample entry fourcc -> codec name (ffmpeg's names, so reports line up)
+MP4_CODECS = {
+    b'avc1': 'h264', b'avc3': 'h264',
+    b'hev1': 'hevc', b'hvc1': 'hevc',
+    b'av01': 'av1', b'vp09': 'vp9', b'mp4v': 'mpeg4',
+    b'mp4a': 'aac', b'ac-3': 'ac3', b'ec-3': 'eac3',
+    b'Opus': 'opus', b'fLaC': 'flac', b'.mp3': 'mp3',
+    b'tx3g': 'mov_text', b'wvtt': 'webvtt',
+}
+
+MKV_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264', 'V_MPEGH/ISO/HEVC': 'hevc',
+    'V_AV1': 'av1', 'V_VP8': 'vp8', 'V_VP9': 'vp9',
+    'V_MPEG4/ISO/ASP': 'mpeg4', 'V_MPEG2': 'mpeg2video',
+    'A_AAC': 'aac', 'A_AC3': 'ac3', 'A_EAC3': 'eac3', 'A_DTS': 'dts',
+    'A_OPUS': 'opus', 'A_VORBIS': 'vorbis', 'A_FLAC': 'flac',
+    'A_MPEG/L3': 'mp3', 'A_TRUEHD': 'truehd',
+    'S_TEXT/UTF8': 'subrip', 'S_TEXT/ASS': 'ass', 'S_TEXT/SSA': 'ass',
+    'S_TEXT/WEBVTT': 'webvtt', 'S_HDMV/PGS': 'hdmv_pgs_subtitle',
+    'S_VOBSUB': 'dvd_subtitle',
+}
+
+# Box types an mp4/mov file can start with
+MP4_TOP_LEVEL = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide')
+
+MP4_HANDLERS = {b'vide': 'video', b'soun': 'audio', b'sbtl': 'subtitle', b'text': 'subtitle'}
+MKV_TRACK_TYPES = {1: 'video', 2: 'audio', 17: 'subtitle'}
+
+
+class ProbeError(Exception):
+    """The file is not a container we can read headers from"""
+
+
+def probe(path):
+    """Describe a media file by reading only its container headers.
+
+    MP4/MOV and Matroska/WebM are parsed directly, which costs a few KB of
+    reads however large the file is. Anything else falls back to ffprobe
+    when it is installed.
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            head = f.read(12)
+            if head[:4] == b'\x1a\x45\xdf\xa3':
+                return _probe_matroska(f, file_size)
+            if head[4:8] in MP4_TOP_LEVEL:
+                return _probe_mp4(f, file_size)
+    except (struct.error, IndexError) as e:
+        raise ProbeError(f'Corrupt header: {e}')
+
+    info = _probe_ffprobe(path)
+    if info is None:
+        raise ProbeError('Unsupported container')
+    return info
+
+
+def keyframe_index(path):
+    """(presentation time in seconds, frame number) of each video keyframe.
+
+    Comes from the sample tables of an mp4 or the Cues of a Matroska file,
+    so only the index is read, never the media. The frame number counts in
+    decode order from 0; Matroska doesn't record it, so it is None there.
+    None when the file has no such index (or no video track).
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            head = f.read(12)
+            if head[:4] == b'\x1a\x45\xdf\xa3':
+                return _matroska_keyframes(f, file_size)
+            if head[4:8] in MP4_TOP_LEVEL:
+                return _mp4_keyframes(f, file_size)
+    except (struct.error, IndexError) as e:
+        raise ProbeError(f'Corrupt index: {e}')
+    return None
+
+
+def _track_summary(info):
+    """Copy the first video and audio track's details to the top level"""
+    video = next((t for t in info['tracks'] if t['type'] == 'video'), {})
+    audio = next((t for t in info['tracks'] if t['type'] == 'audio'), {})
+    info['video_codec'] = video.get('codec')
+    info['width'] = video.get('width')
+    info['height'] = video.get('height')
+    info['bit_depth'] = video.get('bit_depth')
+    info['audio_codec'] = audio.get('codec')
+    info['audio_channels'] = audio.get('channels')
+    return info
+
+
+def _avc_config(data):
+    """Profile and bit depth from an avcC record"""
+    if len(data) < 7:
+        return {}
+    profile = data[1]
+    bit_depth = 8
+
+    # High profiles append chroma format and bit depth after the parameter
+    # sets; skip over the SPS and PPS lists to get to them
+    offset = 5
+    for count_mask in (0x1f, 0xff):
+        if offset >= len(data):
+            return {'profile': profile, 'bit_depth': bit_depth}
+        count = data[offset] & count_mask
+        offset += 1
+        for _ in range(count):
+            offset += 2 + int.from_bytes(data[offset:offset + 2], 'big')
+    if profile in (100, 110, 122, 144, 244) and offset + 2 <= len(data):
+        bit_depth = (data[offset + 1] & 0x07) + 8
+    return {'profile': profile, 'bit_depth': bit_depth}
+
+
+def _hevc_config(data):
+    """Profile and bit depth from an hvcC record"""
+    if len(data) < 23:
+        return {}
+    return {'profile': data[1] & 0x1f, 'bit_depth': (data[18] & 0x07) + 8}
+
+
+# ==================== MP4 ====================
+
+MP4_ENTRY_LIMIT = 64 * 1024
+# Sample tables (stts, stss, ctts) grow with the length of the file
+MP4_TABLE_LIMIT = 16 * 1024 * 1024
+
+
+def iter_boxes(f, start, end):
+    """Yield (type, box offset, payload offset, box end) for boxes in start..end"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            raise ProbeError(f'Corrupt {box_type!r} box at {offset}')
+        yield box_type, offset, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def _children(f, start, end):
+    """First child box of each type, as type -> (payload offset, box end)"""
+    found = {}
+    for box_type, _, payload, box_end in iter_boxes(f, start, end):
+        found.setdefault(box_type, (payload, box_end))
+    return found
+
+
+def _read_payload(f, box, limit=MP4_ENTRY_LIMIT):
+    start, end = box
+    f.seek(start)
+    return f.read(min(end - start, limit))
+
+
+def _probe_mp4(f, file_size):
+    info = {
+        'container': 'mp4',
+        'duration': None,
+        'tracks': [],
+        'moov_offset': None,
+        'mdat_offset': None,
+    }
+
+    for box_type, offset, payload, end in iter_boxes(f, 0, file_size):
+        if box_type == b'moov' and info['moov_offset'] is None:
+            info['moov_offset'] = offset
+            _parse_moov(f, payload, end, info)
+        elif box_type == b'mdat' and info['mdat_offset'] is None:
+            info['mdat_offset'] = offset
+
+    if info['moov_offset'] is None:
+        raise ProbeError('No moov box')
+
+    # Fast-start: the browser gets the index before any media data
+    info['faststart'] = (
+        info['mdat_offset'] is None or info['moov_offset'] < info['mdat_offset']
+    )
+    return _track_summary(info)
+
+
+def _parse_moov(f, start, end, info):
+    for box_type, _, payload, box_end in iter_boxes(f, start, end):
+        if box_type == b'mvhd':
+            data = _read_payload(f, (payload, box_end), 32)
+            if data[0] == 1:
+                timescale, duration = struct.unpack('>IQ', data[20:32])
+            else:
+                timescale, duration = struct.unpack('>II', data[12:20])
+            if timescale:
+                info['duration'] = duration / timescale
+        elif box_type == b'trak':
+            track = _parse_trak(f, payload, box_end)
+            if track is not None:
+                info['tracks'].append(track)
+
+
+def _parse_trak(f, start, end):
+    trak = _children(f, start, end)
+    if b'mdia' not in trak:
+        return None
+    mdia = _children(f, *trak[b'mdia'])
+
+    track = {'type': 'other', 'codec': None}
+    if b'hdlr' in mdia:
+        handler = _read_payload(f, mdia[b'hdlr'], 12)[8:12]
+        track['type'] = MP4_HANDLERS.get(handler, 'other')
+
+    if b'mdhd' in mdia:
+        data = _read_payload(f, mdia[b'mdhd'], 32)
+        if data[0] == 1:
+            timescale, duration = struct.unpack('>IQ', data[20:32])
+        else:
+            timescale, duration = struct.unpack('>II', data[12:20])
+        if timescale:
+            track['duration'] = duration / timescale
+
+    if b'minf' in mdia:
+        stbl = _children(f, *mdia[b'minf']).get(b'stbl')
+        if stbl is not None:
+            stsd = _children(f, *stbl).get(b'stsd')
+            if stsd is not None:
+                _parse_stsd(_read_payload(f, stsd), track)
+    return track
+
+
+def _parse_stsd(data, track):
+    """Codec details from the first sample entry of an stsd box"""
+    if len(data) < 16:
+        return
+    entry_size, fourcc = struct.unpack('>I4s', data[8:16])
+    entry = data[16:8 + entry_size]
+    track['codec'] = MP4_CODECS.get(fourcc, fourcc.decode('latin-1').strip())
+
+    if track['type'] == 'video' and len(entry) >= 78:
+        track['width'], track['height'] = struct.unpack('>HH', entry[24:28])
+        # Codec configuration boxes follow the 78-byte visual sample entry
+        for box_type, box_start, box_end in _iter_bytes_boxes(entry, 78):
+            if box_type == b'avcC':
+                track.update(_avc_config(entry[box_start:box_end]))
+            elif box_type == b'hvcC':
+                track.update(_hevc_config(entry[box_start:box_end]))
+    elif track['type'] == 'audio' and len(entry) >= 28:
+        track['channels'] = struct.unpack('>H', entry[16:18])[0]
+        track['sample_rate'] = struct.unpack('>I', entry[24:28])[0] >> 16
+
+
+def _iter_bytes_boxes(data, offset):
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        if size < 8:
+            return
+        yield box_type, offset + 8, offset + size
+        offset += size
+
+
+def _mp4_keyframes(f, file_size):
+    moov = _children(f, 0, file_size).get(b'moov')
+    if moov is None:
+        return None
+
+    for box_type, _, payload, box_end in iter_boxes(f, *moov):
+        if box_type != b'trak':
+            continue
+        trak = _children(f, payload, box_end)
+        mdia = _children(f, *trak[b'mdia']) if b'mdia' in trak else {}
+        if b'hdlr' not in mdia or _read_payload(f, mdia[b'hdlr'], 12)[8:12] != b'vide':
+            continue
+
+        timescale = 0
+        if b'mdhd' in mdia:
+            data = _read_payload(f, mdia[b'mdhd'], 32)
+            timescale = struct.unpack('>I', data[20:24] if data[0] == 1 else data[12:16])[0]
+        stbl = _children(f, *mdia[b'minf']).get(b'stbl') if b'minf' in mdia else None
+        tables = _children(f, *stbl) if stbl is not None else {}
+        if not timescale or b'stts' not in tables:
+            return None
+
+        stts = _read_table(f, tables[b'stts'], '>II')
+        if b'stss' in tables:
+            sync = [number for (number,) in _read_table(f, tables[b'stss'], '>I')]
+        else:
+            # No sync sample table: every sample is a keyframe
+            sync = list(range(1, sum(count for count, _ in stts) + 1))
+        ctts = []
+        if b'ctts' in tables:
+            signed = _read_payload(f, tables[b'ctts'], 1)[:1] == b'\x01'
+            ctts = _read_table(f, tables[b'ctts'], '>Ii' if signed else '>II')
+
+        media_start = _edit_media_start(f, trak.get(b'edts'))
+        decode = _run_values(stts, sync, cumulative=True)
+        offsets = _run_values(ctts, sync) if ctts else [0] * len(sync)
+        return sorted(
+            (max(0.0, (dts + offset - media_start) / timescale), number - 1)
+            for number, dts, offset in zip(sync, decode, offsets)
+        )
+    return None
+
+
+def _read_table(f, box, entry_format):
+    """Entries of a full box that is a counted array (stts, stss, ctts...)"""
+    data = _read_payload(f, box, MP4_TABLE_LIMIT)
+    count = struct.unpack('>I', data[4:8])[0]
+    entry_size = struct.calcsize(entry_format)
+    return list(struct.iter_unpack(entry_format, data[8:8 + count * entry_size]))
+
+
+def _run_values(runs, samples, cumulative=False):
+    """Look up sorted 1-based sample numbers in run-length (count, value)
+    entries. With cumulative the result is the running total of the values
+    before each sample (stts deltas -> decode times), else the value itself."""
+    values = []
+    samples = iter(samples)
+    sample = next(samples, None)
+    first = 1
+    total = 0
+    for count, value in runs:
+        while sample is not None and sample < first + count:
+            values.append(total + (sample - first) * value if cumulative else value)
+            sample = next(samples, None)
+        first += count
+        total += count * value
+    while sample is not None:
+        # Tables shorter than the sample count; carry the end on
+        values.append(total if cumulative else 0)
+        sample = next(samples, None)
+    return values
+
+
+def _edit_media_start(f, edts):
+    """Media time the first edit list entry starts playing from (B-frame
+    delay, usually), so keyframe times line up with what players show"""
+    if edts is None:
+        return 0
+    elst = _children(f, *edts).get(b'elst')
+    if elst is None:
+        return 0
+    data = _read_payload(f, elst, 4096)
+    version = data[0]
+    count = struct.unpack('>I', data[4:8])[0]
+    entry_format = '>Qqi' if version == 1 else '>Iii'
+    entry_size = struct.calcsize(entry_format)
+    for i in range(count):
+        entry = data[8 + i * entry_size:8 + (i + 1) * entry_size]
+        if len(entry) < entry_size:
+            break
+        _, media_time, _ = struct.unpack(entry_format, entry)
+        if media_time != -1:
+            return media_time
+    return 0
+
+
+# ==================== MATROSKA ====================
+
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_SEEKHEAD = 0x114D9B74
+MKV_SEEK = 0x4DBB
+MKV_SEEK_ID = 0x53AB
+MKV_SEEK_POSITION = 0x53AC
+MKV_INFO = 0x1549A966
+MKV_TIMESTAMP_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_NUMBER = 0xD7
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_CODEC_PRIVATE = 0x63A2
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_COLOUR = 0x55B0
+MKV_BITS_PER_CHANNEL = 0x55B2
+MKV_AUDIO = 0xE1
+MKV_CHANNELS = 0x9F
+MKV_SAMPLING_FREQUENCY = 0xB5
+MKV_CLUSTER = 0x1F43B675
+MKV_CUES = 0x1C53BB6B
+MKV_CUE_POINT = 0xBB
+MKV_CUE_TIME = 0xB3
+MKV_CUE_TRACK_POSITIONS = 0xB7
+MKV_CUE_TRACK = 0xF7
+
+
+def _read_vint(f, keep_marker):
+    """Read an EBML variable-length integer; returns (value, length, unknown)"""
+    first = f.read(1)
+    if not first:
+        return None, 0, False
+    byte = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not byte & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ProbeError('Invalid EBML length')
+
+    value = byte if keep_marker else byte & (mask - 1)
+    for b in f.read(length - 1):
+        value = (value << 8) | b
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+
+def _iter_elements(f, start, end):
+    """Yield (id, data offset, data end) for EBML elements in start..end"""
+    offset = start
+    while offset < end:
+        f.seek(offset)
+        element_id, id_length, _ = _read_vint(f, keep_marker=True)
+        if element_id is None:
+            return
+        size, size_length, unknown = _read_vint(f, keep_marker=False)
+        if size is None:
+            return
+        data = offset + id_length + size_length
+        data_end = end if unknown else min(data + size, end)
+        yield element_id, data, data_end
+        if unknown:
+            return
+        offset = data_end
+
+
+def _read_uint(f, start, end):
+    f.seek(start)
+    return int.from_bytes(f.read(end - start), 'big')
+
+
+def _read_float(f, start, end):
+    f.seek(start)
+    data = f.read(end - start)
+    if len(data) == 4:
+        return struct.unpack('>f', data)[0]
+    if len(data) == 8:
+        return struct.unpack('>d', data)[0]
+    return None
+
+
+def _read_string(f, start, end):
+    f.seek(start)
+    return f.read(end - start).rstrip(b'\x00').decode('utf-8', 'replace')
+
+
+def _probe_matroska(f, file_size):
+    info = {'container': 'matroska', 'duration': None, 'tracks': []}
+    doctype, elements = _matroska_elements(f, file_size, (MKV_INFO, MKV_TRACKS))
+    info['container'] = doctype or info['container']
+    if MKV_INFO in elements:
+        _parse_mkv_info(f, *elements[MKV_INFO], info)
+    if MKV_TRACKS in elements:
+        _parse_mkv_tracks(f, *elements[MKV_TRACKS], info)
+    return _track_summary(info)
+
+
+def _matroska_keyframes(f, file_size):
+    _, elements = _matroska_elements(f, file_size, (MKV_INFO, MKV_TRACKS, MKV_CUES))
+    if MKV_CUES not in elements or MKV_TRACKS not in elements:
+        return None
+
+    info = {'tracks': []}
+    timestamp_scale = 1000000
+    if MKV_INFO in elements:
+        timestamp_scale = _parse_mkv_info(f, *elements[MKV_INFO], info)
+    _parse_mkv_tracks(f, *elements[MKV_TRACKS], info)
+    video = next((t for t in info['tracks'] if t['type'] == 'video'), None)
+    if video is None:
+        return None
+
+    times = []
+    for element_id, point_start, point_end in _iter_elements(f, *elements[MKV_CUES]):
+        if element_id != MKV_CUE_POINT:
+            continue
+        cue_time = None
+        tracks = set()
+        for child_id, child_start, child_end in _iter_elements(f, point_start, point_end):
+            if child_id == MKV_CUE_TIME:
+                cue_time = _read_uint(f, child_start, child_end)
+            elif child_id == MKV_CUE_TRACK_POSITIONS:
+                for position_id, position_start, position_end in _iter_elements(f, child_start, child_end):
+                    if position_id == MKV_CUE_TRACK:
+                        tracks.add(_read_uint(f, position_start, position_end))
+        if cue_time is not None and video.get('number') in tracks:
+            times.append((cue_time * timestamp_scale / 1e9, None))
+    return sorted(times) or None
+
+
+def _matroska_elements(f, file_size, wanted):
+    """(doctype, id -> (start, end)) for the wanted top-level elements of
+    the segment, found before the first Cluster or through the SeekHead"""
+    doctype = None
+    segment = None
+    for element_id, start, end in _iter_elements(f, 0, file_size):
+        if element_id == EBML_HEADER:
+            for child_id, child_start, child_end in _iter_elements(f, start, end):
+                if child_id == EBML_DOCTYPE:
+                    doctype = _read_string(f, child_start, child_end)
+        elif element_id == MKV_SEGMENT:
+            segment = (start, end)
+            break
+
+    if segment is None:
+        raise ProbeError('No Matroska segment')
+
+    segment_start, segment_end = segment
+    found = {}
+    seek_positions = {}
+
+    for element_id, start, end in _iter_elements(f, segment_start, segment_end):
+        if element_id == MKV_SEEKHEAD:
+            seek_positions.update(_parse_seekhead(f, start, end))
+        elif element_id in wanted:
+            found.setdefault(element_id, (start, end))
+        elif element_id == MKV_CLUSTER:
+            # Media data from here on; anything still missing is reachable
+            # through the SeekHead instead of walking every cluster
+            break
+        if len(found) == len(wanted):
+            break
+
+    for element_id in wanted:
+        if element_id in found or element_id not in seek_positions:
+            continue
+        position = segment_start + seek_positions[element_id]
+        for found_id, start, end in _iter_elements(f, position, segment_end):
+            if found_id == element_id:
+                found[element_id] = (start, end)
+            break
+
+    return doctype, found
+
+
+def _parse_seekhead(f, start, end):
+    positions = {}
+    for element_id, seek_start, seek_end in _iter_elements(f, start, end):
+        if element_id != MKV_SEEK:
+            continue
+        seek_id = position = None
+        for child_id, child_start, child_end in _iter_elements(f, seek_start, seek_end):
+            if child_id == MKV_SEEK_ID:
+                seek_id = _read_uint(f, child_start, child_end)
+            elif child_id == MKV_SEEK_POSITION:
+                position = _read_uint(f, child_start, child_end)
+        if seek_id is not None and position is not None:
+            positions[seek_id] = position
+    return positions
+
+
+def _parse_mkv_info(f, start, end, info):
+    timestamp_scale = 1000000
+    duration = None
+    for element_id, child_start, child_end in _iter_elements(f, start, end):
+        if element_id == MKV_TIMESTAMP_SCALE:
+            timestamp_scale = _read_uint(f, child_start, child_end)
+        elif element_id == MKV_DURATION:
+            duration = _read_float(f, child_start, child_end)
+    if duration is not None:
+        info['duration'] = duration * timestamp_scale / 1e9
+    return timestamp_scale
+
+
+def _parse_mkv_tracks(f, start, end, info):
+    for element_id, entry_start, entry_end in _iter_elements(f, start, end):
+        if element_id != MKV_TRACK_ENTRY:
+            continue
+
+        track = {'type': 'other', 'codec': None}
+        codec_private = None
+        for child_id, child_start, child_end in _iter_elements(f, entry_start, entry_end):
+            if child_id == MKV_TRACK_NUMBER:
+                track['number'] = _read_uint(f, child_start, child_end)
+            elif child_id == MKV_TRACK_TYPE:
+                track_type = _read_uint(f, child_start, child_end)
+                track['type'] = MKV_TRACK_TYPES.get(track_type, 'other')
+            elif child_id == MKV_CODEC_ID:
+                codec_id = _read_string(f, child_start, child_end)
+                base = MKV_CODECS.get(codec_id) or MKV_CODECS.get(codec_id.split('/')[0])
+                track['codec'] = base or codec_id
+            elif child_id == MKV_CODEC_PRIVATE and child_end - child_start <= MP4_ENTRY_LIMIT:
+                f.seek(child_start)
+                codec_private = f.read(child_end - child_start)
+            elif child_id == MKV_VIDEO:
+                _parse_mkv_video(f, child_start, child_end, track)
+            elif child_id == MKV_AUDIO:
+                for audio_id, audio_start, audio_end in _iter_elements(f, child_start, child_end):
+                    if audio_id == MKV_CHANNELS:
+                        track['channels'] = _read_uint(f, audio_start, audio_end)
+                    elif audio_id == MKV_SAMPLING_FREQUENCY:
+                        track['sample_rate'] = int(_read_float(f, audio_start, audio_end) or 0)
+
+        if codec_private is not None:
+            if track['codec'] == 'h264':
+                track.update(_avc_config(codec_private))
+            elif track['codec'] == 'hevc':
+                track.update(_hevc_config(codec_private))
+        info['tracks'].append(track)
+
+
+def _parse_mkv_video(f, start, end, track):
+    for element_id, child_start, child_end in _iter_elements(f, start, end):
+        if element_id == MKV_PIXEL_WIDTH:
+            track['width'] = _read_uint(f, child_start, child_end)
+        elif element_id == MKV_PIXEL_HEIGHT:
+            track['height'] = _read_uint(f, child_start, child_end)
+        elif element_id == MKV_COLOUR:
+            for colour_id, colour_start, colour_end in _iter_elements(f, child_start, child_end):
+                if colour_id == MKV_BITS_PER_CHANNEL:
+                    track['bit_depth'] = _read_uint(f, colour_start, colour_end)
+
+
+# ==================== FFPROBE FALLBACK ====================
+
+def _probe_ffprobe(path):
+    """Same description via ffprobe, for containers we don't parse (avi...)"""
+    if not shutil.which('ffprobe'):
+        return None
+    try:
+        result = subprocess.run(
+            [
+                'ffprobe', '-v', 'error', '-of', 'json',
+                '-show_entries',
+                'format=format_name,duration:stream=codec_type,codec_name,'
+                'width,height,channels,sample_rate,bits_per_raw_sample',
+                path
+            ],
+            capture_output=True, text=True, timeout=60
+        )
+        data = json.loads(result.stdout)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+    fmt = data.get('format', {})
+    info = {
+        'container': fmt.get('format_name', '').split(',')[0] or None,
+        'duration': float(fmt['duration']) if fmt.get('duration') else None,
+        'tracks': [],
+    }
+    for stream in data.get('streams', []):
+        track = {'type': stream.get('codec_type', 'other'), 'codec': stream.get('codec_name')}
+        for key in ('width', 'height', 'channels'):
+            if key in stream:
+                track[key] = stream[key]
+        if stream.get('sample_rate'):
+            track['sample_rate'] = int(stream['sample_rate'])
+        if stream.get('bits_per_raw_sample'):
+            track['bit_depth'] = int(stream['bits_per_raw_sample'])
+        info['tracks'].append(track)
+    return _track_summary(info)
+
+
+# ==================== CACHE ====================
+
+class MediaCache:
+    """Probe results kept on disk, keyed by path and checked against the
+    file's size and mtime. A rescan of an unchanged library costs one stat
+    per file and no reads.
+
+    New results are written out together, FLUSH_SECONDS after the first of
+    them (and at exit), not one rewrite of the whole file per probe. The
+    file is read and written outside the lock lookups wait on.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._entries = None
+        self._dirty = {}  # path -> entry probed since the last flush
+        self._timer = None
+        atexit.register(self.flush)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        """The entries, read from disk (outside the lock) the first time"""
+        if self._entries is None:
+            entries = self._read()
+            with self._lock:
+                if self._entries is None:
+                    self._entries = entries
+        return self._entries
+
+    def flush(self):
+        """Write out what was probed since the last flush.
+
+        The main app, the admin app and every worker keep their own copy and
+        save it, so what the others saved since we read the file is merged
+        in rather than overwritten. The file is only a cache: if writing it
+        fails, the entries stay in memory and are tried again later.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._timer = None
+                if not self._dirty:
+                    return
+                dirty, self._dirty = self._dirty, {}
+                entries = dict(self._entries)
+
+            saved = self._read()
+            entries.update(saved)
+            entries.update(dirty)
+            tmp_path = None
+            try:
+                # A name of its own, so two processes saving at once don't
+                # write into each other's file
+                with tempfile.NamedTemporaryFile('w', dir=self.path.parent, prefix=self.path.name,
+                                                 suffix='.tmp', delete=False) as f:
+                    tmp_path = f.name
+                    json.dump(entries, f, separators=(',', ':'))
+                os.replace(tmp_path, self.path)
+            except OSError:
+                traceback.print_exc()
+                if tmp_path is not None:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                with self._lock:
+                    self._dirty = dict(dirty, **self._dirty)
+                    self._schedule()
+                return
+
+            with self._lock:
+                # Take in what the other processes probed
+                for path, entry in saved.items():
+                    if path not in dirty and path not in self._dirty:
+                        self._entries[path] = entry
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(FLUSH_SECONDS, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def get(self, path, st=None):
+        """Probe info for path, or None if it can't be read. st: the file's
+        stat, if the caller already has it"""
+        return self.get_many([path], stats=[st] if st is not None else None)[0]
+
+    def get_many(self, paths, workers=PROBE_WORKERS, stats=None):
+        """Probe info for each of paths, probing misses in parallel"""
+        if stats is not None:
+            stats = dict(zip(paths, stats))
+        else:
+            stats = {}
+            for path in paths:
+                try:
+                    stats[path] = os.stat(path)
+                except OSError:
+                    stats[path] = None
+
+        results = {}
+        missing = []
+        entries = self._load()
+        with self._lock:
+            for path, st in stats.items():
+                if st is None:
+                    continue
+                entry = entries.get(path)
+                if (entry is not None and entry['size'] == st.st_size
+                        and entry['mtime'] == st.st_mtime):
+                    results[path] = entry['info']
+                else:
+                    missing.append(path)
+
+        if missing:
+            with ThreadPoolExecutor(workers) as pool:
+                probed = list(pool.map(_safe_probe, missing))
+
+            with self._lock:
+                for path, info in zip(missing, probed):
+                    st = stats[path]
+                    entry = {'size': st.st_size, 'mtime': st.st_mtime, 'info': info}
+                    self._entries[path] = self._dirty[path] = entry
+                    results[path] = info
+                self._schedule()
+
+        return [results.get(path) for path in paths]
+
+
+def _safe_probe(path):
+    # Anything a damaged file makes the parser trip over is that file's
+    # error, not the whole batch's
+    try:
+        return probe(path)
+    except Exception as e:
+        return {'error': str(e) or type(e).__name__}
+
+
+media_cache = MediaCache(MEDIA_CACHE_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Probe media files (duration, codecs, fast-start) from their headers."
+    )
+    parser.add_argument("paths", nargs="+", help="Files or folders to scan recursively")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore and don't update the cache")
+    args = parser.parse_args()
+
+    files = []
+    for arg in args.paths:
+        p = Path(arg)
+        if p.is_dir():
+            files.extend(sorted(
+                str(f) for f in p.rglob('*')
+                if f.suffix.lower() in ('.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi')
+            ))
+        else:
+            files.append(str(p))
+
+    started = time.perf_counter()
+    if args.no_cache:
+        with ThreadPoolExecutor(PROBE_WORKERS) as pool:
+            infos = list(pool.map(_safe_probe, files))
+    else:
+        infos = media_cache.get_many(files)
+    elapsed = time.perf_counter() - started
+
+    for path, info in zip(files, infos):
+        if info is None or 'error' in info:
+            print(f"ERROR  {path}: {(info or {}).get('error', 'unreadable')}")
+            continue
+        duration = info['duration'] or 0
+        print(
+            f"{int(duration // 60):3d}:{int(duration % 60):02d}  "
+            f"{info['container']:8s} {info['video_codec'] or '-':5s} "
+            f"{info['width'] or 0}x{info['height'] or 0} "
+            f"{info['audio_codec'] or '-':5s} "
+            f"{'faststart' if info.get('faststart') else '':9s} {Path(path).name}"
+        )
+
+    print(f"\n{len(files)} files in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+
+from catalog import catalog_store, library_paths
+from catalog_records import media_id
+
+# ===== CONFIG =====
+# How long a file's stat is trusted before it is checked again
+CHECK_INTERVAL = float(os.environ.get('MEDIA_CHECK_INTERVAL', 2.0))
+# Unknown IDs rebuild the table from the catalog at most this often, so a
+# client guessing IDs can't make every request walk the library
+MISS_REBUILD_INTERVAL = 2.0
+# And it is rebuilt this often anyway, so removed episodes stop resolving
+REBUILD_INTERVAL = 60.0
+# ==================
+
+
+class _Entry:
+    __slots__ = ('path', 'st', 'checked_at')
+
+    def __init__(self, path, st, checked_at):
+        self.path = path
+        self.st = st
+        self.checked_at = checked_at
+
+
+class MediaTable:
+    """media_id -> file, for every episode the catalog knows about.
+
+    Media URLs carry an ID instead of a file path, so the server only ever
+    reads files someone put in a channel, season or show, and a lookup is a
+    dict hit. Each file's stat is taken when it is first served and reused
+    for CHECK_INTERVAL, so a player's stream of range requests mostly costs
+    no syscalls before the read itself.
+    """
+
+    def __init__(self, paths=library_paths, check_interval=CHECK_INTERVAL):
+        self.paths = paths
+        self.check_interval = check_interval
+        self._ids = {}  # media_id -> path
+        self._registered = {}  # added with register(), kept across rebuilds
+        self._entries = {}  # media_id -> _Entry
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def register(self, path):
+        """Make path servable whether or not the catalog lists it; returns its
+        ID. Its stat is taken afresh on the next request."""
+        path = os.path.normpath(path)
+        key = media_id(path)
+        with self._lock:
+            self._registered[key] = path
+            self._ids[key] = path
+            self._entries.pop(key, None)
+        return key
+
+    def rebuild(self):
+        ids = {media_id(path): path for path in self.paths()}
+        with self._lock:
+            ids.update(self._registered)
+            self._ids = ids
+            self._built_at = time.monotonic()
+            for key in list(self._entries):
+                if self._entries[key].path != ids.get(key):
+                    del self._entries[key]
+
+    def path(self, key):
+        """Catalog path for an ID, or None"""
+        now = time.monotonic()
+        age = now - self._built_at if self._built_at is not None else None
+        if age is None or age > REBUILD_INTERVAL:
+            self.rebuild()
+        path = self._ids.get(key)
+        if path is None:
+            # Added since the last rebuild: one indexed query if the
+            # catalog backend has an index (SQLite) ...
+            path = catalog_store.media_path(key)
+            if path is not None:
+                with self._lock:
+                    self._ids[key] = path
+        if path is None and age is not None and MISS_REBUILD_INTERVAL < age <= REBUILD_INTERVAL:
+            # ... otherwise the whole map again, now and then
+            self.rebuild()
+            path = self._ids.get(key)
+        return path
+
+    def resolve(self, key):
+        """(path, stat) for an ID whose file is still there, or None"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry.checked_at < self.check_interval:
+            return entry.path, entry.st
+
+        path = self.path(key)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        with self._lock:
+            self._entries[key] = _Entry(path, st, now)
+        return path, st
+
+    def stats(self):
+        return {'ids': len(self._ids), 'cached_stats': len(self._entries)}
+
+
+media_table = MediaTable()
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from block_cache import block_cache, file_identity
+from media_probe import media_cache
+
+# ===== CONFIG =====
+# How far through an episode (by bytes sent) a stream gets before the
+# channel's next episode is warmed
+WARM_AT = float(os.environ.get('READAHEAD_AT', 0.9))
+# Bytes from the start of the next episode read ahead of time
+WARM_MB = int(os.environ.get('READAHEAD_MB', 16))
+# Seconds before the same file is warmed again
+WARM_AGAIN_AFTER = 600
+# Transitions kept for the time-to-first-byte figures
+TTFB_SAMPLES = 200
+# ==================
+
+READ_SIZE = 1024 * 1024
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 1)
+
+    return {'count': len(ordered), 'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'max_ms': pick(1.0)}
+
+
+class ReadAhead:
+    """Gets the next episode of a channel off disk before the player asks.
+
+    Once a stream of an episode is WARM_AT of the way through, the first
+    WARM_MB of the file next_episode(episode) says is served next (and its
+    index, if that sits at the end of the file) are read into the block
+    cache, which also leaves them in the OS page cache. On network storage
+    that is the difference between a black screen between episodes and
+    none.
+    """
+
+    def __init__(self):
+        self.next_episode = None
+        self._warmed = {}  # path -> when it was warmed
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(1, thread_name_prefix='readahead')
+        self._transitions = deque(maxlen=TTFB_SAMPLES)
+        self._other = deque(maxlen=TTFB_SAMPLES)
+        self.warms = 0
+
+    def watch(self, body, path, start, file_size, episode=None):
+        """body for a stream of path from start, warming the episode after
+        episode (the catalog path path is served for, if not path itself)
+        once it gets far enough, and timing its first chunk"""
+        with self._lock:
+            samples = self._transitions if path in self._warmed else self._other
+        trigger = None
+        if self.next_episode is not None:
+            trigger = int(file_size * WARM_AT)
+        return self._watch(body, episode or path, start, trigger, samples, time.perf_counter())
+
+    def reached(self, path, position, file_size, episode=None):
+        """For a stream of path from position that the server sends on its
+        own (sendfile), so watch() never sees it: warm the next episode if
+        it starts past the WARM_AT mark"""
+        if self.next_episode is not None and position >= int(file_size * WARM_AT):
+            self._pool.submit(self._warm_next, episode or path)
+
+    def _watch(self, body, episode, position, trigger, samples, began):
+        close = getattr(body, 'close', None)
+        try:
+            for chunk in body:
+                if began is not None:
+                    samples.append(time.perf_counter() - began)
+                    began = None
+                position += len(chunk)
+                if trigger is not None and position >= trigger:
+                    trigger = None
+                    self._pool.submit(self._warm_next, episode)
+                yield chunk
+        finally:
+            if close is not None:
+                close()
+
+    def _warm_next(self, episode):
+        try:
+            upcoming = self.next_episode(episode)
+        except Exception:
+            return
+        if upcoming is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._warmed.get(upcoming, -WARM_AGAIN_AFTER) < WARM_AGAIN_AFTER:
+                return
+            self._warmed[upcoming] = now
+            for old, when in list(self._warmed.items()):
+                if now - when > WARM_AGAIN_AFTER:
+                    del self._warmed[old]
+        try:
+            self.warm(upcoming)
+        except OSError:
+            pass
+
+    def warm(self, path):
+        st = os.stat(path)
+        ranges = [(0, min(st.st_size, WARM_MB * 1024 * 1024))]
+        info = media_cache.get(path)
+        moov = (info or {}).get('moov_offset')
+        if info and info.get('faststart') is False and moov is not None:
+            # The player needs the index at the end before it can start
+            ranges.append((moov, st.st_size))
+
+        if hasattr(os, 'posix_fadvise'):
+            # Let the kernel start on all of it at once
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                for start, end in ranges:
+                    os.posix_fadvise(fd, start, end - start, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+
+        if block_cache.enabled:
+            identity = file_identity(path, st)
+            for start, end in ranges:
+                for index in range(start // block_cache.block_size, -(-end // block_cache.block_size)):
+                    block_cache.get_block(path, identity, index)
+        else:
+            with open(path, 'rb') as f:
+                for start, end in ranges:
+                    f.seek(start)
+                    while f.tell() < end and f.read(READ_SIZE):
+                        pass
+        self.warms += 1
+
+    def stats(self):
+        return {
+            'warm_at': WARM_AT,
+            'warm_bytes': WARM_MB * 1024 * 1024,
+            'warmed': self.warms,
+            # First chunk of a stream of a file warmed as someone's next
+            # episode, and of every other stream, measured in the server
+            'transition_ttfb': _percentiles(self._transitions),
+            'other_ttfb': _percentiles(self._other),
+        }
+
+
+readahead = ReadAhead()
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from bisect import bisect_right
+
+from catalog_records import media_id
+from folder_index import folder_index
+from media_probe import media_cache
+
+# ===== CONFIG =====
+# Used for files we can't probe, same guess the player used to make
+DEFAULT_EPISODE_LENGTH = 22 * 60
+MAX_SCHEDULE_HOURS = 48
+# ==================
+
+
+def episode_durations(paths):
+    """Durations in seconds for paths, from the media probe cache"""
+    infos = media_cache.get_many(paths)
+    return [(info or {}).get('duration') or DEFAULT_EPISODE_LENGTH for info in infos]
+
+
+class ChannelTimeline:
+    """A channel's episodes laid end to end and looped forever.
+
+    starts is the prefix sum of the durations, so finding what is on at any
+    moment is a bisect rather than a walk over the episode list. The loop
+    is anchored at the Unix epoch, so every client agrees on the schedule.
+    """
+
+    __slots__ = ('folder_path', 'files', 'durations', 'starts', 'total')
+
+    def __init__(self, folder_path, files, durations):
+        self.folder_path = folder_path
+        self.files = files
+        self.durations = durations
+        self.starts = []
+        total = 0.0
+        for duration in durations:
+            self.starts.append(total)
+            total += duration
+        self.total = total
+
+    def locate(self, when):
+        """(episode index, offset into it in seconds) at Unix time when"""
+        position = when % self.total
+        index = bisect_right(self.starts, position) - 1
+        return index, position - self.starts[index]
+
+    def episode(self, index):
+        filename = self.files[index]
+        path = os.path.join(self.folder_path, filename)
+        return {
+            'index': index,
+            'filename': filename,
+            'path': path,
+            'media_id': media_id(path),
+            'duration': self.durations[index]
+        }
+
+    def now(self, when=None):
+        when = time.time() if when is None else when
+        index, offset = self.locate(when)
+        return {
+            'index': index,
+            'offset': offset,
+            'server_time': when,
+            'count': len(self.files),
+            'episode': self.episode(index)
+        }
+
+    def schedule(self, start, hours):
+        """EPG entries covering hours from Unix time start"""
+        end = start + hours * 3600
+        index, offset = self.locate(start)
+        airs_at = start - offset
+        entries = []
+        while airs_at < end:
+            entry = self.episode(index)
+            entry['start'] = airs_at
+            entry['end'] = airs_at + self.durations[index]
+            entries.append(entry)
+            airs_at = entry['end']
+            index = (index + 1) % len(self.files)
+        return entries
+
+
+_timelines = {}
+_timelines_lock = threading.Lock()
+
+
+def get_timeline(folder_path):
+    """Timeline for a channel folder, rebuilt only when its files change"""
+    files = folder_index.files(folder_path)
+    if not files:
+        return None
+
+    timeline = _timelines.get(folder_path)
+    if timeline is not None and timeline.files == files:
+        return timeline
+
+    paths = [os.path.join(folder_path, f) for f in files]
+    timeline = ChannelTimeline(folder_path, files, episode_durations(paths))
+    with _timelines_lock:
+        _timelines[folder_path] = timeline
+    return timeline
@@ -0,0 +1,168 @@
+"""Production entry point for the main site and the admin panel.
+
+    python serve.py              # main site on :5000
+    python serve.py admin        # admin panel on :5001
+    python serve.py -w 4 -t 32   # 4 worker processes x 32 threads
+
+By default one process runs the asyncio server in async_server.py, where
+a playing video doesn't hold a thread. Asking for more than one worker
+runs gunicorn instead (prefork workers, each with a thread pool) where it
+is installed and the OS can fork; waitress (one process, a thread pool)
+is there too. `python app.py` and `python admin.py` run main() for their
+app, so they take the same options.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+
+# ===== CONFIG =====
+HOST = os.environ.get('SERVE_HOST', '0.0.0.0')
+PORTS = {'main': 5000, 'admin': 5001}
+WORKERS = int(os.environ.get('SERVE_WORKERS', 1))
+# Under gunicorn and waitress a playing video holds a thread for as long
+# as it streams, so this is roughly how many viewers one process can serve
+# at once. The async runtime only runs route handlers on them.
+THREADS = int(os.environ.get('SERVE_THREADS', 256))
+# Seconds an idle keep-alive connection stays open
+KEEPALIVE = int(os.environ.get('SERVE_KEEPALIVE', 75))
+# Open connections (playing videos plus idle keep-alives) per process
+CONNECTIONS = int(os.environ.get('SERVE_CONNECTIONS', 1000))
+# Seconds in-flight requests get to finish on a reload or shutdown
+GRACEFUL_TIMEOUT = 30
+# Response bytes waitress buffers per connection before the request thread
+# waits for the client; keeps slow viewers from piling video up in memory
+SEND_BUFFER = 4 * 1024 * 1024
+# ==================
+
+
+def load_app(name):
+    """Import the Flask app and parse the catalogs once, up front.
+
+    Under gunicorn this runs in the master before it forks, so every
+    worker starts with the catalogs already parsed (shared copy-on-write
+    pages) and afterwards revalidates them against the files with a stat,
+    which keeps all workers consistent with each other and with admin edits.
+    """
+    from catalog import channels_catalog, seasons_catalog, shows_catalog
+    for catalog in (channels_catalog, seasons_catalog, shows_catalog):
+        catalog.snapshot()
+
+    if name == 'admin':
+        from admin import admin_app
+        return admin_app
+    from app import app
+    return app
+
+
+def can_fork():
+    return os.name != 'nt' and importlib.util.find_spec('gunicorn') is not None
+
+
+def serve_gunicorn(name, args):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': f'{args.host}:{args.port}',
+                'workers': args.workers,
+                'threads': args.threads,
+                # Requests on a thread pool; idle keep-alive connections
+                # wait in the worker's poller instead of holding a thread
+                'worker_class': 'gthread',
+                'worker_connections': args.connections,
+                'keepalive': args.keepalive,
+                'graceful_timeout': GRACEFUL_TIMEOUT,
+                'preload_app': True,
+                'proc_name': f'abergeltv-{name}',
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app(name)
+
+    # kill -HUP <master pid> starts fresh workers and lets the old ones
+    # finish their requests (up to GRACEFUL_TIMEOUT) before they exit. The
+    # app is preloaded, so new code needs USR2 (a new master) then QUIT.
+    print(f'gunicorn: {args.workers} workers x {args.threads} threads on {args.host}:{args.port}')
+    if args.workers > 1:
+        # See events.py: the event bus lives in one process
+        print('warning: with more than one worker, /api/events only carries catalog changes; '
+              'stream, transcode and fast-start events reach only clients of the worker they '
+              'happened in. Use the async runtime (one process) for live progress.')
+    Server().run()
+
+
+def serve_async(name, args):
+    from async_server import serve, APP_THREADS
+
+    if args.workers > 1:
+        print('the async server runs a single process; use --runtime gunicorn for workers')
+    threads = args.threads or APP_THREADS
+    print(f'async: {threads} request threads on {args.host}:{args.port}')
+    serve(
+        load_app(name),
+        args.host,
+        args.port,
+        keepalive=args.keepalive,
+        max_connections=args.connections,
+        graceful_timeout=GRACEFUL_TIMEOUT,
+        app_threads=threads,
+    )
+
+
+def serve_waitress(name, args):
+    from waitress import serve
+
+    if args.workers > 1:
+        print('waitress runs a single process; use --threads instead of --workers')
+    print(f'waitress: {args.threads} threads on {args.host}:{args.port}')
+    serve(
+        load_app(name),
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        connection_limit=args.connections,
+        channel_timeout=args.keepalive,
+        outbuf_high_watermark=SEND_BUFFER,
+        # select() tops out at 512 sockets on Windows, poll() has no limit
+        asyncore_use_poll=os.name != 'nt',
+        ident='AbergelTV',
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run AbergelTV under a production WSGI server.')
+    parser.add_argument('app', nargs='?', choices=sorted(PORTS), default='main')
+    parser.add_argument('--runtime', choices=('auto', 'async', 'gunicorn', 'waitress'), default='auto')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, help='Default: 5000 for main, 5001 for admin')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS,
+                        help='Worker processes (gunicorn only). Each has its own block cache.')
+    parser.add_argument('-t', '--threads', type=int,
+                        help=f'Threads per worker (default: {THREADS}; for async, request threads)')
+    parser.add_argument('--keepalive', type=int, default=KEEPALIVE,
+                        help='Seconds to keep idle connections open')
+    parser.add_argument('--connections', type=int, default=CONNECTIONS,
+                        help='Open connections per worker')
+    args = parser.parse_args(argv)
+    if args.port is None:
+        args.port = PORTS[args.app]
+    runtime = args.runtime
+    if runtime == 'auto':
+        runtime = 'gunicorn' if args.workers > 1 and can_fork() else 'async'
+    if runtime != 'async' and args.threads is None:
+        args.threads = THREADS
+
+    if runtime == 'async':
+        serve_async(args.app, args)
+    elif runtime == 'gunicorn':
+        serve_gunicorn(args.app, args)
+    else:
+        serve_waitress(args.app, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from collections import deque
+from itertools import count
+
+from events import event_bus
+
+# ===== CONFIG =====
+# Per viewing device (IP address). A 1080p episode needs 5-20 Mbit/s; the
+# rest goes into filling the player's buffer. 0 for no cap.
+CLIENT_MBPS = float(os.environ.get('SHAPE_CLIENT_MBPS', 0))
+# All streams together: set it a little under what the network really
+# carries (Wi-Fi, uplink) so a burst on one TV can't starve the others.
+# 0 for no cap.
+TOTAL_MBPS = float(os.environ.get('SHAPE_TOTAL_MBPS', 0))
+# Bytes a client may take at full speed before its cap kicks in
+CLIENT_BURST = 8 * 1024 * 1024
+# Seconds of the total rate that may go out at once
+TOTAL_BURST_SECONDS = 0.5
+# The first bytes of every range response are what a seek or a channel
+# change is waiting on, so they are never held back
+INTERACTIVE_BYTES = 2 * 1024 * 1024
+# Seconds of history behind each stream's rate
+RATE_WINDOW = 5
+# Clients without a stream for this long lose their bucket (and its burst)
+CLIENT_IDLE = 60
+# ==================
+
+# Set by servers that would rather wait between chunks themselves than
+# have a thread sleep; see async_server.Pacer
+PACER_KEY = 'async_server.pacer'
+
+
+class TokenBucket:
+    """rate bytes/s, with up to burst bytes saved up.
+
+    A reservation always succeeds and may run the bucket into debt; the
+    caller waits out the debt. Since each stream reserves one chunk at a
+    time, streams sharing a bucket are served in turn, a chunk each.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, size, now):
+        """Take size bytes; returns the seconds to wait before sending them"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class ShapedStream:
+    """Response body that holds each chunk back until the buckets allow it.
+
+    Under threaded servers __next__ sleeps. Servers that put a pacer in
+    the environ get the wait handed to them instead, and pause the
+    connection without holding a thread.
+    """
+
+    def __init__(self, shaper, stream_id, client, path, body, start, pacer):
+        self.shaper = shaper
+        self.id = stream_id
+        self.client = client
+        self.path = path
+        self.start = start
+        self.sent = 0
+        self.waiting = 0.0
+        self.started = time.monotonic()
+        self._body = iter(body)
+        self._close = getattr(body, 'close', None)
+        self._pacer = pacer
+        self._history = deque([(self.started, 0)])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self._body)
+        delay = self.shaper._reserve(self, len(chunk))
+        if self._pacer is not None:
+            self._pacer.delay = delay
+        elif delay:
+            time.sleep(delay)
+        return chunk
+
+    def close(self):
+        self.shaper._finish(self)
+        if self._close is not None:
+            self._close()
+
+    @property
+    def interactive(self):
+        return self.sent < INTERACTIVE_BYTES
+
+    def _trim(self, now):
+        history = self._history
+        while len(history) > 1 and history[1][0] <= now - RATE_WINDOW:
+            history.popleft()
+
+    def rate(self, now):
+        """Bytes/s sent over the last RATE_WINDOW seconds"""
+        self._trim(now)
+        since, sent = self._history[0]
+        return (self.sent - sent) / max(now - since, 1e-3)
+
+
+class Shaper:
+    """Token buckets for every client and for the server as a whole, and
+    the registry of streams in flight"""
+
+    def __init__(self, client_mbps=CLIENT_MBPS, total_mbps=TOTAL_MBPS):
+        self.client_rate = client_mbps * 1e6 / 8
+        self.total_rate = total_mbps * 1e6 / 8
+        self._total = None
+        if self.total_rate:
+            self._total = TokenBucket(self.total_rate, self.total_rate * TOTAL_BURST_SECONDS)
+        self._clients = {}  # address -> (bucket, last active)
+        self._streams = {}
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.client_rate or self._total is not None)
+
+    def wrap(self, body, environ, path, start):
+        """body, shaped as a stream of path from offset start; body itself
+        when there are no caps to keep to"""
+        if not self.enabled:
+            return body
+        client = environ.get('REMOTE_ADDR', '')
+        stream = ShapedStream(
+            self, next(self._ids), client, path, body, start, environ.get(PACER_KEY)
+        )
+        with self._lock:
+            self._streams[stream.id] = stream
+            started = len(self._streams) == 1
+        if started:
+            # Only the first stream and the last one ending are announced:
+            # the admin panel refreshes the rates itself while any are on
+            event_bus.publish('streams', {'active': True})
+        return stream
+
+    def _bucket(self, client, now):
+        entry = self._clients.get(client)
+        bucket = entry[0] if entry else TokenBucket(self.client_rate, CLIENT_BURST)
+        self._clients[client] = (bucket, now)
+        return bucket
+
+    def _reserve(self, stream, size):
+        now = time.monotonic()
+        with self._lock:
+            interactive = stream.interactive
+            stream.sent += size
+            stream._history.append((now, stream.sent))
+            stream._trim(now)
+
+            delay = 0.0
+            if self.client_rate:
+                delay = self._bucket(stream.client, now).reserve(size, now)
+            if self._total is not None:
+                delay = max(delay, self._total.reserve(size, now))
+            if interactive:
+                # Charged all the same, so the bulk streams make way for it
+                delay = 0.0
+            stream.waiting = delay
+            return delay
+
+    def _finish(self, stream):
+        now = time.monotonic()
+        with self._lock:
+            ended = self._streams.pop(stream.id, None) is not None and not self._streams
+            active = {s.client for s in self._streams.values()}
+            for client, (_, last) in list(self._clients.items()):
+                if client not in active and now - last > CLIENT_IDLE:
+                    del self._clients[client]
+        if ended:
+            event_bus.publish('streams', {'active': False})
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            streams = [
+                {
+                    'id': s.id,
+                    'client': s.client,
+                    'file': os.path.basename(s.path),
+                    'offset': s.start,
+                    'sent_bytes': s.sent,
+                    'seconds': round(now - s.started, 1),
+                    'rate_bps': round(s.rate(now) * 8),
+                    'interactive': s.interactive,
+                    'held_seconds': round(s.waiting, 3),
+                }
+                for s in self._streams.values()
+            ]
+        return {
+            'client_cap_bps': round(self.client_rate * 8),
+            'total_cap_bps': round(self.total_rate * 8),
+            'total_rate_bps': sum(s['rate_bps'] for s in streams),
+            'streams': streams,
+        }
+
+
+shaper = Shaper()
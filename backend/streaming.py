@@ -0,0 +1,123 @@
+from flask import Response, request
+from werkzeug.http import http_date, parse_date
+from werkzeug.wsgi import wrap_file
+
+from block_cache import block_cache
+from fd_pool import file_pool
+from readahead import readahead
+from shaping import shaper
+
+# Bytes handed to the server per write. Peak memory per stream is bounded
+# by this, no matter how large the requested range is.
+CHUNK_SIZE = 256 * 1024
+
+# Headers the browser needs to do range requests against us from the LAN
+RANGE_HEADERS = {
+    'Accept-Ranges': 'bytes',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Range',
+    'Access-Control-Expose-Headers': 'Content-Range, Accept-Ranges, ETag'
+}
+
+
+def parse_range(range_header, file_size):
+    """Parse a 'bytes=' Range header into an inclusive (start, end) pair.
+
+    Only the first range of a multi-range request is honoured. Returns None
+    when the range cannot be satisfied for a file of file_size bytes.
+    """
+    units, _, spec = range_header.partition('=')
+    if units.strip() != 'bytes':
+        return None
+
+    first, _, last = spec.split(',')[0].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else file_size - 1
+        elif last:
+            # Suffix range: the final N bytes
+            start = max(file_size - int(last), 0)
+            end = file_size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+
+    end = min(end, file_size - 1)
+    if start < 0 or start >= file_size or end < start:
+        return None
+    return start, end
+
+
+def file_etag(st):
+    """Strong ETag for a file's current content. Fast-start rewrites files
+    in place, so size, mtime and inode all go in: a browser must never
+    splice cached ranges of the old layout into the new one."""
+    return f'{st.st_size:x}-{st.st_mtime_ns:x}-{st.st_ino:x}'
+
+
+def if_range_matches(st):
+    """False if the request's If-Range names another version of the file,
+    in which case the whole file has to be sent instead of the range"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == f'"{file_etag(st)}"'
+    if if_range.startswith('W/'):
+        # Weak validators never qualify for a range
+        return False
+    date = parse_date(if_range)
+    return date is not None and int(date.timestamp()) == int(st.st_mtime)
+
+
+def send_range(path, st, start, end, mimetype, episode=None):
+    """Build a streaming 206 response for bytes start..end of path, which is
+    served for the catalog file episode if that isn't path itself"""
+    file_size = st.st_size
+    length = end - start + 1
+
+    if (not block_cache.enabled and not shaper.enabled and end == file_size - 1
+            and 'wsgi.file_wrapper' in request.environ):
+        # Nothing to share, pace or list: a range that runs to EOF (the
+        # usual 'bytes=N-') goes to the server's wsgi.file_wrapper, which
+        # sends it with sendfile() instead of copying it through Python
+        f = open(path, 'rb')
+        f.seek(start)
+        readahead.reached(path, start, file_size, episode)
+        return _range_response(wrap_file(request.environ, f, CHUNK_SIZE), st, start, end, mimetype)
+
+    if block_cache.enabled:
+        # Shared with every other viewer of the same file, so a whole
+        # channel's worth of clients costs one disk read per block
+        body = block_cache.iter_range(path, st, start, length)
+    else:
+        # Read with pread through a descriptor that stays open for the
+        # player's next range request
+        body = file_pool.iter_range(path, st, start, length, CHUNK_SIZE)
+    # Warms the channel's next episode near the end of this one
+    body = readahead.watch(body, path, start, file_size, episode)
+    # Paced against the client's and the server's bandwidth caps, and
+    # listed in /api/stats/streams
+    body = shaper.wrap(body, request.environ, path, start)
+    return _range_response(body, st, start, end, mimetype)
+
+
+def _range_response(body, st, start, end, mimetype):
+    file_size = st.st_size
+    headers = dict(RANGE_HEADERS)
+    headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+    headers['Content-Length'] = str(end - start + 1)
+    headers['Last-Modified'] = http_date(st.st_mtime)
+    headers['ETag'] = f'"{file_etag(st)}"'
+
+    return Response(body, 206, headers, mimetype=mimetype, direct_passthrough=True)
+
+
+def range_not_satisfiable(file_size):
+    """416 response telling the client how big the file actually is"""
+    headers = dict(RANGE_HEADERS)
+    headers['Content-Range'] = f'bytes */{file_size}'
+    return Response('Requested range not satisfiable', 416, headers)
@@ -0,0 +1,331 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog_records import media_id
+from disk_cache import DiskCache
+from events import event_bus
+from media_probe import DATA_DIR, media_cache
+
+# ===== CONFIG =====
+TRANSCODE_DIR = DATA_DIR / 'transcode_cache'
+TRANSCODE_CACHE_MB = int(os.environ.get('TRANSCODE_CACHE_MB', 20480))
+# Conversions run at once; each already uses several cores
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', 1))
+CRF = 20
+PRESET = 'veryfast'
+AUDIO_BITRATE = '192k'
+# Progress events are published every time a conversion gets this much
+# further along
+PROGRESS_STEP = 0.05
+# Bytes hashed from each end of a file for its cache key
+KEY_SAMPLE = 1024 * 1024
+# How often to look again while another process converts the same file
+CLAIM_POLL_SECONDS = 5
+# What every browser (and smart TV) can play straight out of an mp4
+BROWSER_VIDEO_CODECS = {'h264'}
+BROWSER_H264_PROFILES = {66, 77, 100}  # Baseline, Main, High; not High 10 / 4:4:4
+BROWSER_AUDIO_CODECS = {'aac', 'mp3'}
+# ==================
+
+MODES = ('remux', 'audio', 'encode')
+
+
+def video_playable(info):
+    """True if the first video track of probe info plays in any browser"""
+    video = next((t for t in info.get('tracks', []) if t['type'] == 'video'), None)
+    return (
+        video is not None
+        and video['codec'] in BROWSER_VIDEO_CODECS
+        and video.get('profile', 100) in BROWSER_H264_PROFILES
+        and video.get('bit_depth', 8) == 8
+    )
+
+
+def audio_playable(info):
+    return info.get('audio_codec') is None or info['audio_codec'] in BROWSER_AUDIO_CODECS
+
+
+def choose_mode(info):
+    """How little work makes a file with probe info browser-playable.
+
+    remux:  codecs are fine, only the container changes (stream copy)
+    audio:  video is fine, audio (AC3, DTS...) is re-encoded to AAC
+    encode: video has to be re-encoded
+    """
+    if not info or 'error' in info or not video_playable(info):
+        return 'encode'
+    if not audio_playable(info):
+        return 'audio'
+    return 'remux'
+
+
+def needs_transcode(info):
+    """True if the file has to be converted before a browser can play it.
+    A file that couldn't be probed is served as it is: it may well play,
+    and converting it would most likely fail too."""
+    if not info or 'error' in info or info.get('container') == 'webm':
+        return False
+    return not (info.get('container') == 'mp4' and choose_mode(info) == 'remux')
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+
+def build_command(input_path, output_path, mode, preset=PRESET, crf=CRF, threads=None):
+    if mode == 'encode':
+        video = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-preset', preset, '-crf', str(crf)]
+        if threads:
+            video += ['-threads', str(threads)]
+    else:
+        video = ['-c:v', 'copy']
+
+    if mode == 'remux':
+        audio = ['-c:a', 'copy']
+    else:
+        audio = ['-c:a', 'aac', '-b:a', AUDIO_BITRATE]
+
+    return [
+        'ffmpeg', '-y', '-v', 'error', '-nostdin', '-nostats', '-progress', 'pipe:1',
+        '-i', str(input_path),
+        '-map', '0:v:0', '-map', '0:a?',
+        *video,
+        *audio,
+        # moov at the front so browsers can start playing straight away
+        '-movflags', '+faststart',
+        '-f', 'mp4', str(output_path)
+    ]
+
+
+def run_ffmpeg(cmd, on_progress=None):
+    """Run ffmpeg, calling on_progress(seconds written, speed) as it goes.
+
+    Returns (success, seconds of media written, last lines of ffmpeg output).
+    """
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        text=True, encoding='utf-8', errors='replace'
+    )
+    out_time = 0.0
+    speed = '?'
+    tail = deque(maxlen=10)
+
+    for line in proc.stdout:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            tail.append(line.rstrip())
+            continue
+        if key == 'out_time_us' and value.isdigit():
+            out_time = int(value) / 1e6
+        elif key == 'speed':
+            speed = value
+        elif key == 'progress' and on_progress is not None:
+            on_progress(out_time, speed)
+
+    return proc.wait() == 0, out_time, list(tail)
+
+
+def content_key(path, st):
+    """Cache key from a file's size and the bytes at both ends, so it follows
+    the content through renames and moves but not through edits"""
+    digest = hashlib.sha1(str(st.st_size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(KEY_SAMPLE))
+        if st.st_size > 2 * KEY_SAMPLE:
+            f.seek(-KEY_SAMPLE, os.SEEK_END)
+            digest.update(f.read(KEY_SAMPLE))
+    return digest.hexdigest()[:24] + '.mp4'
+
+
+class Transcoder:
+    """Browser-playable mp4 versions of files that aren't, made in the
+    background the first time one is asked for and kept in a size-bounded
+    cache. Whatever airing() returns (the channels' current and next
+    episodes) is pinned there, so eviction never pulls a file out from
+    under a channel."""
+
+    def __init__(self, cache, workers=TRANSCODE_WORKERS):
+        self.cache = cache
+        self.airing = None
+        self._jobs = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='transcode')
+
+    def key(self, path, st=None):
+        """Content key for path, hashed again only when the file changes"""
+        if st is None:
+            st = os.stat(path)
+        identity = (st.st_size, st.st_mtime_ns)
+        cached = self._keys.get(path)
+        if cached is not None and cached[0] == identity:
+            return cached[1]
+        key = content_key(path, st)
+        with self._lock:
+            self._keys[path] = (identity, key)
+        return key
+
+    def request(self, path, info=None, st=None):
+        """(path of the converted file, None) if it is ready, otherwise
+        (None, job state) with the conversion queued if it wasn't already"""
+        key = self.key(path, st)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, None
+
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                if info is None:
+                    info = media_cache.get(path)
+                job = self._jobs[key] = {
+                    'path': path,
+                    'mode': choose_mode(info),
+                    'duration': (info or {}).get('duration'),
+                    'status': 'queued',
+                    'progress': 0.0,
+                }
+                self._pool.submit(self._run, key, job)
+                self._announce(job)
+            return None, dict(job)
+
+    def converted(self, path, st=None):
+        """Path of the converted copy of path if it is ready, else None;
+        unlike cached(), counts as watching it"""
+        return self.cache.get(self.key(path, st))
+
+    def cached(self, path, st=None):
+        """Path of the converted copy of path if there is one, else None"""
+        try:
+            key = self.key(path, st)
+        except OSError:
+            return None
+        return str(self.cache.path(key)) if key in self.cache else None
+
+    def status(self, path):
+        """Where the conversion of path stands, without starting one"""
+        key = self.key(path)
+        if key in self.cache:
+            return {'path': path, 'status': 'done', 'progress': 1.0}
+        with self._lock:
+            job = self._jobs.get(key)
+            return dict(job) if job is not None else {'path': path, 'status': 'none', 'progress': 0.0}
+
+    def prepare(self, paths):
+        """Queue conversions for whichever of paths need one"""
+        if not ffmpeg_available():
+            return
+        for path, info in zip(paths, media_cache.get_many(paths)):
+            if info is not None and needs_transcode(info):
+                try:
+                    self.request(path, info)
+                except OSError:
+                    pass
+
+    def retry(self, path):
+        """Forget a failed conversion of path so the next request tries again"""
+        key = self.key(path)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job['status'] == 'failed':
+                del self._jobs[key]
+
+    def _announce(self, job, **changes):
+        event_bus.publish('transcode', dict(
+            {'media_id': media_id(job['path']), 'status': job['status'], 'progress': job['progress']},
+            **changes
+        ))
+
+    def _run(self, key, job):
+        # Another process sharing the cache (the other app, a second worker)
+        # may be converting the same file: wait for it instead
+        while not self.cache.claim(key):
+            time.sleep(CLAIM_POLL_SECONDS)
+        try:
+            if self.cache.adopt(key):
+                with self._lock:
+                    del self._jobs[key]
+                self._announce(job, status='done', progress=1.0)
+                return
+            self._convert(key, job)
+        finally:
+            self.cache.release(key)
+
+    def _convert(self, key, job):
+        with self._lock:
+            job['status'] = 'running'
+        self._announce(job)
+        announced = [0.0]
+
+        def on_progress(out_time, speed):
+            if job['duration']:
+                job['progress'] = min(out_time / job['duration'], 1.0)
+            job['speed'] = speed
+            if job['progress'] - announced[0] >= PROGRESS_STEP:
+                announced[0] = job['progress']
+                self._announce(job)
+
+        tmp_path = self.cache.tmp_path(key)
+        try:
+            ok, _, tail = run_ffmpeg(build_command(job['path'], tmp_path, job['mode']), on_progress)
+        except OSError as e:
+            ok, tail = False, [str(e)]
+
+        if not ok:
+            self._fail(job, tail[-1] if tail else 'ffmpeg failed', tmp_path)
+            return
+
+        try:
+            # Evicting for the new file is what the pins are about, so they
+            # go in first, but a failure there mustn't lose the conversion
+            self._pin_airing()
+        except Exception:
+            traceback.print_exc()
+        try:
+            self.cache.put(key, tmp_path)
+        except Exception as e:
+            # Disk full, say; the job must not be left running forever
+            self._fail(job, f'Could not keep the converted file: {e}', tmp_path)
+            return
+        with self._lock:
+            del self._jobs[key]
+        self._announce(job, status='done', progress=1.0)
+
+    def _fail(self, job, error, tmp_path):
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except OSError:
+            pass
+        with self._lock:
+            # Kept, so a broken file isn't converted again on every request
+            job['status'] = 'failed'
+            job['error'] = error
+        self._announce(job, error=error)
+
+    def _pin_airing(self):
+        if self.airing is None:
+            return
+        paths = self.airing()
+        keys = set()
+        for path, info in zip(paths, media_cache.get_many(paths)):
+            if info is not None and needs_transcode(info):
+                try:
+                    keys.add(self.key(path))
+                except OSError:
+                    pass
+        self.cache.pin(keys)
+
+    def jobs(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+
+transcoder = Transcoder(DiskCache(TRANSCODE_DIR, TRANSCODE_CACHE_MB * 1024 * 1024))
@@ -0,0 +1,52 @@
+"""Put a pinned copy of hls.js in frontend/js, so the player's HLS fallback
+works on a LAN without internet and runs only code we chose.
+
+The release tarball is fetched from the npm registry and checked against
+the integrity hash the registry publishes for that version before
+anything is written. Run it once when setting up, or after changing
+HLS_JS_VERSION, and commit the file it writes.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import tarfile
+import urllib.request
+from pathlib import Path
+
+# ===== CONFIG =====
+HLS_JS_VERSION = '1.5.20'
+REGISTRY = 'https://registry.npmjs.org/hls.js'
+OUTPUT = Path(__file__).parent.parent / 'frontend' / 'js' / 'hls.min.js'
+# ==================
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
+
+
+def vendor(version=HLS_JS_VERSION, output=OUTPUT):
+    meta = json.loads(fetch(f'{REGISTRY}/{version}'))
+    algorithm, _, expected = meta['dist']['integrity'].partition('-')
+    tarball = fetch(meta['dist']['tarball'])
+    digest = base64.b64encode(hashlib.new(algorithm, tarball).digest()).decode()
+    if digest != expected:
+        raise SystemExit(f"hls.js {version}: tarball doesn't match its {algorithm} integrity hash")
+
+    with tarfile.open(fileobj=io.BytesIO(tarball), mode='r:gz') as tar:
+        script = tar.extractfile('package/dist/hls.min.js').read()
+    output.write_bytes(script)
+    print(f"hls.js {version} -> {output} (sha256 {hashlib.sha256(script).hexdigest()})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vendor a pinned hls.js into frontend/js.")
+    parser.add_argument("--version", default=HLS_JS_VERSION)
+    args = parser.parse_args()
+    vendor(args.version)
+
+
+if __name__ == "__main__":
+    main()
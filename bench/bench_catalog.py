@@ -0,0 +1,147 @@
+"""Load time, memory and file size of a large shows catalog, stored with a
+full path per episode (as it used to be) and compactly (folder + files),
+what a page of show summaries costs next to the whole /api/shows body,
+and what adding a big season to it costs through the journal compared to
+rewriting the whole file.
+
+Usage: python bench/bench_catalog.py [episodes]
+"""
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from catalog import RecordCatalogFile  # noqa: E402
+from catalog_records import Show, media_id  # noqa: E402
+
+EPISODES_PER_SEASON = 25
+IMPORTED_EPISODES = 5000
+SEASONS_PER_SHOW = 8
+ROOT = "D:\\.New\\otherProjects\\Ground2\\library\\{show} (1998) Season 1-8 S01-S08 (1080p BluRay x265 HEVC 10bit AAC 5.1 FreetheFish)\\Season {season}\\"
+
+
+def make_shows(episodes):
+    shows = []
+    show_count = -(-episodes // (EPISODES_PER_SEASON * SEASONS_PER_SHOW))
+    for s in range(show_count):
+        name = f'Show {s:05d}'
+        seasons = []
+        for n in range(1, SEASONS_PER_SHOW + 1):
+            folder = ROOT.format(show=name, season=n)
+            seasons.append({'id': str(n), 'name': f'Season {n}', 'episodes': [
+                {'filename': f,
+                 'path': folder + f}
+                for f in (f'{name} - S{n:02d}E{e:02d} - Episode Title (1080p BluRay x265).mp4'
+                          for e in range(1, EPISODES_PER_SEASON + 1))
+            ]})
+        shows.append({'id': str(s + 1), 'name': name, 'poster': '', 'seasons': seasons})
+    return shows
+
+
+def legacy_load(path):
+    """What loading the catalog cost before: the whole document as dicts,
+    media IDs set on every episode, and the response body kept alongside"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    for show in data:
+        for season in show['seasons']:
+            for episode in season['episodes']:
+                episode['media_id'] = media_id(episode['path'])
+    body = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return data, body
+
+
+def compact_load(path):
+    catalog = RecordCatalogFile(path, Show)
+    catalog.snapshot()
+    return catalog
+
+
+def measure(name, load, path):
+    gc.collect()
+    began = time.perf_counter()
+    load(path)
+    elapsed = time.perf_counter() - began
+    # Again for memory; tracemalloc would slow the timed run down
+    gc.collect()
+    tracemalloc.start()
+    kept = load(path)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:8s} load {elapsed * 1000:8.1f} ms   kept {current / 2**20:7.1f} MB   '
+          f'peak {peak / 2**20:7.1f} MB   file {os.path.getsize(path) / 2**20:6.1f} MB')
+    return kept
+
+
+def main():
+    episodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    shows = make_shows(episodes)
+    total = sum(len(s['episodes']) for show in shows for s in show['seasons'])
+    print(f'{len(shows)} shows, {total} episodes')
+
+    workdir = tempfile.mkdtemp()
+    legacy_path = os.path.join(workdir, 'legacy.json')
+    compact_path = os.path.join(workdir, 'compact.json')
+    try:
+        with open(legacy_path, 'w') as f:
+            json.dump(shows, f, indent=2)
+        # Written the way the admin app saves it
+        RecordCatalogFile(compact_path, Show).save(shows)
+        del shows
+
+        legacy = measure('legacy', legacy_load, legacy_path)
+        del legacy
+        catalog = measure('compact', compact_load, compact_path)
+
+        for label in ('first', 'again'):
+            # The first one also works out every media ID
+            began = time.perf_counter()
+            body = b''.join(catalog.response().response)
+            print(f'compact  /api/shows body ({label}) {(time.perf_counter() - began) * 1000:.1f} ms, '
+                  f'{len(body) / 2**20:.1f} MB, not kept')
+        began = time.perf_counter()
+        paths = [p for show in catalog.data for p in show.paths()]
+        print(f'compact  {len(paths)} episode paths in {(time.perf_counter() - began) * 1000:.1f} ms')
+
+        began = time.perf_counter()
+        index = catalog.index()
+        print(f'index    {len(index.records)} shows in {(time.perf_counter() - began) * 1000:.1f} ms '
+              f'(once per change)')
+        # The last page, and the last show's seasons, as the UIs ask for them
+        last = index.records[-1]
+        began = time.perf_counter()
+        shows, _ = index.page(f'{len(index.records) - 41}:{index.records[-41].id}', 40)
+        page = json.dumps([s.summary(('id', 'name', 'poster')) for s in shows])
+        seasons = json.dumps(index.get(last.id).summary(('id', 'name', 'seasons')))
+        print(f'pages    40 shows + 1 show\'s seasons {(time.perf_counter() - began) * 1000:.2f} ms, '
+              f'{(len(page) + len(seasons)) / 1024:.1f} KB')
+
+        # A bulk import: one show gets a season of IMPORTED_EPISODES
+        folder = ROOT.format(show='Imported', season=1)
+        show = catalog.get('1')
+        show['seasons'].append({'id': str(SEASONS_PER_SHOW + 1), 'name': 'Imported', 'episodes': [
+            {'filename': f'{e:05d}.mp4', 'path': f'{folder}{e:05d}.mp4'} for e in range(IMPORTED_EPISODES)
+        ]})
+        began = time.perf_counter()
+        with catalog.transaction():
+            catalog.put('1', show)
+        print(f'journal  add {IMPORTED_EPISODES} episodes {(time.perf_counter() - began) * 1000:8.1f} ms   '
+              f'journal {os.path.getsize(catalog.journal.path) / 2**20:.1f} MB')
+        began = time.perf_counter()
+        catalog.save(catalog.load())
+        print(f'rewrite  the whole file     {(time.perf_counter() - began) * 1000:8.1f} ms   '
+              f'(every change, before the journal)')
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main()
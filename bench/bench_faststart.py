@@ -0,0 +1,106 @@
+"""Time-to-first-frame of an mp4 before and after the fast-start rewrite.
+
+Replays the range requests a <video> element makes on startup against
+serve_media: read from the front, jump over mdat to find moov when it isn't
+there, then come back for the first frames. Each request is charged one
+network round trip on top of the transfer time.
+
+Usage: python bench/bench_faststart.py <file.mp4> [rtt_ms] [mbit_per_s]
+"""
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from app import app  # noqa: E402
+from block_cache import block_cache  # noqa: E402
+from faststart import make_faststart  # noqa: E402
+from media_table import media_table  # noqa: E402
+
+WINDOW = 256 * 1024   # bytes a browser typically takes per startup read
+FIRST_FRAMES = 512 * 1024
+
+
+def startup(client, path, rtt, bytes_per_s):
+    # Registered again each time, since the rewrite replaces the file
+    url = '/api/media/' + media_table.register(path)
+    size = os.path.getsize(path)
+    requests = fetched = 0
+    elapsed = 0.0
+
+    def fetch(start, length):
+        nonlocal requests, fetched, elapsed
+        end = min(start + length, size) - 1
+        began = time.perf_counter()
+        data = client.get(url, headers={'Range': f'bytes={start}-{end}'}).data
+        elapsed += time.perf_counter() - began + rtt + len(data) / bytes_per_s
+        requests += 1
+        fetched += len(data)
+        return data
+
+    offset = 0
+    mdat_start = None
+    buffer_start, buffer = 0, fetch(0, WINDOW)
+    while offset < size:
+        if offset + 8 > buffer_start + len(buffer):
+            buffer_start, buffer = offset, fetch(offset, WINDOW)
+        box_size, box_type = struct.unpack('>I4s', buffer[offset - buffer_start:offset - buffer_start + 8])
+        if box_size == 1:
+            extra = buffer[offset - buffer_start + 8:offset - buffer_start + 16]
+            if len(extra) < 8:
+                buffer_start, buffer = offset, fetch(offset, WINDOW)
+                extra = buffer[8:16]
+            box_size = struct.unpack('>Q', extra)[0]
+        if box_type == b'mdat' and mdat_start is None:
+            mdat_start = offset
+        if box_type == b'moov':
+            have = buffer_start + len(buffer) - offset
+            if have < box_size:
+                # The rest of moov streams in on the same connection
+                more = box_size - have
+                elapsed += more / bytes_per_s
+                fetched += more
+            break
+        offset += box_size
+
+    if mdat_start is not None and mdat_start < offset:
+        # moov was at the tail: go back to the start of the media
+        fetch(mdat_start, FIRST_FRAMES)
+    else:
+        elapsed += FIRST_FRAMES / bytes_per_s
+        fetched += FIRST_FRAMES
+    return requests, fetched, elapsed
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    rtt = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.03
+    bytes_per_s = (float(sys.argv[3]) if len(sys.argv) > 3 else 100) * 1e6 / 8
+
+    block_cache.max_bytes = 0
+    client = app.test_client()
+    source = os.path.abspath(sys.argv[1])
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'episode.mp4')
+        shutil.copy(source, path)
+        print(f'{rtt * 1000:.0f} ms RTT, {bytes_per_s * 8 / 1e6:.0f} Mbit/s')
+        for label in ('before', 'after'):
+            if label == 'after':
+                make_faststart(path)
+            requests, fetched, elapsed = startup(client, path, rtt, bytes_per_s)
+            print(f'{label:7s} {requests} requests, {fetched / 2**20:6.2f} MB, '
+                  f'time to first frame ~{elapsed * 1000:.0f} ms')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
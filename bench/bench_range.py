@@ -0,0 +1,153 @@
+"""Compare the old read-it-all range path with the chunked streaming path,
+a player's stream of small range requests with and without the file
+descriptor pool, and 'bytes=0-' from the async server copied through
+Python versus handed to sendfile().
+
+Usage: python bench/bench_range.py [size_mb]
+"""
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+from flask import Flask  # noqa: E402
+from block_cache import block_cache  # noqa: E402
+from catalog_records import media_id  # noqa: E402
+from fd_pool import file_pool  # noqa: E402
+from shaping import shaper  # noqa: E402
+from streaming import send_range  # noqa: E402
+
+app = Flask(__name__)
+
+PORT = 5000
+# The test file isn't in the catalog, so the server registers it first.
+# Run as: python -c BOOT <backend> <file> [serve.py arguments]
+BOOT = (
+    'import sys; sys.path.insert(0, sys.argv[1]); '
+    'from media_table import media_table; media_table.register(sys.argv[2]); '
+    'import serve; sys.argv[1:] = sys.argv[3:]; serve.main()'
+)
+
+
+def legacy(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        chunk = f.read(end - start + 1)
+    yield chunk
+
+
+def streaming(path, start, end, st=None):
+    st = st or os.stat(path)
+    with app.test_request_context(headers={'Range': f'bytes={start}-'}):
+        response = send_range(path, st, start, end, 'video/mp4')
+        try:
+            yield from response.response
+        finally:
+            response.close()
+
+
+def small_ranges(path, size, count=2000, length=256 * 1024):
+    st = os.stat(path)
+    for _ in range(count):
+        start = random.randrange(0, size - length)
+        yield from streaming(path, start, start + length - 1, st)
+
+
+def run(name, body, size):
+    tracemalloc.start()
+    began = time.perf_counter()
+    sent = 0
+    for chunk in body:
+        sent += len(chunk)
+    elapsed = time.perf_counter() - began
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert sent == size, (name, sent, size)
+    print(f'{name:10s} {sent / elapsed / 2**20:9.1f} MB/s   peak {peak / 2**20:8.2f} MB')
+
+
+def over_http(name, path, size, env):
+    """bytes=0- of path from serve.py's async runtime, with env; prints the
+    throughput and the CPU time the server used (startup included)"""
+    server = subprocess.Popen(
+        [sys.executable, '-c', BOOT, str(BACKEND), path,
+         '--runtime', 'async', '--host', '127.0.0.1', '--port', str(PORT)],
+        env=dict(os.environ, SHAPE_CLIENT_MBPS='0', SHAPE_TOTAL_MBPS='0', WATCH_LIBRARY='0', **env),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', PORT), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=30)
+        began = time.perf_counter()
+        conn.request('GET', f'/api/media/{media_id(path)}', headers={'Range': 'bytes=0-'})
+        response = conn.getresponse()
+        sent = 0
+        while True:
+            chunk = response.read(1024 * 1024)
+            if not chunk:
+                break
+            sent += len(chunk)
+        elapsed = time.perf_counter() - began
+        conn.close()
+    finally:
+        server.terminate()
+    _, _, usage = os.wait4(server.pid, 0)
+    assert sent == size, (name, sent, size)
+    print(f'{name:10s} {sent / elapsed / 2**20:9.1f} MB/s   '
+          f'server CPU {usage.ru_utime + usage.ru_stime:5.2f}s')
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    size = size_mb * 2**20
+    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as f:
+        block = os.urandom(2**20)
+        for _ in range(size_mb):
+            f.write(block)
+        path = f.name
+
+    # Throughput of the server itself, not of the bandwidth caps
+    shaper.client_rate = 0
+    max_open = file_pool.max_open
+    try:
+        print(f"bytes=0- against a {size_mb} MB file")
+        run('legacy', legacy(path, 0, size - 1), size)
+        block_cache.max_bytes = 0
+        run('streaming', streaming(path, 0, size - 1), size)
+        block_cache.max_bytes = 64 * 2**20
+        run('cold cache', streaming(path, 0, size - 1), size)
+        run('warm cache', streaming(path, size - 32 * 2**20, size - 1), 32 * 2**20)
+
+        print('2000 requests of 256 KB at random offsets, block cache off')
+        block_cache.max_bytes = 0
+        file_pool.max_open = 0
+        run('open each', small_ranges(path, size), 2000 * 256 * 1024)
+        file_pool.max_open = max_open
+        run('fd pool', small_ranges(path, size), 2000 * 256 * 1024)
+        print(f"  pool hit rate {file_pool.stats()['hit_rate']}")
+
+        if hasattr(os, 'wait4'):
+            print('bytes=0- over HTTP from the async server')
+            over_http('chunked', path, size, {})
+            # Nothing to share or pace, so the range goes to sendfile()
+            over_http('sendfile', path, size, {'BLOCK_CACHE_MB': '0'})
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
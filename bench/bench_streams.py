@@ -0,0 +1,176 @@
+"""Concurrent viewers against the Flask dev server and against serve.py.
+
+Each client opens a connection, asks for a range from a random offset and
+reads it at a video's bitrate for the length of the run. A stream counts as
+sustained if it kept up with that bitrate the whole time.
+
+Usage: python bench/bench_streams.py [clients ...] [--seconds N] [--mbps N]
+"""
+import argparse
+import http.client
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+
+from catalog_records import media_id  # noqa: E402
+
+PORT = 5000
+FILE_MB = 256
+CHUNK = 64 * 1024
+
+# The test file isn't in the catalog, so each server registers it first.
+# Run as: python -c BOOT <backend> <file> [serve.py arguments]
+BOOT = (
+    'import sys; sys.path.insert(0, sys.argv[1]); '
+    'from media_table import media_table; media_table.register(sys.argv[2]); '
+    'import serve; sys.argv[1:] = sys.argv[3:]; serve.main()'
+)
+# The dev server exactly as app.py starts it, minus the reloader
+DEV_SERVER = (
+    'import sys; sys.path.insert(0, sys.argv[1]); '
+    'from media_table import media_table; media_table.register(sys.argv[2]); '
+    f"from app import app; app.run(host='127.0.0.1', port={PORT}, threaded=True)"
+)
+SERVE_ARGS = ['--host', '127.0.0.1', '--port', str(PORT)]
+SERVERS = {
+    'dev': ['-c', DEV_SERVER],
+    'async': ['-c', BOOT, '--runtime', 'async'] + SERVE_ARGS,
+    'waitress': ['-c', BOOT, '--runtime', 'waitress'] + SERVE_ARGS,
+    'gunicorn': ['-c', BOOT, '--runtime', 'gunicorn', '--workers', '2', '--threads', '128'] + SERVE_ARGS,
+}
+
+
+def viewer(url, size, rate, seconds, results):
+    """Read url from a random offset at rate bytes/s for seconds"""
+    start = random.randrange(0, size - int(rate * seconds) - 1)
+    began = time.perf_counter()
+    ttfb = None
+    received = 0
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=30)
+        conn.request('GET', url, headers={'Range': f'bytes={start}-'})
+        response = conn.getresponse()
+        if response.status != 206:
+            raise OSError(f'HTTP {response.status}')
+        while True:
+            chunk = response.read(CHUNK)
+            if not chunk:
+                break
+            now = time.perf_counter()
+            if ttfb is None:
+                ttfb = now - began
+                began = now
+            received += len(chunk)
+            elapsed = now - began
+            if elapsed >= seconds:
+                break
+            # Read no faster than a player would
+            ahead = received / rate - elapsed
+            if ahead > 0:
+                time.sleep(ahead)
+        conn.close()
+    except OSError as e:
+        results.append((None, 0.0, str(e)))
+        return
+    elapsed = max(time.perf_counter() - began, 1e-6)
+    results.append((ttfb, received / rate / elapsed, None))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float('nan')
+
+
+def run(clients, size, url, rate, seconds):
+    results = []
+    threads = [
+        threading.Thread(target=viewer, args=(url, size, rate, seconds, results))
+        for _ in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+        # Viewers arrive over a second, not all in one instant
+        time.sleep(1 / clients)
+    for thread in threads:
+        thread.join()
+
+    ttfbs = [ttfb for ttfb, _, error in results if error is None]
+    sustained = sum(1 for _, pace, error in results if error is None and pace >= 0.95)
+    errors = sum(1 for _, _, error in results if error is not None)
+    print(
+        f'  {clients:4d} clients: {sustained:4d} sustained, {errors:4d} failed, '
+        f'ttfb p50 {percentile(ttfbs, 0.5) * 1000:7.1f} ms  p95 {percentile(ttfbs, 0.95) * 1000:7.1f} ms'
+    )
+
+
+def wait_for_port(proc):
+    for _ in range(100):
+        if proc.poll() is not None:
+            raise RuntimeError('server exited')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=1)
+            conn.request('GET', '/api/channels')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('clients', nargs='*', type=int, default=[25, 50, 100, 200])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--mbps', type=float, default=8, help='Bitrate of each stream')
+    parser.add_argument('--servers', default='dev,async,waitress,gunicorn')
+    args = parser.parse_args()
+    rate = args.mbps * 1e6 / 8
+
+    workdir = tempfile.mkdtemp()
+    # Not a video extension, so it is served as it is without a conversion
+    # check
+    path = os.path.join(workdir, 'stream.ts')
+    url = f'/api/media/{media_id(path)}'
+    size = FILE_MB * 2**20
+    with open(path, 'wb') as f:
+        block = os.urandom(2**20)
+        for _ in range(FILE_MB):
+            f.write(block)
+
+    try:
+        for server in args.servers.split(','):
+            if server == 'gunicorn' and os.name == 'nt':
+                continue
+            print(f'{server}:')
+            command = [sys.executable] + SERVERS[server]
+            # Backend and file go right after the -c script
+            command[3:3] = [str(BACKEND), path]
+            proc = subprocess.Popen(
+                command, cwd=workdir,
+                # Every viewer here is 127.0.0.1, i.e. one client to the shaper
+                env=dict(os.environ, SHAPE_CLIENT_MBPS='0'),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                wait_for_port(proc)
+                for clients in args.clients:
+                    run(clients, size, url, rate, args.seconds)
+            finally:
+                proc.terminate()
+                proc.wait()
+    finally:
+        os.remove(path)
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,9 @@ const app = {
     currentView: 'menu',
     currentChannel: null,
     currentSeason: null,
+    showsCursor: null,
+    showsRequest: 0,
+    showsObserver: null,
     channelPlayer: null,
     vodPlayer: null,
     autoplayNextEpisode: true,
@@ -19,9 +22,22 @@ const app = {
 
         this.showView('menu');
         this.attachEventListeners();
+        this.subscribeToEvents();
         console.log('App initialized');
     },
 
+    // Catalog changes are pushed by the server; refresh whichever list is open
+    subscribeToEvents() {
+        const events = new EventSource(`${this.apiUrl}/events`);
+        const refresh = () => {
+            if (this.currentView === 'channels-view') this.loadChannels();
+            if (this.currentView === 'shows-view') this.loadShows();
+        };
+        events.addEventListener('channels', refresh);
+        events.addEventListener('shows', refresh);
+        events.addEventListener('reset', refresh);
+    },
+
     // View Management
     showView(viewName) {
         // 🔑 Exit fullscreen only when leaving players
@@ -37,6 +53,8 @@ const app = {
         // Stop any playing videos when switching views
         document.querySelectorAll('video').forEach(v => {
             v.pause();
+            v.onerror = null;
+            this.stopHls(v);
             v.removeAttribute('src');
             v.load();
         });
@@ -84,11 +102,30 @@ const app = {
 
     async goToVOD() {
         this.showView('shows-view');
-        const res = await fetch(`${this.apiUrl}/shows`);
+        await this.loadShows();
+    },
+
+    // Shows come a page at a time, just what the cards need; the next
+    // page is fetched once the end of the grid is about to scroll into view
+    async loadShows() {
+        this.showsCursor = null;
+        document.getElementById('shows-grid').innerHTML = '';
+        await this.loadMoreShows();
+    },
+
+    async loadMoreShows() {
+        const request = ++this.showsRequest;
+        const params = new URLSearchParams({ fields: 'id,name,poster', limit: 40 });
+        if (this.showsCursor) params.set('cursor', this.showsCursor);
+
+        const res = await fetch(`${this.apiUrl}/shows?${params}`);
         if (!res.ok) throw new Error('Failed to load shows');
-        const text = await res.text();
-        const shows = JSON.parse(text);
-        this.renderShows(shows);
+        const page = await res.json();
+        // The list was reloaded while this page was on its way
+        if (request !== this.showsRequest) return;
+
+        this.showsCursor = page.next_cursor;
+        this.renderShows(page.shows);
     },
 
     nextVODEpisode() {
@@ -123,7 +160,6 @@ const app = {
 
     renderShows(shows) {
         const grid = document.getElementById('shows-grid');
-        grid.innerHTML = '';
 
         shows.forEach(show => {
             const card = document.createElement('div');
@@ -136,11 +172,28 @@ const app = {
 
             grid.appendChild(card);
         });
+
+        if (this.showsObserver) this.showsObserver.disconnect();
+        const last = grid.lastElementChild;
+        if (this.showsCursor && last) {
+            this.showsObserver = new IntersectionObserver(entries => {
+                if (!entries[0].isIntersecting) return;
+                this.showsObserver.disconnect();
+                this.loadMoreShows();
+            }, { rootMargin: '400px' });
+            this.showsObserver.observe(last);
+        }
     },
     
-    selectShow(show) {
-        this.currentShow = show;
-        this.renderSeasons(show.seasons);
+    // Seasons without their episodes; a season's come when it is opened
+    async selectShow(show) {
+        const res = await fetch(`${this.apiUrl}/shows/${show.id}?fields=id,name,seasons`);
+        if (!res.ok) {
+            console.error(`Error loading show ${show.id}: ${res.status}`);
+            return;
+        }
+        this.currentShow = await res.json();
+        this.renderSeasons(this.currentShow.seasons);
         this.showView('vod-view');
     },
 
@@ -205,13 +258,49 @@ const app = {
             card.className = 'season-card';
             card.innerHTML = `
                 <h3>🎬 ${season.name}</h3>
-                <p>${season.episodes.length} episodes</p>
+                <p>${season.episode_count} episodes</p>
             `;
             card.onclick = () => this.selectSeason(season);
             container.appendChild(card);
         });
     },
 
+    // Play a file straight off the disk; if the browser can't decode it
+    // (HEVC, 10-bit, AC3 in MKV...) switch to the server's HLS version,
+    // which is stream-copied or transcoded segment by segment
+    setVideoSource(video, episode) {
+        const id = episode.media_id;
+        this.stopHls(video);
+        video.dataset.mediaId = id;
+
+        video.onerror = () => {
+            const code = video.error && video.error.code;
+            if (code !== MediaError.MEDIA_ERR_DECODE &&
+                code !== MediaError.MEDIA_ERR_SRC_NOT_SUPPORTED) return;
+            if (video.dataset.hls === id) return;
+            video.dataset.hls = id;
+
+            const playlist = `${this.apiUrl}/media/${id}/hls/index.m3u8`;
+            if (window.Hls && Hls.isSupported()) {
+                video._hls = new Hls();
+                video._hls.loadSource(playlist);
+                video._hls.attachMedia(video);
+            } else if (video.canPlayType('application/vnd.apple.mpegurl')) {
+                video.src = playlist;
+            }
+        };
+
+        video.src = `${this.apiUrl}/media/${id}`;
+    },
+
+    stopHls(video) {
+        if (video._hls) {
+            video._hls.destroy();
+            video._hls = null;
+        }
+        delete video.dataset.hls;
+    },
+
     setSubtitle(lang) {
         const video =
             this.currentView === 'channel-player'
@@ -230,21 +319,12 @@ const app = {
 
         if (!lang) return;
 
-        const videoApiSrc = video.currentSrc || video.src;
-        if (!videoApiSrc.includes('/api/video/')) return;
+        // The episode's own ID; with HLS the src is a playlist (or blob)
+        const id = video.dataset.mediaId;
+        if (!id || (lang !== 'he' && lang !== 'en')) return;
 
-        const encodedPath = videoApiSrc.split('/api/video/')[1];
-        const filePath = decodeURIComponent(encodedPath);
-        const basePath = filePath.replace(/\.(mp4|mkv|webm)$/i, '');
-
-        const subtitlePath =
-            lang === 'he' ? `${basePath}.vtt`
-            : lang === 'en' ? `${basePath}.en.vtt`
-            : null;
-
-        if (!subtitlePath) return;
-
-        const subtitleApiUrl = `/api/video/${encodeURIComponent(subtitlePath)}`;
+        // The server finds the .vtt / .en.vtt next to the episode
+        const subtitleApiUrl = `/api/media/${id}/subtitles/${lang}`;
 
         // 3️⃣ Create new track
         const track = document.createElement('track');
@@ -266,9 +346,16 @@ const app = {
     },
 
     async selectSeason(season) {
-        this.currentSeason = season;
+        const res = await fetch(
+            `${this.apiUrl}/shows/${this.currentShow.id}/seasons/${season.id}/episodes`
+        );
+        if (!res.ok) {
+            console.error(`Error loading episodes of season ${season.id}: ${res.status}`);
+            return;
+        }
+        this.currentSeason = { ...season, episodes: await res.json() };
         document.getElementById('season-title').textContent = season.name;
-        this.renderEpisodes(season.episodes);
+        this.renderEpisodes(this.currentSeason.episodes);
         this.showView('vod-episodes');
     },
 
@@ -315,10 +402,9 @@ const app = {
         this.showView('vod-player');
 
         const video = document.getElementById('vod-video');
-        const videoPath = episode.path.replace(/\\/g, '__SLASH__');
 
         video.pause();
-        video.src = `${this.apiUrl}/video/${videoPath}`;
+        this.setVideoSource(video, episode);
 
         video.removeEventListener('ended', this._vodEndedHandler);
         video.removeEventListener('seeking', this._vodSeekingHandler);
@@ -493,46 +579,60 @@ class ChannelPlayer {
 
     async initialize() {
         try {
-            // Load episodes from channel folder
-            const response = await fetch(`${app.apiUrl}/channels/${this.channel.id}/episodes`);
-            this.episodes = await response.json();
-
-            if (this.episodes.length === 0) {
+            // Ask the server what is on now; it knows the real episode
+            // lengths, so every client lands on the same frame
+            const response = await fetch(`${app.apiUrl}/channels/${this.channel.id}/now`);
+            if (!response.ok) {
                 this.episodeInfo.textContent = 'No videos found';
                 return;
             }
+            const now = await response.json();
+            this.liveFetchedAt = Date.now();
+
+            this.episodes = new Array(now.count);
+            this.episodes[now.index] = now.episode;
 
             this.video.onended = () => {
                 this.manualOverride = false;
                 this.nextEpisode();
             };
 
-            // Start from middle episode
             this.manualOverride = false;
-            const live = this.getLivePosition();
-            this.currentIndex = live.index;
-            this.liveStartTime = live.time;
+            this.currentIndex = now.index;
+            this.liveStartTime = now.offset;
             this.playCurrentEpisode();
+
+            // The full list is only needed for next/previous
+            this.loadEpisodes();
         } catch (error) {
             console.error('Error initializing channel player:', error);
         }
     }
 
+    async loadEpisodes() {
+        const response = await fetch(`${app.apiUrl}/channels/${this.channel.id}/episodes`);
+        if (!response.ok) return;
+        this.episodes = await response.json();
+        this.updateEpisodeInfo();
+    }
+
     playCurrentEpisode() {
         if (this.episodes.length === 0) return;
 
         const episode = this.episodes[this.currentIndex];
+        if (!episode) return;
         const video = this.video;
 
         video.pause();
-        video.src = "/api/video/" + encodeURIComponent(episode.path);
-        video.load();
+        app.setVideoSource(video, episode);
 
         video.onloadedmetadata = () => {
-            // "Live TV" feel: start in the middle
+            // "Live TV" feel: join where the schedule says we are,
+            // counting the time it took to load
+            const elapsed = (Date.now() - this.liveFetchedAt) / 1000;
             const startTime = this.manualOverride
                 ? 0
-                : Math.min(this.liveStartTime || 0, video.duration - 1);
+                : Math.min((this.liveStartTime || 0) + elapsed, video.duration - 1);
 
             video.currentTime = startTime;
             video.play();
@@ -554,31 +654,9 @@ class ChannelPlayer {
         this.updateEpisodeInfo();
     }
 
-    getLivePosition() {
-        const totalEpisodes = this.episodes.length;
-        if (totalEpisodes === 0) return { index: 0, time: 0 };
-
-        // Total duration of one full loop (estimate: use metadata later if you want)
-        const EST_EPISODE_LENGTH = 22 * 60; // 22 minutes (safe default)
-        const loopDuration = totalEpisodes * EST_EPISODE_LENGTH;
-
-        // Use real time as the clock
-        const now = Math.floor(Date.now() / 1000);
-        const positionInLoop = now % loopDuration;
-
-        const episodeIndex = Math.floor(positionInLoop / EST_EPISODE_LENGTH);
-        const timeInEpisode = positionInLoop % EST_EPISODE_LENGTH;
-
-        return {
-            index: episodeIndex,
-            time: timeInEpisode
-        };
-    }
-
-
-
     updateEpisodeInfo() {
         const episode = this.episodes[this.currentIndex];
+        if (!episode) return;
         const total = this.episodes.length;
         this.episodeInfo.textContent = `${episode.filename} (${this.currentIndex + 1}/${total})`;
     }
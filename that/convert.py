@@ -1,18 +1,178 @@
 import argparse
+import json
 import os
-import subprocess
 import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from media_probe import probe, ProbeError  # noqa: E402
+import transcode  # noqa: E402
+from transcode import CRF, PRESET, MODES  # noqa: E402
+
+# The server now converts incompatible files itself the first time they are
+# played (backend/transcode.py); this is for converting a library in bulk.
+
 # ===== CONFIG =====
 OUTPUT_DIR = "output"
-CRF = 20
-PRESET = "veryfast"
-AUDIO_BITRATE = "192k"
 EXTENSIONS = (".mkv", ".avi", ".mov", ".wmv", ".flv", ".webm")
+JOURNAL_NAME = ".convert_journal.jsonl"
+THREADS_PER_JOB = 4
+PROGRESS_INTERVAL = 15  # seconds between progress lines for a running job
 # ==================
 
+print_lock = threading.Lock()
+
+
+def log(message):
+    with print_lock:
+        print(message, flush=True)
+
+
+class Journal:
+    """Append-only record of job state, so a crash can be resumed.
+
+    A job only counts as done once its output was renamed into place and a
+    'done' line was synced to disk; anything that was still 'running' when
+    we died is simply converted again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        self._lock = threading.Lock()
+
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-append
+                        continue
+                    self.state[entry["input"]] = entry
+
+    def record(self, input_path, status, **fields):
+        entry = {"input": str(input_path), "status": status, "time": time.time(), **fields}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.state[entry["input"]] = entry
+
+    def is_done(self, input_path):
+        entry = self.state.get(str(input_path))
+        return entry is not None and entry["status"] == "done"
+
+
+def find_jobs(process_dir, base_rel, output_root):
+    """(input, output) pairs for every convertible file under process_dir"""
+    jobs = []
+    for dirpath, _, filenames in os.walk(process_dir):
+        current_dir = Path(dirpath)
+        rel_dir = current_dir.relative_to(process_dir)
+        out_dir = output_root / base_rel / rel_dir
+
+        for filename in sorted(filenames):
+            if filename.lower().endswith(EXTENSIONS):
+                jobs.append((current_dir / filename, out_dir / (Path(filename).stem + ".mp4")))
+    return jobs
+
+
+def choose_mode(input_path):
+    """(mode, probe info) for input_path; see transcode.choose_mode"""
+    try:
+        info = probe(input_path)
+    except (OSError, ProbeError):
+        info = None
+    return transcode.choose_mode(info), info
+
+
+def build_command(input_path, tmp_path, args, mode):
+    return transcode.build_command(input_path, tmp_path, mode, args.preset, args.crf, args.threads)
+
+
+def run_ffmpeg(cmd, name):
+    """Run ffmpeg, logging its progress now and then.
+
+    Returns (success, seconds of media written, last lines of ffmpeg output).
+    """
+    last_report = [time.monotonic()]
+
+    def on_progress(out_time, speed):
+        if time.monotonic() - last_report[0] >= PROGRESS_INTERVAL:
+            last_report[0] = time.monotonic()
+            log(f"  ... {name}: {int(out_time // 60)}:{int(out_time % 60):02d} encoded @ {speed}")
+
+    return transcode.run_ffmpeg(cmd, on_progress)
+
+
+def convert(job, journal, args, counter):
+    input_path, output_path = job
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Written under a temp name and renamed when complete, so a crash can
+    # never leave a truncated .mp4 that looks finished
+    tmp_path = output_path.with_name(output_path.name + ".part")
+
+    mode, _ = ("encode", None) if args.always_encode else choose_mode(input_path)
+
+    with counter["lock"]:
+        counter["started"] += 1
+        number = counter["started"]
+    log(f"CONVERT [{number}/{counter['total']}] ({mode}): {input_path} → {output_path}")
+
+    journal.record(input_path, "running", output=str(output_path), mode=mode)
+    started = time.monotonic()
+    cmd = build_command(input_path, tmp_path, args, mode)
+    ok, media_seconds, tail = run_ffmpeg(cmd, input_path.name)
+    elapsed = max(time.monotonic() - started, 1e-3)
+
+    if not ok:
+        tmp_path.unlink(missing_ok=True)
+        journal.record(input_path, "failed", output=str(output_path), mode=mode, error="\n".join(tail))
+        log(f"FAILED: Conversion failed for {input_path}")
+        for line in tail:
+            log(f"    {line}")
+        return "failed", mode, 0, 0, elapsed
+
+    os.replace(tmp_path, output_path)
+    input_size = input_path.stat().st_size
+    journal.record(
+        input_path, "done", output=str(output_path), mode=mode,
+        seconds=round(elapsed, 1), media_seconds=round(media_seconds, 1)
+    )
+    log(
+        f"DONE ({mode}): {output_path.name} in {elapsed:.0f}s "
+        f"({input_size / elapsed / 2**20:.1f} MB/s, {media_seconds / elapsed:.1f}x realtime)"
+    )
+
+    if input_path.suffix.lower() == '.mkv':
+        os.remove(str(input_path))
+        log(f"DELETED original MKV: {input_path}")
+    return "done", mode, input_size, media_seconds, elapsed
+
+
+def run_job(job, journal, args, counter):
+    """convert(), but an error on one file (unreadable, disk full, ...) is
+    recorded as that file failing instead of ending the whole run"""
+    input_path, output_path = job
+    started = time.monotonic()
+    try:
+        return convert(job, journal, args, counter)
+    except Exception as e:
+        output_path.with_name(output_path.name + ".part").unlink(missing_ok=True)
+        journal.record(input_path, "failed", output=str(output_path), error=str(e))
+        log(f"FAILED: {input_path}: {e}")
+        return "failed", None, 0, 0, time.monotonic() - started
+
+
 def main():
+    cores = os.cpu_count() or 1
     parser = argparse.ArgumentParser(
         description="Convert video files (mkv, avi, etc.) to MP4 using ffmpeg, recursively."
     )
@@ -22,8 +182,24 @@ def main():
         default=None,
         help="Optional specific folder to process recursively. If omitted, processes the current directory and all subfolders."
     )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="Files to convert at once (default: cores / threads per job)"
+    )
+    parser.add_argument(
+        "-t", "--threads", type=int, default=THREADS_PER_JOB,
+        help=f"Threads each ffmpeg may use (default: {THREADS_PER_JOB})"
+    )
+    parser.add_argument("--preset", default=PRESET, help=f"x264 preset (default: {PRESET})")
+    parser.add_argument("--crf", type=int, default=CRF, help=f"x264 CRF (default: {CRF})")
+    parser.add_argument(
+        "--always-encode", action="store_true",
+        help="Re-encode video even when the source could just be remuxed"
+    )
     args = parser.parse_args()
 
+    jobs_at_once = args.jobs or max(1, cores // max(1, args.threads))
+
     start_dir = Path.cwd()
     output_root = start_dir / OUTPUT_DIR
     output_root.mkdir(exist_ok=True)
@@ -50,43 +226,42 @@ def main():
         print("Error: The specified folder must be the current directory or a subdirectory.")
         return
 
-    # Walk through the directory and convert files
-    for dirpath, _, filenames in os.walk(process_dir):
-        current_dir = Path(dirpath)
-        rel_dir = current_dir.relative_to(process_dir)
-        full_rel_dir = base_rel / rel_dir
+    journal = Journal(output_root / JOURNAL_NAME)
 
-        out_dir = output_root / full_rel_dir
-        out_dir.mkdir(parents=True, exist_ok=True)
+    pending = []
+    for input_path, output_path in find_jobs(process_dir, base_rel, output_root):
+        if journal.is_done(input_path) or (
+            output_path.exists() and str(input_path) not in journal.state
+        ):
+            # Finished in an earlier run (or by a version of this script
+            # that predates the journal)
+            print(f"SKIP: {input_path}")
+        else:
+            pending.append((input_path, output_path))
 
-        for filename in filenames:
-            if filename.lower().endswith(EXTENSIONS):
-                input_path = current_dir / filename
-                output_path = out_dir / (Path(filename).stem + ".mp4")
-
-                if output_path.exists():
-                    print(f"SKIP: {input_path}")
-                else:
-                    print(f"CONVERT: {input_path} → {output_path}")
-
-                    ffmpeg_cmd = [
-                        "ffmpeg", "-y", "-i", str(input_path),
-                        "-map", "0:v:0", "-map", "0:a?",
-                        "-c:v", "libx264", "-pix_fmt", "yuv420p",
-                        "-preset", PRESET, "-crf", str(CRF),
-                        "-c:a", "aac", "-b:a", AUDIO_BITRATE,
-                        str(output_path)
-                    ]
+    print(f"\n{len(pending)} files to convert, {jobs_at_once} at a time, {args.threads} threads each\n")
 
-                    try:
-                        subprocess.run(ffmpeg_cmd, check=True)
-                        if input_path.suffix.lower() == '.mkv':
-                            os.remove(str(input_path))
-                            print(f"DELETED original MKV: {input_path}")
-                    except subprocess.CalledProcessError:
-                        print(f"FAILED: Conversion failed for {input_path}")
+    counter = {"lock": threading.Lock(), "started": 0, "total": len(pending)}
+    started = time.monotonic()
+    with ThreadPoolExecutor(jobs_at_once) as pool:
+        results = list(pool.map(lambda job: run_job(job, journal, args, counter), pending))
+    elapsed = time.monotonic() - started
 
-    print("\nDONE!")
+    done = [r for r in results if r[0] == "done"]
+    failed = len(results) - len(done)
+    total_bytes = sum(r[2] for r in done)
+    total_media = sum(r[3] for r in done)
+    print(f"\nDONE! {len(done)} converted, {failed} failed in {elapsed:.0f}s")
+    for mode in MODES:
+        by_mode = [r for r in results if r[1] == mode]
+        if by_mode:
+            ok = [r for r in by_mode if r[0] == "done"]
+            media = sum(r[3] for r in ok)
+            busy = sum(r[4] for r in ok)
+            speed = f", {media / busy:.1f}x realtime" if busy else ""
+            print(f"  {mode:7s} {len(ok)} done, {len(by_mode) - len(ok)} failed{speed}")
+    if done and elapsed:
+        print(f"Throughput: {total_bytes / elapsed / 2**20:.1f} MB/s, {total_media / elapsed:.1f}x realtime")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()